@@ -1,22 +1,33 @@
 import csv
-from sklearn.cluster import MiniBatchKMeans
-import matplotlib
-matplotlib.use('TkAgg')
-import matplotlib.pyplot as plt
+import sys
 import pickle
 import numpy as np
-import sklearn.metrics as metrics
-from yellowbrick.cluster import InterclusterDistance
-from scipy.optimize import curve_fit
-import umap.umap_ as umap
 from colorsys import hls_to_rgb
-from pylab import *
 from datetime import datetime
 import os
 import argparse
-import scipy.stats as scist
-from docx import Document
-from feature_extraction import LemmaStemmerTokenizer
+from results_writer import write_assignments, select_representatives, write_supp_info
+from run_artifact import save_run, ClusterRun
+from award_table import load_awards
+from near_duplicates import load_groups
+from lsa import load_features, is_lsa, project, term_weights, EMBEDDING_FILE
+from spherical_kmeans import SphericalKMeans
+import perf
+
+# Heavy libraries (sklearn, scipy, umap, yellowbrick, matplotlib) are imported inside the functions that use them,
+# so that importing this module stays fast. The vectorizer pickle imports feature_extraction when it is loaded.
+
+def pyplot():
+    """
+    matplotlib.pyplot with the headless Agg backend (figures are only saved to files)
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+# Two-sided 95% quantile of the standard normal, scipy.stats.norm.ppf(0.975) (importing scipy.stats takes ~0.4s)
+Z_95 = 1.959963984540054
 
 # Allow for larger CSV files
 maxInt = sys.maxsize
@@ -29,18 +40,22 @@ while True:
     except OverflowError:
         maxInt = int(maxInt/10)
 
-def get_clusters(selected_k, data_file, processed_file, centers, years, save_folder="", save=True):
+# Fiscal years used for training (2021 awards are held out as test data)
+YEARS = [str(i) for i in range(1985,2021)]
+
+def get_clusters(selected_k, data_file, processed_file, centers, years, save_folder="", save=True, engine="minibatch"):
     """
 
     Parameters
     ----------
     selected_k : selected number of clusters
-    data_file : pickle with raw data as list of dictionaries
-    processed_file : pickle with transformed data as array
+    data_file : pickle with raw data as an AwardTable
+    processed_file : pickle with transformed data as array, or the LSA embedding (lsa.EMBEDDING_FILE)
     centers : array. initial centroids from LDA. Can be initialized as 'k-means++'
     years : list of strings. years for intracluster analysis
     save_folder : string. directory to save result, the default is "".
     save : boolean
+    engine : string. "minibatch" (MiniBatchKMeans, euclidean silhouettes) or "spherical" (SphericalKMeans, cosine silhouettes)
 
     Returns
     -------
@@ -48,78 +63,61 @@ def get_clusters(selected_k, data_file, processed_file, centers, years, save_fol
         "yr_avg_cost": List of lists. Average funding by year for each cluster.
         "yr_total_cost": List of lists. Total funding by year for each cluster.
         "size": List. Size of each cluster.
-        "data_by_cluster": List of lists of dictionaries. Points in each cluster: [ [{Cluster1pt1}, {Cluster1pt2},...], [{Cluster2pt1}, {Cluster2pt2},...], ...]
         "centroids": 10 x K array of cluster centroids,
         "score": List. Silhouette score by cluster
-        "model": MiniBatchKMeans model
+        "model": MiniBatchKMeans or SphericalKMeans model
         "labels": Cluster labels of data points (ordered)
+        "sample_scores": Silhouette score of data points (ordered)
+
+    When the features are near-duplicate group representatives (data/groups.npz), k-means is weighted by
+    group size and every award takes the label and silhouette score of its representative.
 
     """
-    # Load data as list of dictionaries
-    data = pickle.load(open(data_file,"rb"))
+    from sklearn.cluster import MiniBatchKMeans
+    import sklearn.metrics as metrics
+
+    # Load data as an award table
+    data = load_awards(data_file)
 
     # Transformed data
-    X_transformed = pickle.load(open(processed_file,"rb"))
+    X_transformed = load_features(processed_file)
 
-    # Perform mini batch k means
-    km = MiniBatchKMeans(n_clusters=selected_k, init=centers, verbose=0, max_no_improvement=None)
-    clusters = km.fit_predict(X_transformed)
-    scores = metrics.silhouette_samples(X_transformed, clusters)
+    groups = load_groups()
 
-    # Output data
-    cluster_all = []
-    costs = []
-    yoy = []
-    size = []
-    mechanisms = []
-    for i in range(6): # initialization
-        mechanisms.append([])
+    # Perform mini batch k means, or spherical k means on the unit length rows
+    if engine == "spherical":
+        km = SphericalKMeans(n_clusters=selected_k, init=centers)
+        metric = "cosine"
+    else:
+        km = MiniBatchKMeans(n_clusters=selected_k, init=centers, verbose=0, max_no_improvement=None)
+        metric = "euclidean"
+    with perf.timer("kmeans"):
+        clusters = km.fit_predict(X_transformed, sample_weight=None if groups is None else groups["weights"])
+    with perf.timer("silhouette"):
+        scores = metrics.silhouette_samples(X_transformed, clusters, metric=metric)
+    if groups is not None:
+        clusters = clusters[groups["group"]]
+        scores = scores[groups["group"]]
+
+    # Output data, aggregated by cluster in one pass over the awards
     MECH_NAMES = "R01", "U01", "R44", "U24", "R21", "U54"
-
-    for i in range(0,selected_k):
-
-        # indices of cluster k
-        cluster = [idx for idx, element in enumerate(clusters) if element == i]
-
-        # get points
-        cluster_data = [data[ind] for ind in cluster]
-        cluster_scores = [scores[ind] for ind in cluster]
-        for i in range(len(cluster_data)):
-            cluster_data[i]["score"] = cluster_scores[i]
-        cluster_all.append(cluster_data)
-
-        # calculate average cost and std
-        try:
-            average_cost = sum([item["award_amount"] for item in cluster_data])/len(cluster_data)
-        except:
-            average_cost = 0
-        costs.append(average_cost)
-
-        cost_trend = []
-        for year in years:
-            year_data = [data[ind]["award_amount"] for ind in cluster if data[ind]["year"] == year]
-            if len(year_data) == 0:
-                cost_trend.append(0)
-            else:
-                year_cost = sum(year_data) # /len(year_data)
-                cost_trend.append(year_cost)
-
-        yoy.append(cost_trend)
-
-        size.append(len(cluster))
-
-        # get number of awards per mechanism
-        if len(cluster_data) != 0:
-            for j in range(len(mechanisms)):
-                mech = len([ind for ind in cluster if data[ind]["mechanism"] == MECH_NAMES[j]])/len(cluster_data)
-                mechanisms[j].append(mech)
-        else:
-            for j in range(len(mechanisms)):
-                mechanisms[j].append(0)
+    amounts = data.column("award_amount").astype(np.float64)
+    year_index = {year: j for j, year in enumerate(years)}
+    award_years = np.array([year_index.get(year, -1) for year in data.categories("year")], dtype=int)[data.codes("year")]
+    award_mechs = np.array([MECH_NAMES.index(mech) if mech in MECH_NAMES else -1 for mech in data.categories("mechanism")], dtype=int)[data.codes("mechanism")]
+
+    size = np.bincount(clusters, minlength=selected_k)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        costs = np.nan_to_num(np.bincount(clusters, weights=amounts, minlength=selected_k)/size)
+        in_years = award_years >= 0
+        yoy = np.bincount(clusters[in_years]*len(years) + award_years[in_years], weights=amounts[in_years], minlength=selected_k*len(years)).reshape(selected_k, len(years))
+        mechanisms = []
+        for j in range(len(MECH_NAMES)):
+            mechanisms.append(list(np.nan_to_num(np.bincount(clusters[award_mechs == j], minlength=selected_k)/size)))
 
     # Get centroids
     # Identify the top terms for each cluster, using the TF-IDF terms with the highest values in the centroid
-    order_centroids = km.cluster_centers_.argsort()[:, ::-1]
+    order_centroids = term_weights(km.cluster_centers_, processed_file).argsort()[:, ::-1]
     vectorizer = pickle.load(open("data/vectorizer.pkl","rb"))
     terms = vectorizer.get_feature_names_out()
     centroids = []
@@ -139,32 +137,34 @@ def get_clusters(selected_k, data_file, processed_file, centers, years, save_fol
             centroid_file.write("\n")
         centroid_file.close()
 
-    # get scores
-    score = metrics.silhouette_score(X_transformed, km.labels_)
+    # get scores (the silhouette score is the mean of the sample silhouettes)
+    score = float(np.mean(scores))
 
     output = {
-        "yr_avg_cost": costs, # Average award size by year by cluster
-        "yr_total_cost": yoy, # Total award size by year by cluster
-        "size": size, # Number of awards in each cluster
-        "data_by_cluster": cluster_all,
+        "yr_avg_cost": list(costs), # Average award size by year by cluster
+        "yr_total_cost": yoy.astype(np.int64).tolist(), # Total award size by year by cluster
+        "size": size.tolist(), # Number of awards in each cluster
         "centroids": centroids,
         "score": score, # Silhouette score for
         "model": km, # K-means model
         "labels": clusters, # Ordered list of cluster number labels for each award
+        "sample_scores": scores, # Ordered list of silhouette scores for each award
         "mechanisms": mechanisms # List of lists: [r01, u01, r44, u24, r21, u54]. Each internal list has number of awards per mechanism by cluster
         }
     return output
 
-def umap_visualization(X_transformed, cluster_labels, silhouette_scores, sizes, save_folder=""):
+def umap_visualization(X_transformed, cluster_labels, silhouette_scores, sizes, save_folder="", metric='hellinger'):
     #outlier_scores = sklearn.neighbors.LocalOutlierFactor(contamination=0.1).fit_predict(X_transformed)
     #X_transformed = X_transformed[outlier_scores != -1]
     #cluster_labels = cluster_labels[outlier_scores != -1]
     # product = [silhouette_scores[i]*sizes[i] for i in range(len(sizes))]
-    
+    import umap.umap_ as umap
+    plt = pyplot()
+
     top_clusters = sorted(range(len(silhouette_scores)), key=lambda i: silhouette_scores[i], reverse=True)[:9]
     n_subset = len(cluster_labels)
     selected_cells = np.random.choice(np.arange(X_transformed.shape[0]), size = n_subset, replace = False)
-    mapper = umap.UMAP(metric='hellinger', random_state=42).fit(X_transformed[selected_cells,:])
+    mapper = umap.UMAP(metric=metric, random_state=42).fit(X_transformed[selected_cells,:])
 
     embedding = mapper.transform(X_transformed[selected_cells,:])
 
@@ -178,7 +178,7 @@ def umap_visualization(X_transformed, cluster_labels, silhouette_scores, sizes,
             selected_colors.append('tab:gray')
     
     # Plot Clusters on UMAP
-    plt.figure()
+    plt.figure(figsize=(19.2, 10.8))
     plt.grid(visible=None)
     plt.scatter(embedding[:, 0], embedding[:, 1], cmap='Spectral', s=5, c=selected_colors)
     plt.gca().set_aspect('equal', 'datalim')
@@ -188,36 +188,15 @@ def umap_visualization(X_transformed, cluster_labels, silhouette_scores, sizes,
     plt.xlabel("UMAP 1")
     plt.ylabel("UMAP 2")
 
-    manager = plt.get_current_fig_manager()
-    manager.resize(*manager.window.maxsize())
     plt.savefig('{}/umap.png'.format(save_folder))
 
 def rainbow_color_stops(n=10, end=1, shade=0.9):
     return [ hls_to_rgb(end * i/(n-1)*shade, 0.5*shade, 1*shade) for i in range(n) ]
 
 def get_funding_projections(data):
+    from scipy.optimize import curve_fit
 
-    # 1. Determine dimensions for plot
-    k = len(data["size"])
-    factors = []
-    for i in range(1, k+1):
-        if k / i == i:
-            factors.extend([i,i])
-        elif k % i == 0:
-            factors.append(i)
-    dim1, dim2 = factors[int(len(factors)/2)], factors[int(len(factors)/2-1)]
-
-    # 2. Create plot
-    fig, axs = plt.subplots(dim1, dim2, sharex='all', sharey='all')
-
-    # 3. Create hidden frame for shared labels
-    fig.add_subplot(111, frameon=False)
-    plt.grid(visible=None)
-    plt.tick_params(labelcolor='none', which='both', top=False, bottom=False, left=False, right=False)
-    plt.xlabel("Years from 1985")
-    plt.ylabel("Funding ($100 millions)")
-
-    # 4. Get projections
+    # Get projections
     years_int = list(range(0,36))
     projection = []
     growth = []
@@ -240,79 +219,81 @@ def get_funding_projections(data):
         # growth.append(0)
         # bounds.append([0,0])
 
-    # 5. Return 2021 projections and growth rate
+    # Return 2021 projections and growth rate
     return projection, growth, bounds
 
-def viz_centroids(data):
-    model = data["model"]
-    X_transformed = pickle.load(open("data/processed-data.pkl","rb"))
+def viz_centroids(run):
+    from sklearn.cluster import KMeans
+    from yellowbrick.cluster import InterclusterDistance
+    plt = pyplot()
+    # Refit from the saved centers (a single Lloyd pass from a converged solution)
+    model = KMeans(n_clusters=run.k, init=run.centers, n_init=1)
+    X_transformed = load_features(run.features)
     plt.figure()
     visualizer = InterclusterDistance(model, random_state=0)
     visualizer.fit(X_transformed)     # Fit the data to the visualizer
     visualizer.show()        # Finalize and render the figure
 
-def predict_clusters(test_data, selected_k, model):
-    test_data = pickle.load(open(test_data,"rb"))
-    vectorizer = pickle.load(open("data/vectorizer.pkl","rb"))
-    input_text = [item["text"] for item in test_data]
-    if len(input_text) == 0:
-        return [0 for i in range(0,selected_k)], 0
-    test_transformed = vectorizer.transform(input_text)
-    years = [str(i) for i in range(1985,2021)]
-    labels = model.predict(test_transformed)
+def predict_clusters(test_data, selected_k, model, processed_file="data/processed-data.pkl"):
+    """
 
-    # Output data
-    cluster_all = []
-    costs = []
-    yoy = []
-    size = []
+    Parameters
+    ----------
+    test_data : pickle with the awards to assign (AwardTable)
+    selected_k : number of clusters
+    model : fitted clustering model with a predict method
+    processed_file : features the model was fitted on; TF-IDF of test_data is projected when it is the LSA embedding
 
-    for i in range(0,selected_k):
+    Returns
+    -------
+    cluster_all : list of AwardTables, awards assigned to each cluster
+    size : list of cluster sizes
+    labels : array. cluster label of each award
 
-        # indices of cluster k
-        cluster = [idx for idx, element in enumerate(labels) if element == i]
+    """
+    test_data = load_awards(test_data)
+    vectorizer = pickle.load(open("data/vectorizer.pkl","rb"))
+    if len(test_data) == 0:
+        return [test_data for i in range(0,selected_k)], [0 for i in range(0,selected_k)], np.array([], dtype=int)
+    test_transformed = vectorizer.transform(test_data.column("text"))
+    if is_lsa(processed_file):
+        test_transformed = project(test_transformed)
+    labels = model.predict(test_transformed)
 
-        # get points
-        cluster_data = [test_data[ind] for ind in cluster]
-        cluster_all.append(cluster_data)
+    # Output data
+    cluster_all = [test_data.take(np.flatnonzero(labels == i)) for i in range(0,selected_k)]
+    size = np.bincount(labels, minlength=selected_k).tolist()
 
-        # calculate average cost and std
-        try:
-            average_cost = sum([item["award_amount"] for item in cluster_data])/len(cluster_data)
-        except:
-            average_cost = 0
-        costs.append(average_cost)
+    return cluster_all, size, labels
 
-        cost_trend = []
-        for year in years:
-            year_data = [test_data[ind]["award_amount"] for ind in cluster if test_data[ind]["year"] == year]
-            if len(year_data) == 0:
-                cost_trend.append(0)
-            else:
-                year_cost = sum(year_data)
-                cost_trend.append(year_cost)
+def predict_text(texts, save_folder, exact=False):
+    """
 
-        yoy.append(cost_trend)
+    Parameters
+    ----------
+    texts : list of strings. documents (title, abstract and relevance text) to assign to clusters
+    save_folder : string. results directory with run.json
+    exact : bool. tokenize with nltk through the pickled vectorizer instead of the TF-IDF table saved with it
+        (feature_extraction.TfidfTransform), which starts faster but splits sentences on fewer abbreviations
+        and does not know the inflections missing from the corpus
 
-        size.append(len(cluster))
+    Returns
+    -------
+    labels : array. cluster label of each document
+    centroids : list of lists of top centroid terms by cluster
 
-    return cluster_all, size
+    """
+    from feature_extraction import load_transform
+    run = ClusterRun(save_folder)
+    transform = pickle.load(open("data/vectorizer.pkl","rb")) if exact else load_transform()
+    return run.predict(transform.transform(texts)), run.top_terms
 
-def get_best_cluster(selected_k, num_trials, centers, years, save_folder="", save=True):
+def get_best_cluster(selected_k, num_trials, centers, years, save_folder="", save=True, processed_file="data/processed-data.pkl", engine="minibatch"):
     scores = []
-    results = {}
     print("Optimizing model...")
     for i in range(num_trials):
         # Generate clusters for a selected k
-        data = get_clusters(selected_k, "data/data.pkl", "data/processed-data.pkl", 'k-means++', years, save_folder, save=save)
-        j = 0
-        for thing in data["data_by_cluster"]:
-            for item in thing:
-                try:
-                    results[item["id"]].append(centroids[j])
-                except:
-                    results[item["id"]] = [item["id"],item["title"],item["award_amount"],data["centroids"][j]]
-            j+=1
+        data = get_clusters(selected_k, "data/data.pkl", processed_file, 'k-means++', years, save_folder, save=save, engine=engine)
         print("Trial {}: Score = {:.3f}".format(str(i+1), data["score"]))
         scores.append(data["score"])
         if data["score"] >= max(scores):
@@ -320,12 +301,14 @@ def get_best_cluster(selected_k, num_trials, centers, years, save_folder="", sav
 
     return chosen, scores
 
-def get_citations(clusters):
+def get_citations(labels, project_numbers, k):
     """
 
     Parameters
     ----------
-    clusters : nested lists of dictionaries representing each award in a cluster.
+    labels : cluster label of each award
+    project_numbers : core project number of each award (e.g. the "project_number" column of the awards)
+    k : number of clusters
 
     Returns
     -------
@@ -336,30 +319,21 @@ def get_citations(clusters):
     upper: upper bound of 95% CI of average APT [0.95,...] - "0.9 (0.85-0.95)"
 
     """
-
-    # Get clusters by project number
-    clusters_by_project = []
-    for cluster in clusters:
-        cluster = [item["project_number"] for item in cluster]
-        cluster = list(set(cluster)) # Remove duplicates
-        clusters_by_project.append(cluster)
-
-    # Get number of citations, apt, and publication year by paper
-    output = {}
-    with open("data/citations.csv", newline='', encoding='utf8') as csvfile:
-       raw_data = list(csv.reader(csvfile))
-       for i in range(1,len(raw_data)): # "rcr": float(raw_data[i][6]),
-           output[raw_data[i][0]] = {
-               "citations": int(raw_data[i][13]), 
-               "apt": float(raw_data[i][11]),
-               "year": int(raw_data[i][1])}
-
-    # Get project number and year by paper
-    with open("data/publications.csv", newline='', encoding='utf8') as csvfile:
-       raw_data = list(csv.reader(csvfile))
-       for i in range(1,len(raw_data)):
-           if raw_data[i][1] in output.keys():
-               output[raw_data[i][1]]["project"] = raw_data[i][0]
+    from award_store import connect
+
+    # Clusters by core project number, without duplicates
+    conn = connect()
+    conn.execute("CREATE TEMP TABLE cluster_projects (cluster INTEGER, core_project TEXT, UNIQUE (cluster, core_project))")
+    conn.executemany("INSERT OR IGNORE INTO cluster_projects VALUES (?, ?)",
+                     zip(np.asarray(labels).tolist(), project_numbers))
+
+    # Number of papers and citations, APT statistics and years available of the papers of each cluster
+    # (papers joined through the core project index)
+    sums = {row[0]: row[1:] for row in conn.execute("""
+        SELECT cp.cluster, COUNT(*), SUM(p.citations), SUM(p.apt = 0.95), SUM(p.apt), SUM(p.apt * p.apt), SUM(MAX(0, 2021 - p.year))
+        FROM cluster_projects cp JOIN papers p ON p.core_project = cp.core_project
+        GROUP BY cp.cluster""")}
+    conn.close()
 
     # Calculate total number of citations, total number of papers, average RCR, average APT for each cluster
     total_citations = []
@@ -369,223 +343,144 @@ def get_citations(clusters):
     lower = []
     upper = []
     total_availability = []
-    # rcrs = []
-    for cluster in clusters_by_project:
-        cluster_citations = []
-        # cluster_rcr = []
-        cluster_apt = []
-        num_papers = 0
-        availability = []
-
-        for idd in cluster:
-            papers = [output[key]["citations"] for key in output if output[key]["project"]==idd] # list of all papers associated with cluster by citation count
-            # rcr = [output[key]["rcr"] for key in output if output[key]["project"]==idd]
-            apt = [output[key]["apt"] for key in output if output[key]["project"]==idd]
-
-            avail_years = [max(0, 2021-output[key]["year"]) for key in output if output[key]["project"]==idd]
-
-            # cluster_rcr.extend(rcr)
-            cluster_apt.extend(apt)
-            num_papers += len(papers)
-            cluster_citations.append(sum(papers))
-            availability.append(sum(avail_years))
-
-        total_citations.append(sum(cluster_citations))
+    for i in range(k):
+        num_papers, citations, apt_95, apt_sum, apt_squares, availability = sums.get(i, (0, 0, 0, 0.0, 0.0, 0))
+        total_citations.append(citations)
         total_papers.append(num_papers)
-        apts_95.append(sum([1 for i in cluster_apt if i==0.95])/len(cluster_apt))
-        apts.append(np.mean(cluster_apt))
+        apts_95.append(apt_95/num_papers if num_papers > 0 else np.nan)
+        apts.append(apt_sum/num_papers if num_papers > 0 else np.nan)
 
         #create 95% confidence interval for population mean weight
-        apts_interval = scist.norm.interval(alpha=0.95, loc=np.mean(cluster_apt), scale=scist.sem(cluster_apt))
-        lower.append(apts_interval[0])
-        upper.append(apts_interval[1])
-        # rcrs.append(sum(cluster_apt)/len(cluster_apt))
+        variance = max(apt_squares - apt_sum**2/num_papers, 0)/(num_papers - 1) if num_papers > 1 else np.nan
+        margin = Z_95 * np.sqrt(variance/num_papers) if num_papers > 0 else np.nan
+        lower.append(apts[-1] - margin)
+        upper.append(apts[-1] + margin)
 
-        total_availability.append(int(sum(availability)))
+        total_availability.append(int(availability))
 
     return total_citations, total_papers, apts_95, apts, lower, upper, total_availability
 
-def get_rep_clusters(result):
-    path, dirs, files = next(os.walk('{}/clusters'.format(result)))
-    file_count = len(files)
-    if file_count == 0:
-        return
-    document = Document()
-
-    for i in range(file_count):
-        unique_awards = {}
-
-        # open file
-        with open('{}/clusters/cluster-{}.csv'.format(result, str(i)), newline='', encoding='utf8') as csvfile:
-            raw_data = list(csv.reader(csvfile))
-            for j in range(1,len(raw_data)):
-                title = raw_data[j][1]
-                organization = raw_data[j][6]
-                mechanism = raw_data[j][7]
-                year = int(raw_data[j][8])
-                score = float(raw_data[j][11])
-
-                # If this is a new title
-                if title not in unique_awards:
-                    unique_awards[title] = {
-                        "organization": organization,
-                        "activity": mechanism,
-                        "year": year,
-                        "score": score,
-                        }
-
-                # If the title is already there
-                else:
-                    current_year = unique_awards[title]["year"]
-                    # Use the most recent one
-                    if year > current_year:
-                        unique_awards[title] = {
-                        "organization": organization,
-                        "activity": mechanism,
-                        "year": year,
-                        "score": score,
-                        }
-
-        unique_awards_sorted = dict(sorted(unique_awards.items(), key = lambda item: -item[1]["score"]))
-        unique_awards_list = list(unique_awards_sorted.items())[0:5]
-
-        p = document.add_paragraph()
-        p.add_run('Cluster {}:'.format(str(i))).bold = True
-        table = document.add_table(rows=6, cols=5)
-        hdr_cells = table.rows[0].cells
-        hdr_cells[0].text = 'Title'
-        hdr_cells[1].text = 'Awardee'
-        hdr_cells[2].text = 'Award Activity'
-        hdr_cells[3].text = 'Year'
-        hdr_cells[4].text = 'Sample Silhouette Score'
-
-        for i in range(len(unique_awards_list)):
-            table.cell(i+1,0).text = unique_awards_list[i][0] # Title
-            table.cell(i+1,1).text = unique_awards_list[i][1]['organization'] # Awardee
-            table.cell(i+1,2).text = unique_awards_list[i][1]['activity'] # Award Activity
-            table.cell(i+1,3).text = str(unique_awards_list[i][1]['year']) # Year
-            table.cell(i+1,4).text = "{:.2g}".format(unique_awards_list[i][1]['score']) # Sample Silhouette Score
-
-        document.add_page_break()
-
-    document.save('{}/supp_info.docx'.format(result))
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        '--k',
-        type=int,
-        required=True,
-        help='number of clusters',
-        default=30,
-        )
-    parser.add_argument(
-        '--trials',
-        type=int,
-        required=True,
-        help='number of trials',
-        default=50,
-        )
-    FLAGS, unparsed = parser.parse_known_args()
-
-
-    years = [str(i) for i in range(1985,2021)]
-    selected_k = FLAGS.k
-    num_trials = FLAGS.trials
-    centers = 'k-means++'
+def cluster_silhouettes(labels, scores, selected_k):
+    """
+    Average silhouette score of each cluster from the per-award scores
+    """
+    counts = np.bincount(labels, minlength=selected_k)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return list(np.bincount(labels, weights=scores, minlength=selected_k)/counts)
 
-    # Create folder to save results
+def new_results_folder():
+    """
+    Creates results/<timestamp> for a new run
+    """
     now = datetime.now()
     save_folder = "results/"+now.strftime("%m-%d-%Y--%H%M%S")
     os.mkdir(save_folder)
+    return save_folder
+
+def save_perf(save_folder):
+    """
+    Saves perf.json for the run. The first save includes the upstream query and feature extraction
+    scripts; later saves (e.g. a separate report command) add to the existing file.
+    """
+    path = "{}/perf.json".format(save_folder)
+    upstream = ["data/perf-query.json", "data/perf-feature_extraction.json", "data/perf-find_k.json"]
+    for saved in ([path] if os.path.exists(path) else upstream):
+        if os.path.exists(saved):
+            perf.load(saved)
+    perf.save(path)
+
+def run_clustering(selected_k, num_trials, save_folder, years=YEARS, lsa=False, engine="minibatch"):
+    """
+    Cluster stage: picks the best of num_trials clusterings with the given engine (in the cached LSA space
+    if lsa) and saves the run artifact (see save_run), centroids and the train/test assignments in save_folder
+    """
+    os.makedirs(save_folder, exist_ok=True)
+    processed_file = EMBEDDING_FILE if lsa else "data/processed-data.pkl"
 
     # Get best clustering
-    data, scores = get_best_cluster(selected_k, num_trials, centers, years, save_folder)
-    with open("{}/model_clustering.pkl".format(save_folder), 'wb') as handle:
-        pickle.dump(data, handle)
-
-    # Final cluster files
-    num = 0
-    os.mkdir(save_folder+"/clusters")
-    for cluster in data["data_by_cluster"]:
-        if cluster == []:
-            continue
-        keys = cluster[0].keys()
-        with open('{}/clusters/cluster-{}.csv'.format(save_folder,str(num)), 'w', newline='', encoding='utf8')  as output_file:
-            dict_writer = csv.DictWriter(output_file, keys)
-            dict_writer.writeheader()
-            dict_writer.writerows(cluster)
-        num+=1
+    data, scores = get_best_cluster(selected_k, num_trials, 'k-means++', years, save_folder, processed_file=processed_file, engine=engine)
+    save_run(save_folder, data, "data/data.pkl", years, processed_file)
+
+    # Final cluster assignments, written in one pass
+    awards = load_awards("data/data.pkl")
+    with perf.timer("write", items=len(awards)):
+        write_assignments(save_folder, awards, data["labels"], data["sample_scores"])
 
     # Silhouette score by cluster
     print("")
     print("------Silhouette scores------")
-    X_transformed = pickle.load(open("data/processed-data.pkl","rb"))
-    scores = metrics.silhouette_samples(X_transformed, data["labels"])
-    tabulated = []
-    pairs = [(scores[i],data["labels"][i]) for i in range(len(scores))]
+    tabulated = cluster_silhouettes(data["labels"], data["sample_scores"], selected_k)
     for i in range(selected_k):
-        avg_score = np.mean([j[0] for j in pairs if j[1] == i])
-        print("Cluster {}: {}".format(str(i), str(avg_score)))
-        tabulated.append(avg_score)
+        print("Cluster {}: {}".format(str(i), str(tabulated[i])))
     print("----------------------------")
     print("")
 
     # Final centroids
-    order_centroids = data["model"].cluster_centers_.argsort()[:, ::-1]
-    vectorizer = pickle.load(open("data/vectorizer.pkl","rb"))
-    terms = vectorizer.get_feature_names_out()
-    centroids = []
     centroid_file = open("{}/centroids".format(save_folder), "w", encoding='utf8')
     for i in range(selected_k):
         centroid_file.write("Cluster %d:" % i)
-        centroid_list = []
-        for ind in order_centroids[i, :15]:
-            centroid_file.write(" %s," % terms[ind])
-            centroid_list.append(terms[ind])
-        centroids.append(centroid_list)
+        for term in data["centroids"][i]:
+            centroid_file.write(" %s," % term)
         centroid_file.write("\n")
     centroid_file.close()
 
-    # UMAP Visualization
-    X_transformed = pickle.load(open("data/processed-data.pkl","rb"))
-    umap_visualization(X_transformed, data["labels"], tabulated, data["size"], save_folder)
+    # Save 2021 clusters
+    with perf.timer("predict"):
+        clusters_test, size_test, labels_test = predict_clusters("data/test-data.pkl", selected_k, data["model"], processed_file)
+    test_awards = load_awards("data/test-data.pkl")
+    write_assignments(save_folder, test_awards, labels_test, suffix="_test")
+
+def run_umap(save_folder):
+    """
+    UMAP stage: saves umap.png for the clustering in save_folder
+    """
+    run = ClusterRun(save_folder)
+    run.check_inputs([run.features])
+    tabulated = cluster_silhouettes(run.labels, run.scores, run.k)
+    X_transformed = load_features(run.features)
+    labels = np.asarray(run.labels)
+    groups = load_groups()
+    if groups is not None:
+        labels = labels[groups["representatives"]]
+    # Hellinger distance needs non-negative features, the unit length LSA embedding uses cosine
+    umap_visualization(X_transformed, labels, tabulated, run["size"], save_folder, 'cosine' if is_lsa(run.features) else 'hellinger')
+
+def run_citations(save_folder):
+    """
+    Citation stage: saves citation and paper summaries by cluster to citations.pkl in save_folder
+    """
+    run = ClusterRun(save_folder)
+    citations = get_citations(run.labels, run.awards.column("project_number"), run.k)
+    with open("{}/citations.pkl".format(save_folder), 'wb') as handle:
+        pickle.dump(citations, handle)
+
+def run_report(save_folder):
+    """
+    Report stage: saves final_data.csv and supp_info.docx in save_folder
+    """
+    run = ClusterRun(save_folder)
+    data = run.meta
+    citations, papers, apt_pct, apt, lower, upper, availability = pickle.load(open("{}/citations.pkl".format(save_folder),"rb"))
+    selected_k = run.k
+    labels = np.asarray(run.labels)
+    scores = np.asarray(run.scores)
+    tabulated = cluster_silhouettes(labels, scores, selected_k)
+    centroids = run.top_terms
 
     # Get 2021 projections, projected growth rates, and confidence bounds on growth rates by cluster
     projection, growth, bounds = get_funding_projections(data) # 2021 prediction
 
-    # Get 2021 clusters
-    model = data["model"]
-    clusters_test, size_test = predict_clusters("data/test-data.pkl", selected_k, model)
-    x = np.arange(selected_k)
-    if size_test == 0:
-        cluster_cost_2021 = [0 for i in range(0, selected_k)]
-    else:
-        cluster_cost_2021 = [(sum([item["award_amount"] for item in group]) if len(group) > 0 else 0) for group in clusters_test]
-
-    # Save 2021 clusters
-    num = 0
-    os.mkdir("{}/clusters_test".format(save_folder))
-    for cluster in clusters_test:
-        try:
-            keys = cluster[0].keys()
-        except:
-            num+=1
-            continue
-        with open('{}/clusters_test/cluster-{}.csv'.format(save_folder,str(num)), 'w', newline='', encoding='utf8')  as output_file:
-            dict_writer = csv.DictWriter(output_file, keys)
-            dict_writer.writeheader()
-            dict_writer.writerows(cluster)
-        num+=1
-
-    # Citations and papers
-    citations, papers, apt_pct, apt, lower, upper, availability = get_citations(data["data_by_cluster"])
+    # Actual 2021 funding from the saved test assignments
+    assignments_test = np.load("{}/assignments_test.npz".format(save_folder))
+    cluster_cost_2021 = list(np.bincount(assignments_test["label"], weights=assignments_test["award_amount"], minlength=selected_k).astype(np.int64))
 
     # Total funding
-    total_cluster_funding = [sum([item["award_amount"] for item in group]) for group in data["data_by_cluster"]]
+    awards = run.awards
+    total_cluster_funding = list(np.bincount(labels, weights=awards.column("award_amount"), minlength=selected_k).astype(np.int64))
 
-    # Get representative clusters for supp info
-    get_rep_clusters(save_folder)
+    # Get representative awards for supp info, selected from the saved labels and scores
+    representatives = select_representatives(awards, labels, scores, selected_k)
+    write_supp_info(save_folder, representatives)
 
     # All data - note blank columns for description, category
     output = [["Cluster", "Size", "Total", "Citations", "APT % over 95%", "Avg. APT", "95%CI L", "95%CI U", "Papers", "Citations per $1mil funding", "Years of Availability", "Citations per thousand dollars of funding per year", "Projected 2021 Award", "Actual 2021 Award To Date", "Growth Rate", "95%CI L", "95%CI U", "Score", "Description", "Category", "Clinical/Technical", "Centroids", "%R01", "%U01", "%R44", "%U24", "%R21", "%U54"]]
@@ -595,4 +490,60 @@ if __name__ == "__main__":
         writer = csv.writer(csvfile)
         writer.writerows(output)
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--k',
+        type=int,
+        required=True,
+        help='number of clusters',
+        default=30,
+        )
+    parser.add_argument(
+        '--trials',
+        type=int,
+        required=True,
+        help='number of trials',
+        default=50,
+        )
+    parser.add_argument(
+        '--profile',
+        type=str,
+        help='stage to profile (cluster, umap, citations, report)',
+        default=None,
+        )
+    parser.add_argument(
+        '--profiler',
+        type=str,
+        help='profiler for --profile (cprofile, pyinstrument)',
+        default="cprofile",
+        )
+    parser.add_argument(
+        '--lsa',
+        action='store_true',
+        help='cluster in the LSA space cached by feature_extraction.py --lsa',
+        )
+    parser.add_argument(
+        '--engine',
+        type=str,
+        help='k-means engine (minibatch, spherical)',
+        default="minibatch",
+        )
+    FLAGS, unparsed = parser.parse_known_args()
+
+    # Create folder to save results
+    save_folder = new_results_folder()
+    if FLAGS.profile is not None:
+        perf.configure_profile(FLAGS.profile, FLAGS.profiler, save_folder)
+
+    with perf.timer("cluster"):
+        run_clustering(FLAGS.k, FLAGS.trials, save_folder, lsa=FLAGS.lsa, engine=FLAGS.engine)
+    with perf.timer("umap"):
+        run_umap(save_folder)
+    with perf.timer("citations"):
+        run_citations(save_folder)
+    with perf.timer("report"):
+        run_report(save_folder)
+    save_perf(save_folder)
+
     print("Complete.")
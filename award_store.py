@@ -0,0 +1,119 @@
+import os
+import csv
+import sqlite3
+import argparse
+import perf
+from award_table import load_awards
+
+DB_FILE = "data/awards.db"
+
+# Downloaded tables (nih_reporter_query.py), loaded with their csv headers as TEXT columns
+SOURCES = {
+    "raw_awards": "data/raw_data.csv",
+    "publications": "data/publications.csv",
+    "citations": "data/citations.csv",
+    }
+
+# Processed awards (process_data), loaded into the awards table
+AWARD_FILES = ["data/data.pkl", "data/test-data.pkl"]
+
+INDEXES = [
+    ("raw_awards", "appl_id"),
+    ("raw_awards", "project_num"),
+    ("publications", "applid"),
+    ("publications", "coreproject"),
+    ("publications", "pmid"),
+    ("citations", "pmid"),
+    ]
+
+# One row per paper as get_citations has always counted them: the last citations row of each pmid,
+# linked to the core project of the last publications row of that pmid
+PAPERS = """
+CREATE TABLE papers AS
+    SELECT c.pmid AS pmid, p.coreproject AS core_project, CAST(c.year AS INTEGER) AS year,
+           CAST(c.citation_count AS INTEGER) AS citations, CAST(c.apt AS REAL) AS apt
+    FROM (SELECT pmid, MAX(rowid) AS last FROM citations GROUP BY pmid) lc
+    JOIN citations c ON c.rowid = lc.last
+    JOIN (SELECT pmid, MAX(rowid) AS last FROM publications GROUP BY pmid) lp ON lp.pmid = lc.pmid
+    JOIN publications p ON p.rowid = lp.last;
+CREATE INDEX papers_core_project ON papers (core_project);
+CREATE INDEX papers_pmid ON papers (pmid);
+"""
+
+def load_csv(conn, table, path):
+    """
+    Loads a csv into a new table with one TEXT column per header field
+    """
+    with open(path, newline='', encoding='utf8') as csvfile:
+        reader = csv.reader(x.replace('\0', '') for x in csvfile)
+        header = next(reader)
+        columns = ", ".join('"{}" TEXT'.format(name.replace('"', '""')) for name in header)
+        conn.execute('DROP TABLE IF EXISTS {}'.format(table))
+        conn.execute('CREATE TABLE {} ({})'.format(table, columns))
+        conn.executemany('INSERT INTO {} VALUES ({})'.format(table, ", ".join("?" * len(header))),
+                         (row[:len(header)] + [None] * (len(header) - len(row)) for row in reader))
+
+def load_processed_awards(conn, files=AWARD_FILES):
+    """
+    (Re)loads the awards kept by process_data, with the core project number of each award
+    """
+    conn.execute("DROP TABLE IF EXISTS awards")
+    conn.execute("CREATE TABLE awards (appl_id TEXT, core_project TEXT, administration TEXT, mechanism TEXT, year TEXT, award_amount INTEGER)")
+    for path in files:
+        if not os.path.exists(path):
+            continue
+        awards = load_awards(path)
+        columns = [awards.column(field) for field in ["id", "project_number", "administration", "mechanism", "year"]]
+        amounts = awards.column("award_amount").tolist()
+        conn.executemany("INSERT INTO awards VALUES (?, ?, ?, ?, ?, ?)",
+                         zip(*[[str(value) for value in column] for column in columns], amounts))
+    conn.execute("CREATE INDEX IF NOT EXISTS awards_appl_id ON awards (appl_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS awards_core_project ON awards (core_project)")
+
+def build_store(db_file=DB_FILE):
+    """
+    Builds the award database from the downloaded csvs and the processed awards, indexed on application id,
+    core project number and pmid. Run it after process_data (it is the store stage of pipeline.py); the new
+    database is written next to the old one and swapped in, so readers never see a partial file.
+    """
+    tmp_file = db_file + ".tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    conn = sqlite3.connect(tmp_file)
+    with conn:
+        for table, path in SOURCES.items():
+            if os.path.exists(path):
+                load_csv(conn, table, path)
+                print("Loaded {} into {}".format(path, table))
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        for table, column in INDEXES:
+            if table in tables:
+                conn.execute('CREATE INDEX {0}_{1} ON {0} ("{1}")'.format(table, column))
+        if "citations" in tables and "publications" in tables:
+            conn.executescript(PAPERS)
+        load_processed_awards(conn)
+    conn.close()
+    os.replace(tmp_file, db_file)
+
+def connect(db_file=DB_FILE):
+    """
+    Read-only connection to the award database (temporary tables can still be created).
+    The database is never built here: build_store is its own step.
+    """
+    if not os.path.exists(db_file):
+        raise FileNotFoundError("{} not found, build it after process_data with python award_store.py (or cli.py store)".format(db_file))
+    return sqlite3.connect("file:{}?mode=ro".format(db_file), uri=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--db_file',
+        type=str,
+        help='Path of the award database',
+        default=DB_FILE,
+        )
+    FLAGS, unparsed = parser.parse_known_args()
+
+    with perf.timer("store"):
+        build_store(FLAGS.db_file)
+    perf.save("data/perf-store.json")
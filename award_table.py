@@ -0,0 +1,161 @@
+import pickle
+from collections.abc import Mapping
+import numpy as np
+
+# Award fields, in the order of the dictionaries built by process_data
+FIELDS = ["text", "title", "id", "project_number", "terms", "administration", "organization", "mechanism", "year", "award_amount", "cong_dist"]
+
+# Fields with few distinct values, stored as int32 codes into a sorted array of categories
+CATEGORICAL = ["administration", "organization", "mechanism", "year", "cong_dist"]
+
+# Free text fields, stored as one utf8 buffer per field with int64 offsets ("terms" is joined with ";")
+TEXT = ["text", "title", "id", "project_number", "terms"]
+
+class AwardRow(Mapping):
+    """
+    Read-only dictionary view of one award. Values are decoded from the table on access.
+    """
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, field):
+        return self.table.value(field, self.index)
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def __repr__(self):
+        return "AwardRow({})".format(dict(self))
+
+class AwardTable:
+    """
+    Struct-of-arrays table of awards. Supports the list-of-dictionaries idioms used by the
+    scripts (len, iteration, data[i]["field"]), where rows are lazy AwardRow views, and
+    column access for vectorized code:
+        table.column("award_amount") - int64 array
+        table.codes("year"), table.categories("year") - int32 codes and their values
+        table.column("text") - list of strings
+
+    Parameters
+    ----------
+    amounts : int64 array of award amounts
+    codes : dictionary of int32 code arrays by categorical field
+    categories : dictionary of category value arrays by categorical field
+    buffers : dictionary of utf8 bytes by text field
+    offsets : dictionary of int64 offset arrays (length n+1) by text field
+    """
+    def __init__(self, amounts, codes, categories, buffers, offsets):
+        self.amounts = amounts
+        self._codes = codes
+        self._categories = categories
+        self.buffers = buffers
+        self.offsets = offsets
+
+    @classmethod
+    def from_columns(cls, columns):
+        """
+        Builds a table from a dictionary of lists of values by field
+        """
+        codes, categories, buffers, offsets = {}, {}, {}, {}
+        for field in CATEGORICAL:
+            categories[field], inverse = np.unique(np.array(columns[field], dtype=str), return_inverse=True)
+            codes[field] = inverse.astype(np.int32)
+        for field in TEXT:
+            values = [";".join(value) for value in columns[field]] if field == "terms" else columns[field]
+            encoded = [str(value).encode("utf8") for value in values]
+            offsets[field] = np.zeros(len(encoded)+1, dtype=np.int64)
+            np.cumsum([len(value) for value in encoded], out=offsets[field][1:])
+            buffers[field] = b"".join(encoded)
+        return cls(np.array(columns["award_amount"], dtype=np.int64), codes, categories, buffers, offsets)
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Builds a table from a list of award dictionaries
+        """
+        return cls.from_columns({field: [item[field] for item in records] for field in FIELDS})
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("award index {} out of range".format(index))
+            return AwardRow(self, int(index))
+        return self.take(np.arange(len(self))[index] if isinstance(index, slice) else index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield AwardRow(self, i)
+
+    def value(self, field, i):
+        """
+        Value of a field for award i, with the types of the process_data dictionaries
+        """
+        if field == "award_amount":
+            return int(self.amounts[i])
+        if field in self._codes:
+            return str(self._categories[field][self._codes[field][i]])
+        if field in self.buffers:
+            offsets = self.offsets[field]
+            value = self.buffers[field][offsets[i]:offsets[i+1]].decode("utf8")
+            return value.split(";") if field == "terms" else value
+        raise KeyError(field)
+
+    def codes(self, field):
+        return self._codes[field]
+
+    def categories(self, field):
+        return self._categories[field]
+
+    def column(self, field):
+        """
+        All values of a field: an array for amounts and categorical fields, a list of strings for text fields
+        """
+        if field == "award_amount":
+            return self.amounts
+        if field in self._codes:
+            return self._categories[field][self._codes[field]]
+        return [self.value(field, i) for i in range(len(self))]
+
+    def take(self, indices):
+        """
+        New table with the awards at indices (integer array or boolean mask)
+        """
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        else:
+            # An empty list would otherwise become a float array
+            indices = indices.astype(np.int64, copy=False)
+        buffers, offsets = {}, {}
+        for field in TEXT:
+            starts = self.offsets[field][indices]
+            ends = self.offsets[field][indices+1]
+            view = memoryview(self.buffers[field])
+            buffers[field] = b"".join([view[a:b] for a, b in zip(starts, ends)])
+            offsets[field] = np.zeros(len(indices)+1, dtype=np.int64)
+            np.cumsum(ends - starts, out=offsets[field][1:])
+        codes = {field: self._codes[field][indices] for field in CATEGORICAL}
+        return AwardTable(self.amounts[indices], codes, dict(self._categories), buffers, offsets)
+
+def as_table(data):
+    """
+    AwardTable for a table or a list of award dictionaries (e.g. a data.pkl saved before the table existed)
+    """
+    return data if isinstance(data, AwardTable) else AwardTable.from_records(data)
+
+def load_awards(path):
+    """
+    Loads data.pkl or test-data.pkl as an AwardTable
+    """
+    return as_table(pickle.load(open(path, "rb")))
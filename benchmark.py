@@ -0,0 +1,237 @@
+import argparse
+import json
+import os
+import pickle
+import platform
+import sys
+import tempfile
+import traceback
+from datetime import datetime
+import numpy as np
+import perf
+from synthetic_data import write_corpus
+
+BENCHMARKS = ["process_data", "store", "tokenizer", "feature_extraction", "get_clusters", "get_citations", "predict_clusters", "umap_visualization", "fetch"]
+
+# Largest corpus each benchmark runs at unless --no_limits is given: silhouette scores (get_clusters)
+# and UMAP grow quadratically or worse with the number of awards
+MAX_SIZE = {"get_clusters": 100000, "umap_visualization": 100000}
+
+def timed(results, name, n, func, *args, **kwargs):
+    """
+    Runs func under a perf timer and stores wall/CPU time, throughput and peak RSS in results[name].
+    If func raises, its traceback is printed and results[name] records a "failed" status with the exception
+    type only (no message or traceback, which name local paths), and None is returned.
+    """
+    try:
+        with perf.timer(name, items=n):
+            output = func(*args, **kwargs)
+    except Exception as e:
+        results[name] = {"status": "failed", "error": type(e).__name__}
+        print("{} failed:\n{}".format(name, traceback.format_exc()))
+        return None
+    entry = perf.recorder.timers[name]
+    results[name] = {
+        "status": "ok",
+        "seconds": entry["wall_s"],
+        "cpu_s": entry["cpu_s"],
+        "items_per_s": n / entry["wall_s"] if entry["wall_s"] > 0 else None,
+        "peak_rss_mb": entry["peak_rss_mb"],
+        }
+    return output
+
+def run_benchmarks(n, k=50, max_features=1000, limits=True, workdir=None, engine="minibatch"):
+    """
+
+    Parameters
+    ----------
+    n : number of synthetic awards
+    k : number of clusters
+    max_features : number of TF-IDF features
+    limits : boolean. skip benchmarks above their MAX_SIZE
+    workdir : directory for the synthetic data/ folder, the default is a temporary directory
+    engine : k-means engine of get_clusters (minibatch, spherical)
+
+    Returns
+    -------
+    results : dictionary of timings by benchmark name
+
+    """
+    from feature_extraction import process_data, feature_extraction, LemmaStemmerTokenizer
+    from analyze_clusters import get_clusters, get_citations, predict_clusters, umap_visualization, cluster_silhouettes, YEARS
+    from award_store import build_store
+    from sklearn.cluster import MiniBatchKMeans
+
+    workdir = workdir if workdir is not None else tempfile.mkdtemp(prefix="bench-{}-".format(n))
+    cwd = os.getcwd()
+    os.chdir(workdir) # pipeline functions read and write data/ relative to the working directory
+    perf.reset()
+    results = {}
+    skip = lambda name: limits and n > MAX_SIZE.get(name, n)
+    try:
+        print("Generating {} synthetic awards in {}...".format(n, workdir))
+        with perf.timer("generate"):
+            write_corpus(n, "data")
+
+        ok = lambda name: "seconds" in results.get(name, {})
+        output = timed(results, "process_data", n, process_data, "data/raw_data.csv")
+        if ok("process_data"):
+            data, test_data = output
+            timed(results, "store", n, build_store)
+            tokenizer = LemmaStemmerTokenizer()
+            timed(results, "tokenizer", len(data), lambda: [tokenizer(text) for text in data.column("text")])
+            timed(results, "feature_extraction", len(data), feature_extraction, data, max_features, 0.1)
+
+        model = None
+        if ok("feature_extraction") and skip("get_clusters"):
+            results["get_clusters"] = {"status": "skipped", "reason": "n > {}".format(MAX_SIZE["get_clusters"])}
+            # Untimed clustering so the downstream benchmarks have labels and a model
+            X_transformed = pickle.load(open("data/processed-data.pkl","rb"))
+            model = MiniBatchKMeans(n_clusters=k, max_no_improvement=None).fit(X_transformed)
+            labels = model.labels_
+            scores = np.zeros(len(labels))
+        elif ok("feature_extraction"):
+            output = timed(results, "get_clusters", len(data), get_clusters, k, "data/data.pkl", "data/processed-data.pkl", 'k-means++', YEARS, save=False, engine=engine)
+            if ok("get_clusters"):
+                model, labels, scores = output["model"], output["labels"], output["sample_scores"]
+
+        if model is not None:
+            if ok("store"):
+                timed(results, "get_citations", len(data), get_citations, labels, data.column("project_number"), k)
+
+            timed(results, "predict_clusters", len(test_data), predict_clusters, "data/test-data.pkl", k, model)
+
+            if skip("umap_visualization"):
+                results["umap_visualization"] = {"status": "skipped", "reason": "n > {}".format(MAX_SIZE["umap_visualization"])}
+            else:
+                X_transformed = pickle.load(open("data/processed-data.pkl","rb"))
+                sizes = list(np.bincount(labels, minlength=k))
+                timed(results, "umap_visualization", len(data), umap_visualization, X_transformed, labels, cluster_silhouettes(labels, scores, k), sizes, workdir)
+
+        # Benchmarks that need the output of one that failed
+        for name in BENCHMARKS:
+            if name != "fetch":
+                results.setdefault(name, {"status": "skipped", "reason": "a benchmark it depends on failed"})
+    finally:
+        os.chdir(cwd)
+    return results
+
+def run_fetch_benchmark(n, latency=0.0, error_rate=0.0, rate_limit=0.0, workdir=None):
+    """
+
+    Parameters
+    ----------
+    n : number of synthetic awards served by a local mock_reporter server
+    latency : seconds added to every response
+    error_rate : fraction of 5xx responses
+    rate_limit : fraction of 429 responses (sent with Retry-After: 0)
+    workdir : directory for the downloaded data/ folder, the default is a temporary directory
+
+    Returns
+    -------
+    results : dictionary with total pull time, requests per second and HTTP statistics by endpoint
+
+    """
+    from mock_reporter import MockReporter, serve
+    from nih_reporter_query import get_data
+
+    workdir = workdir if workdir is not None else tempfile.mkdtemp(prefix="fetch-{}-".format(n))
+    os.makedirs("{}/data".format(workdir), exist_ok=True)
+    with open("{}/search_terms.txt".format(workdir), "w") as f:
+        f.write("machine learning\n")
+    server, base_url = serve(MockReporter(n, latency=latency, error_rate=error_rate, rate_limit=rate_limit, retry_after=0))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    perf.reset()
+    try:
+        with perf.timer("fetch"):
+            get_data("search_terms.txt", 1985, 2022, "or", base_url, base_url, retry_wait=0)
+    finally:
+        os.chdir(cwd)
+        server.shutdown()
+
+    seconds = perf.recorder.timers["fetch"]["wall_s"]
+    report = perf.recorder.report()["http"]
+    requests = sum([entry["requests"] for entry in report.values()])
+    return {"fetch": {
+        "status": "ok",
+        "seconds": seconds,
+        "requests": requests,
+        "requests_per_s": requests / seconds,
+        "retries": sum([entry["retries"] for entry in report.values()]),
+        "endpoints": {endpoint.replace(base_url, ""): entry for endpoint, entry in report.items()},
+        }}
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the change of every benchmark against a baseline
+
+    Returns
+    -------
+    regressions : list of (size, benchmark, ratio) slower than the baseline by more than tolerance
+    """
+    regressions = []
+    for size, benchmarks in results["results"].items():
+        for name in BENCHMARKS:
+            new = benchmarks.get(name, {})
+            old = baseline["results"].get(size, {}).get(name, {})
+            if "seconds" not in new or "seconds" not in old:
+                continue
+            ratio = new["seconds"] / old["seconds"]
+            flag = "REGRESSION" if ratio > 1 + tolerance else ""
+            print("{:>8} {:<20} {:>10.3f}s -> {:>10.3f}s ({:+.0%}) {}".format(size, name, old["seconds"], new["seconds"], ratio - 1, flag))
+            if flag:
+                regressions.append((size, name, ratio))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=str, default="10000,100000,1000000", help='comma-separated numbers of synthetic awards')
+    parser.add_argument('--k', type=int, default=50, help='number of clusters')
+    parser.add_argument('--max_features', type=int, default=1000, help='number of features')
+    parser.add_argument('--engine', type=str, default="minibatch", help='k-means engine of get_clusters (minibatch, spherical)')
+    parser.add_argument('--no_limits', action='store_true', help='run every benchmark at every size')
+    parser.add_argument('--fetch', action='store_true', help='benchmark the RePORTER/iCite fetcher against a local mock server instead')
+    parser.add_argument('--latency', type=float, default=0.0, help='mock server latency in seconds (with --fetch)')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='fraction of mock 5xx responses (with --fetch)')
+    parser.add_argument('--rate_limit', type=float, default=0.0, help='fraction of mock 429 responses (with --fetch)')
+    parser.add_argument('--output', type=str, default=None, help='path to save results (default benchmarks/<timestamp>.json)')
+    parser.add_argument('--compare', type=str, default=None, help='baseline json to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown against the baseline')
+    parser.add_argument('--note', type=str, default=None, help='description of the machine or setup, saved with the results')
+    FLAGS, unparsed = parser.parse_known_args()
+
+    results = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "k": FLAGS.k,
+            "max_features": FLAGS.max_features,
+            "engine": FLAGS.engine,
+            "note": FLAGS.note,
+            },
+        "results": {},
+        }
+    for size in [int(s) for s in FLAGS.sizes.split(",")]:
+        if FLAGS.fetch:
+            results["results"][str(size)] = run_fetch_benchmark(size, FLAGS.latency, FLAGS.error_rate, FLAGS.rate_limit)
+        else:
+            results["results"][str(size)] = run_benchmarks(size, FLAGS.k, FLAGS.max_features, not FLAGS.no_limits, engine=FLAGS.engine)
+        for name, entry in results["results"][str(size)].items():
+            print("{:>8} {:<20} {}".format(size, name, "{:.3f}s".format(entry["seconds"]) if "seconds" in entry else entry["status"]))
+            if "requests_per_s" in entry:
+                print("{:>8} {:<20} {} requests, {:.1f} requests/s, {} retries".format(size, "", entry["requests"], entry["requests_per_s"], entry["retries"]))
+
+    os.makedirs("benchmarks", exist_ok=True)
+    output = FLAGS.output if FLAGS.output is not None else "benchmarks/{}.json".format(datetime.now().strftime("%m-%d-%Y--%H%M%S"))
+    with open(output, "w", encoding="utf8") as f:
+        json.dump(results, f, indent=1)
+    print("Saved {}".format(output))
+
+    if FLAGS.compare is not None:
+        regressions = compare(results, json.load(open(FLAGS.compare, encoding="utf8")), FLAGS.tolerance)
+        if regressions:
+            print("{} regression(s) against {}".format(len(regressions), FLAGS.compare))
+            sys.exit(1)
@@ -0,0 +1,235 @@
+import argparse
+import sys
+import perf
+
+# Each command imports its stage lazily, so start-up only pays for the libraries that command uses
+
+def query(FLAGS):
+    from nih_reporter_query import get_data, get_batch
+    with perf.timer("query"):
+        if FLAGS.queries is not None:
+            get_batch(FLAGS.queries, FLAGS.start_year, FLAGS.end_year+1, FLAGS.base_url, FLAGS.icite_url, FLAGS.retry_wait, FLAGS.max_retries)
+        else:
+            get_data(FLAGS.search_terms, FLAGS.start_year, FLAGS.end_year+1, FLAGS.operator, FLAGS.base_url, FLAGS.icite_url, FLAGS.retry_wait, FLAGS.max_retries)
+    perf.save("data/perf-query.json")
+
+def store(FLAGS):
+    from award_store import build_store
+    with perf.timer("store"):
+        build_store()
+    perf.save("data/perf-store.json")
+
+def extract(FLAGS):
+    from feature_extraction import run_extraction, run_batch_extraction
+    if FLAGS.batch:
+        run_batch_extraction(FLAGS.max_features, FLAGS.max_df, dedup=FLAGS.dedup, lsa=FLAGS.lsa, precision=FLAGS.precision, store=FLAGS.store)
+    else:
+        run_extraction(FLAGS.max_features, FLAGS.max_df, dedup=FLAGS.dedup, lsa=FLAGS.lsa, precision=FLAGS.precision, store=FLAGS.store)
+
+def find_k(FLAGS):
+    from find_k import run_find_k
+    run_find_k(FLAGS.trials, FLAGS.max_k, FLAGS.num_features, FLAGS.lsa, FLAGS.engine, FLAGS.dedup)
+
+def funding(FLAGS):
+    from funding_cube import FundingCube
+    cube = FundingCube.load(FLAGS.cube).select(**{f.split("=")[0]: f.split("=")[1].split(",") for f in FLAGS.where})
+    cube.write_crosstab(FLAGS.rows, FLAGS.columns, sys.stdout, FLAGS.value)
+
+def cluster(FLAGS):
+    import os
+    from analyze_clusters import new_results_folder, run_clustering, run_umap, save_perf
+    save_folder = FLAGS.results if FLAGS.results is not None else new_results_folder()
+    os.makedirs(save_folder, exist_ok=True)
+    if FLAGS.profile is not None:
+        perf.configure_profile(FLAGS.profile, FLAGS.profiler, save_folder)
+    with perf.timer("cluster"):
+        run_clustering(FLAGS.k, FLAGS.trials, save_folder, lsa=FLAGS.lsa, engine=FLAGS.engine)
+    if not FLAGS.no_umap:
+        with perf.timer("umap"):
+            run_umap(save_folder)
+    save_perf(save_folder)
+    print("Results: {}".format(save_folder))
+    print("Run 'python cli.py report --results {}' for citations, projections and the supplementary tables.".format(save_folder))
+
+def report(FLAGS):
+    from analyze_clusters import run_citations, run_report, save_perf
+    if FLAGS.profile is not None:
+        perf.configure_profile(FLAGS.profile, FLAGS.profiler, FLAGS.results)
+    with perf.timer("citations"):
+        run_citations(FLAGS.results)
+    with perf.timer("report"):
+        run_report(FLAGS.results)
+    save_perf(FLAGS.results)
+
+def predict(FLAGS):
+    import csv
+    from award_table import load_awards
+    from analyze_clusters import predict_text
+    if FLAGS.input.endswith(".pkl"):
+        awards = load_awards(FLAGS.input)
+        ids = awards.column("id")
+        texts = awards.column("text")
+    else:
+        with open(FLAGS.input, encoding="utf8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        ids = list(range(len(texts)))
+    labels, centroids = predict_text(texts, FLAGS.results, FLAGS.exact)
+    output = open(FLAGS.output, "w", newline="", encoding="utf8") if FLAGS.output is not None else sys.stdout
+    writer = csv.writer(output)
+    writer.writerow(["id", "cluster", "centroids"])
+    for i in range(len(texts)):
+        writer.writerow([ids[i], labels[i], " ".join(centroids[labels[i]][:5])])
+    if FLAGS.output is not None:
+        output.close()
+
+def similar(FLAGS):
+    import csv
+    import time
+    from similarity_index import similar_awards, load_lookup
+    texts = FLAGS.text if FLAGS.text else []
+    if FLAGS.input is not None:
+        with open(FLAGS.input, encoding="utf8") as f:
+            texts += [line.strip() for line in f if line.strip()]
+    start = time.perf_counter()
+    matches = similar_awards(texts, FLAGS.k, FLAGS.results, FLAGS.features, FLAGS.probes)
+    print("{} documents in {:.1f} ms".format(len(texts), 1000*(time.perf_counter()-start)), file=sys.stderr)
+    recall = load_lookup(FLAGS.features)[0].recall
+    if recall is not None:
+        print("Index recall@{k} {recall:.1%} against brute force ({queries} sampled awards, {probes} probes)".format(**recall), file=sys.stderr)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["query", "rank", "id", "title", "year", "similarity", "cluster"])
+    for i, found in enumerate(matches):
+        for award in found:
+            writer.writerow([i, award["rank"], award["id"], award["title"], award["year"], "{:.4f}".format(award["similarity"]), award["cluster"]])
+
+def compare(FLAGS):
+    from compare_runs import compare_runs, print_comparison
+    pairwise, topics = compare_runs(FLAGS.runs, FLAGS.reference, FLAGS.threshold, FLAGS.output)
+    print_comparison(pairwise, topics)
+
+def evolve(FLAGS):
+    from topic_evolution import topic_evolution, print_evolution, new_evolution_folder
+    save_folder = FLAGS.results if FLAGS.results is not None else new_evolution_folder()
+    lineage, summary = topic_evolution(FLAGS.k, FLAGS.window, FLAGS.step, FLAGS.start_year, FLAGS.end_year, FLAGS.features,
+                                       FLAGS.engine, FLAGS.jobs, FLAGS.threshold, save_folder, FLAGS.seed)
+    print_evolution(lineage, summary)
+    perf.save("{}/perf.json".format(save_folder))
+    print("Results: {}".format(save_folder))
+
+def precision(FLAGS):
+    from precision import validate_precision, print_report
+    print_report(validate_precision(FLAGS.k, FLAGS.features, FLAGS.engine, FLAGS.seed, FLAGS.max_label_change, FLAGS.silhouette_tolerance))
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="NIH award topic analysis")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("query", help="download awards, publications and citations")
+    p.add_argument('--search_terms', type=str, default="search_terms.txt", help='Terms for NIH RePORTER query')
+    p.add_argument('--operator', type=str, default="or", help='Operator for NIH RePORTER query (and, or, advanced)')
+    p.add_argument('--start_year', type=int, default=1985, help='Start year for search (inclusive)')
+    p.add_argument('--end_year', type=int, default=2021, help='End year for search (inclusive)')
+    p.add_argument('--base_url', type=str, default="https://api.reporter.nih.gov", help='Base URL of the RePORTER API')
+    p.add_argument('--icite_url', type=str, default="https://icite.od.nih.gov", help='Base URL of the iCite API')
+    p.add_argument('--retry_wait', type=float, default=30, help='Seconds to wait before retrying a failed request')
+    p.add_argument('--max_retries', type=int, default=10, help='Retries of a rate-limited (429) or failed (5xx) request before giving up')
+    p.add_argument('--queries', type=str, default=None, help='json list of query definitions to fetch together, instead of --search_terms and --operator')
+    p.set_defaults(func=query)
+
+    p = commands.add_parser("store", help="build the indexed award database (data/awards.db) from the downloads and processed awards")
+    p.set_defaults(func=store)
+
+    p = commands.add_parser("extract", help="process raw data, extract TF-IDF features and summarize funding")
+    p.add_argument('--max_features', type=int, default=1000, help='number of features')
+    p.add_argument('--max_df', type=float, default=0.1, help='maximum document frequency')
+    p.add_argument('--dedup', type=float, default=None, help='collapse near-duplicate awards above this Jaccard similarity (e.g. 0.8)')
+    p.add_argument('--lsa', type=int, default=None, help='also fit and cache an LSA embedding with this number of components (e.g. 100)')
+    p.add_argument('--precision', type=str, default="float64", help='float64, or float32 for float32 features through clustering')
+    p.add_argument('--batch', action='store_true', help='also extract the awards of each query of a batch download to queries/<name>/data')
+    p.add_argument('--store', action='store_true', help='build data/awards.db after processing the data and summarize funding from it')
+    p.set_defaults(func=extract)
+
+    p = commands.add_parser("funding", help="cross-tab of the funding cube, e.g. funder by year")
+    p.add_argument('--rows', type=str, default="administration", help='dimension of the rows (administration, year, mechanism)')
+    p.add_argument('--columns', type=str, default="year", help='dimension of the columns')
+    p.add_argument('--value', type=str, default="amounts", help='amounts or counts')
+    p.add_argument('--where', type=str, action='append', default=[], help='filter as dimension=value[,value...], repeatable')
+    p.add_argument('--cube', type=str, default="data/funding_cube.npz", help='cube saved by the extract command')
+    p.set_defaults(func=funding)
+
+    p = commands.add_parser("find-k", help="empiric search for the number of clusters")
+    p.add_argument('--trials', type=int, default=5, help='numbers of trials per k')
+    p.add_argument('--max_k', type=int, default=120, help='maximum number of clusters to evaluate')
+    p.add_argument('--num_features', type=int, default=500, help='number of features')
+    p.add_argument('--lsa', type=int, default=None, help='search k in an LSA space with this number of components')
+    p.add_argument('--dedup', type=float, default=None, help='collapse near-duplicate awards above this Jaccard similarity (e.g. 0.8)')
+    p.add_argument('--engine', type=str, default="minibatch", help='k-means engine (minibatch, spherical)')
+    p.set_defaults(func=find_k)
+
+    p = commands.add_parser("cluster", help="cluster awards and save the model, assignments and UMAP plot")
+    p.add_argument('--k', type=int, required=True, help='number of clusters')
+    p.add_argument('--trials', type=int, default=1, help='number of trials')
+    p.add_argument('--results', type=str, default=None, help='results directory (default results/<timestamp>)')
+    p.add_argument('--no_umap', action='store_true', help='skip the UMAP visualization')
+    p.add_argument('--lsa', action='store_true', help='cluster in the LSA space cached by extract --lsa')
+    p.add_argument('--engine', type=str, default="minibatch", help='k-means engine (minibatch, spherical)')
+    p.add_argument('--profile', type=str, default=None, help='stage to profile, e.g. cluster/kmeans')
+    p.add_argument('--profiler', type=str, default="cprofile", help='profiler for --profile (cprofile, pyinstrument)')
+    p.set_defaults(func=cluster)
+
+    p = commands.add_parser("report", help="citations, funding projections, final_data.csv and supp_info.docx for a run")
+    p.add_argument('--results', type=str, required=True, help='results directory of a cluster run')
+    p.add_argument('--profile', type=str, default=None, help='stage to profile, e.g. report')
+    p.add_argument('--profiler', type=str, default="cprofile", help='profiler for --profile (cprofile, pyinstrument)')
+    p.set_defaults(func=report)
+
+    p = commands.add_parser("predict", help="assign new documents to the clusters of a run")
+    p.add_argument('--results', type=str, required=True, help='results directory of a cluster run')
+    p.add_argument('--input', type=str, required=True, help='pickle of awards (e.g. data/test-data.pkl) or text file with one document per line')
+    p.add_argument('--output', type=str, default=None, help='csv to write (default stdout)')
+    p.add_argument('--exact', action='store_true', help='tokenize with nltk through the fitted vectorizer (slower start-up)')
+    p.set_defaults(func=predict)
+
+    p = commands.add_parser("similar", help="most similar awards to new documents, from the LSH index of the features")
+    p.add_argument('--text', type=str, action='append', default=[], help='document to look up, repeatable')
+    p.add_argument('--input', type=str, default=None, help='text file with one document per line')
+    p.add_argument('--k', type=int, default=10, help='number of similar awards per document')
+    p.add_argument('--results', type=str, default=None, help='results directory of a cluster run, adds cluster labels')
+    p.add_argument('--features', type=str, default="data/processed-data.pkl", help='features to search (data/processed-data.pkl or data/lsa-embedding.npy)')
+    p.add_argument('--probes', type=int, default=4, help='extra buckets probed per hash table')
+    p.set_defaults(func=similar)
+
+    p = commands.add_parser("compare", help="ARI/NMI of cluster runs and stable topics across them")
+    p.add_argument('runs', nargs='+', help='results directories to compare, e.g. results/*')
+    p.add_argument('--reference', type=str, default=None, help='run whose topics are matched (default the first)')
+    p.add_argument('--threshold', type=float, default=0.5, help='minimum Jaccard overlap of a stable topic in every other run')
+    p.add_argument('--output', type=str, default=None, help='directory for pairwise.csv and topics.csv')
+    p.set_defaults(func=compare)
+
+    p = commands.add_parser("precision", help="validate float32 features against float64: memory, assignments and silhouettes")
+    p.add_argument('--k', type=int, required=True, help='number of clusters')
+    p.add_argument('--features', type=str, default="data/processed-data.pkl", help='features to validate (data/processed-data.pkl or data/lsa-embedding.npy)')
+    p.add_argument('--engine', type=str, default="minibatch", help='k-means engine (minibatch, spherical)')
+    p.add_argument('--seed', type=int, default=0, help='random seed of both fits')
+    p.add_argument('--max_label_change', type=float, default=0.01, help='largest accepted fraction of changed assignments')
+    p.add_argument('--silhouette_tolerance', type=float, default=1e-3, help='largest accepted difference of the mean silhouette')
+    p.set_defaults(func=precision)
+
+    p = commands.add_parser("evolve", help="cluster sliding fiscal-year windows in parallel and link their topics into a lineage table")
+    p.add_argument('--k', type=int, required=True, help='number of clusters per window')
+    p.add_argument('--window', type=int, default=5, help='fiscal years per window')
+    p.add_argument('--step', type=int, default=1, help='years between consecutive windows')
+    p.add_argument('--start_year', type=int, default=None, help='first fiscal year (default the first of the corpus)')
+    p.add_argument('--end_year', type=int, default=None, help='last fiscal year (default the last of the corpus)')
+    p.add_argument('--features', type=str, default="data/processed-data.pkl", help='features to cluster (data/processed-data.pkl or data/lsa-embedding.npy)')
+    p.add_argument('--engine', type=str, default="minibatch", help='k-means engine (minibatch, spherical)')
+    p.add_argument('--jobs', type=int, default=None, help='worker processes (default the number of CPUs, at most half the number of windows)')
+    p.add_argument('--threshold', type=float, default=0.5, help='minimum centroid cosine similarity of linked clusters')
+    p.add_argument('--results', type=str, default=None, help='output directory (default results/<timestamp>-evolution)')
+    p.add_argument('--seed', type=int, default=0, help='random seed')
+    p.set_defaults(func=evolve)
+    return parser
+
+if __name__ == "__main__":
+    FLAGS = build_parser().parse_args()
+    FLAGS.func(FLAGS)
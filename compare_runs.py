@@ -0,0 +1,218 @@
+import argparse
+import csv
+import glob
+import os
+import sys
+import numpy as np
+import perf
+
+def load_labels(save_folder):
+    """
+
+    Parameters
+    ----------
+    save_folder : string. directory of a cluster run
+
+    Returns
+    -------
+    ids : array of award ids (strings)
+    labels : int32 array. cluster label of each award
+    k : number of clusters
+
+    Reads labels.npy (with the ids of assignments.npz or of the award store), assignments.npz alone,
+    or, for runs saved before either existed, the per-cluster csvs clusters/cluster-<i>.csv
+    """
+    if os.path.exists("{}/labels.npy".format(save_folder)):
+        from run_artifact import ClusterRun
+        run = ClusterRun(save_folder)
+        labels = np.asarray(run.labels, dtype=np.int32)
+        if os.path.exists("{}/assignments.npz".format(save_folder)):
+            ids = np.load("{}/assignments.npz".format(save_folder))["id"]
+        else:
+            ids = np.array(run.awards.column("id"))
+        return ids.astype(str), labels, run.k
+    if os.path.exists("{}/assignments.npz".format(save_folder)):
+        arrays = np.load("{}/assignments.npz".format(save_folder))
+        labels = arrays["label"].astype(np.int32)
+        return arrays["id"].astype(str), labels, int(labels.max()) + 1 if len(labels) > 0 else 0
+    files = glob.glob("{}/clusters/cluster-*.csv".format(save_folder))
+    if len(files) == 0:
+        raise FileNotFoundError("{} has no labels.npy, assignments.npz or clusters/cluster-<i>.csv".format(save_folder))
+    ids, labels = [], []
+    for path in files:
+        label = int(os.path.basename(path)[len("cluster-"):-len(".csv")])
+        with open(path, newline='', encoding='utf8') as csvfile:
+            reader = csv.reader(csvfile)
+            column = next(reader).index("id")
+            for row in reader:
+                ids.append(row[column])
+                labels.append(label)
+    return np.array(ids, dtype=str), np.array(labels, dtype=np.int32), max(labels) + 1
+
+def load_terms(save_folder, n=5):
+    """
+    Top n centroid terms of each cluster, from top_terms.csv or the centroids file
+    """
+    if os.path.exists("{}/top_terms.csv".format(save_folder)):
+        with open("{}/top_terms.csv".format(save_folder), newline='', encoding='utf8') as csvfile:
+            return [row[1:n+1] for row in list(csv.reader(csvfile))[1:]]
+    terms = []
+    if os.path.exists("{}/centroids".format(save_folder)):
+        with open("{}/centroids".format(save_folder), encoding='utf8') as f:
+            for line in f:
+                if line.startswith("Cluster "):
+                    terms.append([term for term in line.split(":", 1)[1].strip().rstrip(",").split(", ")][:n])
+    return terms
+
+def align(runs):
+    """
+    Label matrix (runs x awards) over the union of the award ids of the runs, -1 where a run has no label
+    """
+    all_ids, inverse = np.unique(np.concatenate([ids for ids, labels, k in runs]), return_inverse=True)
+    matrix = np.full((len(runs), len(all_ids)), -1, dtype=np.int32)
+    start = 0
+    for r, (ids, labels, k) in enumerate(runs):
+        matrix[r, inverse[start:start+len(ids)]] = labels
+        start += len(ids)
+    return all_ids, matrix
+
+def contingency(a, b, ka, kb):
+    """
+    ka x kb table of the number of awards labeled i by one run and j by the other (awards of both runs)
+    """
+    both = (a >= 0) & (b >= 0)
+    return np.bincount(a[both].astype(np.int64) * kb + b[both], minlength=ka * kb).reshape(ka, kb)
+
+def adjusted_rand_index(table):
+    pairs = lambda x: x * (x - 1) / 2
+    n = table.sum()
+    index = pairs(table).sum()
+    rows, cols = pairs(table.sum(axis=1)).sum(), pairs(table.sum(axis=0)).sum()
+    expected = rows * cols / pairs(n) if n > 1 else 0.0
+    maximum = (rows + cols) / 2
+    return float((index - expected) / (maximum - expected)) if maximum != expected else 1.0
+
+def normalized_mutual_info(table):
+    """
+    Mutual information normalized by the arithmetic mean of the entropies (as in sklearn)
+    """
+    n = table.sum()
+    p_a, p_b = table.sum(axis=1) / n, table.sum(axis=0) / n
+    rows, cols = np.nonzero(table)
+    p = table[rows, cols] / n
+    mutual_info = np.sum(p * np.log(p / (p_a[rows] * p_b[cols])))
+    entropy = lambda q: -np.sum(q[q > 0] * np.log(q[q > 0]))
+    mean_entropy = (entropy(p_a) + entropy(p_b)) / 2
+    return float(mutual_info / mean_entropy) if mean_entropy > 0 else 1.0
+
+def match_clusters(table):
+    """
+
+    Parameters
+    ----------
+    table : contingency table of two runs
+
+    Returns
+    -------
+    match : index of the matched cluster of the second run for each cluster of the first run (-1 if unmatched)
+    jaccard : Jaccard overlap of each cluster of the first run with its match (0 if unmatched)
+
+    Hungarian algorithm on the Jaccard overlap matrix: the one-to-one matching with the largest total overlap
+    """
+    from scipy.optimize import linear_sum_assignment
+    sizes_a, sizes_b = table.sum(axis=1), table.sum(axis=0)
+    overlap = table / np.maximum(sizes_a[:, None] + sizes_b[None, :] - table, 1)
+    rows, cols = linear_sum_assignment(-overlap)
+    match = np.full(table.shape[0], -1)
+    jaccard = np.zeros(table.shape[0])
+    match[rows] = cols
+    jaccard[rows] = overlap[rows, cols]
+    return match, jaccard
+
+def compare_runs(folders, reference=None, threshold=0.5, output_folder=None):
+    """
+
+    Parameters
+    ----------
+    folders : list of strings. results directories of cluster runs
+    reference : string. run whose clusters are matched against every other run (default the first)
+    threshold : minimum Jaccard overlap of a stable topic with its match in every other run
+    output_folder : string. optional directory for pairwise.csv and topics.csv
+
+    Returns
+    -------
+    pairwise : list of dictionaries with the ARI and NMI of each pair of runs
+    topics : list of dictionaries with the matches and stability of each cluster of the reference run
+
+    """
+    names = [os.path.basename(os.path.normpath(folder)) for folder in folders]
+    with perf.timer("load", items=len(folders)):
+        runs = [load_labels(folder) for folder in folders]
+    with perf.timer("align"):
+        ids, matrix = align(runs)
+    ks = [k for ids, labels, k in runs]
+
+    # Pairwise agreement from one contingency table per pair
+    pairwise = []
+    with perf.timer("pairwise", items=len(runs) * (len(runs) - 1) // 2):
+        for a in range(len(runs)):
+            for b in range(a + 1, len(runs)):
+                table = contingency(matrix[a], matrix[b], ks[a], ks[b])
+                pairwise.append({"run_a": names[a], "run_b": names[b], "k_a": ks[a], "k_b": ks[b], "awards": int(table.sum()),
+                                 "ari": adjusted_rand_index(table), "nmi": normalized_mutual_info(table)})
+
+    # Topics of the reference run matched in every other run
+    r = folders.index(reference) if reference is not None else 0
+    others = [i for i in range(len(runs)) if i != r]
+    matches, overlaps = [], []
+    with perf.timer("match", items=len(others)):
+        for i in others:
+            match, jaccard = match_clusters(contingency(matrix[r], matrix[i], ks[r], ks[i]))
+            matches.append(match)
+            overlaps.append(jaccard)
+    overlaps = np.array(overlaps).reshape(len(others), ks[r])
+    terms = load_terms(folders[r])
+    sizes = np.bincount(runs[r][1], minlength=ks[r])
+    topics = []
+    for j in range(ks[r]):
+        topic = {"cluster": j, "size": int(sizes[j]), "terms": " ".join(terms[j]) if j < len(terms) else "",
+                 "mean_jaccard": float(overlaps[:, j].mean()) if others else 1.0,
+                 "min_jaccard": float(overlaps[:, j].min()) if others else 1.0}
+        topic["stable"] = topic["min_jaccard"] >= threshold
+        for i, match, jaccard in zip(others, matches, overlaps):
+            topic[names[i]] = int(match[j])
+            topic[names[i] + "_jaccard"] = round(float(jaccard[j]), 4)
+        topics.append(topic)
+
+    if output_folder is not None:
+        os.makedirs(output_folder, exist_ok=True)
+        for rows, name in [(pairwise, "pairwise.csv"), (topics, "topics.csv")]:
+            with open("{}/{}".format(output_folder, name), 'w', newline='', encoding='utf8') as csvfile:
+                writer = csv.DictWriter(csvfile, list(rows[0].keys()) if rows else [])
+                writer.writeheader()
+                writer.writerows(rows)
+    return pairwise, topics
+
+def print_comparison(pairwise, topics, output=sys.stdout):
+    """
+    Pairwise ARI/NMI and the stable and unstable topics of the reference run
+    """
+    output.write("{:<24} {:<24} {:>5} {:>5} {:>8} {:>6} {:>6}\n".format("run_a", "run_b", "k_a", "k_b", "awards", "ARI", "NMI"))
+    for pair in pairwise:
+        output.write("{run_a:<24} {run_b:<24} {k_a:>5} {k_b:>5} {awards:>8} {ari:>6.3f} {nmi:>6.3f}\n".format(**pair))
+    for stable in [True, False]:
+        selected = sorted([topic for topic in topics if topic["stable"] == stable], key=lambda topic: -topic["min_jaccard"])
+        output.write("\n{} topics ({}):\n".format("Stable" if stable else "Unstable", len(selected)))
+        for topic in selected:
+            output.write("  {cluster:>3} (n={size}, min Jaccard {min_jaccard:.2f}, mean {mean_jaccard:.2f}) {terms}\n".format(**topic))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('runs', nargs='+', help='results directories to compare, e.g. results/*')
+    parser.add_argument('--reference', type=str, default=None, help='run whose topics are matched (default the first)')
+    parser.add_argument('--threshold', type=float, default=0.5, help='minimum Jaccard overlap of a stable topic in every other run')
+    parser.add_argument('--output', type=str, default=None, help='directory for pairwise.csv and topics.csv')
+    FLAGS, unparsed = parser.parse_known_args()
+
+    pairwise, topics = compare_runs(FLAGS.runs, FLAGS.reference, FLAGS.threshold, FLAGS.output)
+    print_comparison(pairwise, topics)
@@ -1,12 +1,18 @@
+import os
+import re
 import csv
-from sklearn.feature_extraction.text import TfidfVectorizer
-import matplotlib
-matplotlib.use('TkAgg')
+import json
+import shutil
 import pickle
-import numpy as np
-from nltk import word_tokenize
-from nltk.stem import WordNetLemmatizer, PorterStemmer
 import argparse
+import numpy as np
+import perf
+from award_table import AwardTable, FIELDS, as_table
+from funding_cube import FundingCube, TEST_YEAR
+from award_store import DB_FILE, build_store, connect
+from near_duplicates import collapse, save_groups, clear_groups
+from lsa import fit_lsa, clear_lsa
+from precision import DTYPES, compact
 
 def mk_int(s):
     """
@@ -33,57 +39,52 @@ def process_data(data_file):
 
     Returns
     -------
-    data : list of dictionaries representing awards until 2020
-    test_data : list of dictionaries representing awards in 2021
+    data : AwardTable of awards until 2020
+    test_data : AwardTable of awards in 2021
 
     """
-    data = []
+    columns = {field: [] for field in FIELDS}
     with open(data_file, newline='', encoding='utf8') as csvfile:
         reader = csv.reader(x.replace('\0', '') for x in csvfile)
-        raw_data = list(reader)
-        ids = []
-        print("Raw data N: {}".format(str(len(raw_data))))
+        header = next(reader)
         c = {}
-        for j in range(len(raw_data[0])):
-            c[raw_data[0][j]] = j
-        for i in range(1,len(raw_data)):
-            if len(raw_data[i][c["direct_cost_amt"]]) <= 1:
+        for j in range(len(header)):
+            c[header[j]] = j
+        ids = set()
+        raw_n = 1
+        for row in reader:
+            raw_n += 1
+            if len(row[c["direct_cost_amt"]]) <= 1:
                 continue
-            elif ("No abstract available" in raw_data[i][c["abstract_text"]]) or len(raw_data[i][c["abstract_text"]])==0:
+            elif ("No abstract available" in row[c["abstract_text"]]) or len(row[c["abstract_text"]])==0:
                 continue
-            elif (raw_data[i][c["appl_id"]] in ids) or (raw_data[i][c["activity_code"]][0] in ['Z','T']):
+            elif (row[c["appl_id"]] in ids) or (row[c["activity_code"]][0] in ['Z','T']):
                 continue
             else:
-                ids.append(raw_data[i][c["appl_id"]])
-            abstract = raw_data[i][c["abstract_text"]].replace('\n',' ')
-            title = raw_data[i][c["project_title"]]
-            relevance = raw_data[i][c["phr_text"]].replace('\n',' ')
-            data.append({
-                "text": title + " " + abstract + " " + relevance,
-                "title": title,
-                "id": raw_data[i][c["appl_id"]],
-                "project_number": raw_data[i][c["project_num"]][1:].split("-")[0],
-                "terms": raw_data[i][c["terms"]].split(";"),
-                "administration": raw_data[i][c["agency_ic_admin_abbreviation"]],
-                "organization": raw_data[i][c["organization_org_name"]],
-                "mechanism": raw_data[i][c["activity_code"]],
-                "year": raw_data[i][c["fiscal_year"]],
-                "award_amount": mk_int(raw_data[i][c["award_amount"]]),
-                "cong_dist": raw_data[i][c["cong_dist"]]
-                })
-
-    new_data = []
-    for item in data:
-        if item["award_amount"] != 0:
-            new_data.append(item)
-
-    data = []
-    test_data = []
-    for item in new_data:
-        if item["year"] != "2021":
-            data.append(item)
-        else:
-            test_data.append(item)
+                ids.add(row[c["appl_id"]])
+            amount = mk_int(row[c["award_amount"]])
+            if amount == 0:
+                continue
+            abstract = row[c["abstract_text"]].replace('\n',' ')
+            title = row[c["project_title"]]
+            relevance = row[c["phr_text"]].replace('\n',' ')
+            columns["text"].append(title + " " + abstract + " " + relevance)
+            columns["title"].append(title)
+            columns["id"].append(row[c["appl_id"]])
+            columns["project_number"].append(row[c["project_num"]][1:].split("-")[0])
+            columns["terms"].append(row[c["terms"]].split(";"))
+            columns["administration"].append(row[c["agency_ic_admin_abbreviation"]])
+            columns["organization"].append(row[c["organization_org_name"]])
+            columns["mechanism"].append(row[c["activity_code"]])
+            columns["year"].append(row[c["fiscal_year"]])
+            columns["award_amount"].append(amount)
+            columns["cong_dist"].append(row[c["cong_dist"]])
+        print("Raw data N: {}".format(str(raw_n)))
+
+    awards = AwardTable.from_columns(columns)
+    is_test = awards.column("year") == "2021"
+    data = awards.take(~is_test)
+    test_data = awards.take(is_test)
 
     with open("data/data.pkl", 'wb') as handle:
         pickle.dump(data, handle)
@@ -96,21 +97,229 @@ def process_data(data_file):
 
 class LemmaStemmerTokenizer:
     """
-    Tokenizer that lemmatizes and stems words
+    Tokenizer that lemmatizes and stems words. With a cache (a dictionary of tokens by document, e.g. shared
+    by the extractions of a batch) each document is tokenized once; the cache is not pickled with the vectorizer.
+    Each distinct word is lemmatized once, and the words whose lemma differs are saved with the TF-IDF table
+    (TfidfTransform) for predicting without nltk.
     """
-    def __init__(self):
+    def __init__(self, cache=None):
+        from nltk.stem import WordNetLemmatizer, PorterStemmer
         self.wnl = WordNetLemmatizer()
         self.ps = PorterStemmer()
+        self.cache = cache
+        self.lemmas = {}
     def __call__(self, doc):
+        from nltk import word_tokenize
+        if self.cache is not None and doc in self.cache:
+            return self.cache[doc]
         # leaving out stemming for now
-        return [self.wnl.lemmatize(t).lower() for t in word_tokenize(doc) if (t.isalpha() and len(t) > 1)]
+        lemmas = self.lemmas
+        tokens = []
+        for t in word_tokenize(doc):
+            if t.isalpha() and len(t) > 1:
+                if t not in lemmas:
+                    lemmas[t] = self.wnl.lemmatize(t).lower()
+                tokens.append(lemmas[t])
+        if self.cache is not None:
+            self.cache[doc] = tokens
+        return tokens
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["cache"] = None
+        state["lemmas"] = {}
+        return state
+    def __setstate__(self, state):
+        # Loaded vectorizers (including those saved with a cache) never cache
+        self.__dict__.update(state)
+        self.cache = None
+        self.lemmas = {}
+
+# nltk.word_tokenize without nltk, for the alphabetic tokens LemmaStemmerTokenizer keeps: the padding rules of
+# nltk's treebank tokenizer, with a period before whitespace ending a sentence unless it ends an abbreviation
+STARTING_QUOTE = re.compile(r"(?i)(?<!\w)'(?!(?:re|ve|ll|m|t|s|d|n)\b)(?=\w)")
+PUNCTUATION = re.compile(r"[«“‘„`»”’\";@#$%&?!*()\[\]{}<>‒-―]|\.{2,}|--|[:,](?!\d)")
+FINAL_PERIOD = re.compile(r"([^\s.]+)\.(?=[\]\)}>\"'»”’]*(?:\s|$))")
+ABBREVIATIONS = {"al", "approx", "co", "corp", "dept", "dr", "drs", "etc", "fig", "figs", "inc", "jr", "ltd", "mr", "mrs", "prof", "rev", "st", "vol", "vs"}
+CLITIC = re.compile(r"(?<=[^'\s])('[sS]|'[mM]|'[dD]|'ll|'LL|'re|'RE|'ve|'VE|n't|N'T|')(?=\s)")
+CONTRACTIONS = [re.compile(pattern, re.I) for pattern in [
+    r"\b(can)(not)\b", r"\b(d)('ye)\b", r"\b(gim)(me)\b", r"\b(gon)(na)\b", r"\b(got)(ta)\b",
+    r"\b(lem)(me)\b", r"\b(more)('n)\b", r"\b(wan)(na)(?=\s)", r" ('t)(is)\b", r" ('t)(was)\b"]]
+
+def split_words(doc):
+    """
+    Tokens of a document as nltk.word_tokenize splits it, up to the sentence ends its punkt model detects
+    """
+    doc = STARTING_QUOTE.sub("' ", doc)
+    doc = PUNCTUATION.sub(r" \g<0> ", doc)
+    doc = FINAL_PERIOD.sub(lambda m: m.group(0) if m.group(1).lower() in ABBREVIATIONS else m.group(1) + " . ", doc) + " "
+    doc = CLITIC.sub(r" \1", doc)
+    for pattern in CONTRACTIONS:
+        doc = pattern.sub(r" \1 \2 ", doc)
+    return doc.split()
+
+class TableTokenizer:
+    """
+    LemmaStemmerTokenizer without nltk, for prediction: words are split by split_words and lemmatized from the
+    table of the words whose lemma differed when the vectorizer was fitted. Other words are kept, as WordNet
+    keeps the words it does not know, so only unseen inflections of known words are tokenized differently.
+
+    Parameters
+    ----------
+    lemmas : dictionary of lemmas by word
+    """
+    def __init__(self, lemmas):
+        self.lemmas = lemmas
+    def __call__(self, doc):
+        lemmas = self.lemmas
+        return [lemmas.get(t, t) for t in split_words(doc) if (t.isalpha() and len(t) > 1)]
+
+# Vocabulary, idf, settings and lemma table of the fitted vectorizer, for transforming new documents
+# without nltk or sklearn (importing both takes ~0.8s, most of the start-up of cli.py predict)
+TFIDF_FILE = "data/tfidf.npz"
+
+class TfidfTransform:
+    """
+    The transform of a fitted TfidfVectorizer (word analyzer with LemmaStemmerTokenizer) rebuilt from its
+    vocabulary, idf, stop words and lemma table with numpy and scipy only. With the same tokens it gives the
+    same matrix as vectorizer.transform.
+
+    Parameters
+    ----------
+    terms : array of the feature terms, in column order
+    idf : idf weight of each term
+    stop_words : removed tokens
+    lemmas : dictionary of lemmas by word (see TableTokenizer)
+    ngram_range : (min_n, max_n) of the word n-grams
+    norm : "l2", "l1" or None
+    sublinear_tf : use 1 + log(tf)
+    dtype : dtype of the output values
+    """
+    def __init__(self, terms, idf, stop_words, lemmas, ngram_range=(1, 2), norm="l2", sublinear_tf=False, dtype=np.float64):
+        self.terms = np.asarray(terms)
+        self.idf = np.asarray(idf)
+        self.stop_words = frozenset(stop_words)
+        self.tokenizer = TableTokenizer(lemmas)
+        self.ngram_range = tuple(ngram_range)
+        self.norm = norm
+        self.sublinear_tf = sublinear_tf
+        self.dtype = np.dtype(dtype)
+        self.index = {term: i for i, term in enumerate(self.terms.tolist())}
+
+    @classmethod
+    def from_vectorizer(cls, vectorizer):
+        terms = np.empty(len(vectorizer.vocabulary_), dtype=object)
+        for term, i in vectorizer.vocabulary_.items():
+            terms[i] = term
+        lemmas = {word: lemma for word, lemma in vectorizer.tokenizer.lemmas.items() if lemma != word}
+        return cls(terms.astype(str), vectorizer.idf_, vectorizer.get_stop_words() or (), lemmas,
+                   vectorizer.ngram_range, vectorizer.norm, vectorizer.sublinear_tf, vectorizer.dtype)
+
+    def save(self, path=TFIDF_FILE):
+        words = sorted(self.tokenizer.lemmas)
+        np.savez(path, terms=self.terms, idf=self.idf, stop_words=np.array(sorted(self.stop_words), dtype=str),
+                 words=np.array(words, dtype=str), lemmas=np.array([self.tokenizer.lemmas[word] for word in words], dtype=str),
+                 ngram_range=np.array(self.ngram_range), norm=str(self.norm), sublinear_tf=self.sublinear_tf, dtype=str(self.dtype))
+
+    @classmethod
+    def load(cls, path=TFIDF_FILE):
+        arrays = np.load(path)
+        norm = str(arrays["norm"])
+        return cls(arrays["terms"], arrays["idf"], arrays["stop_words"].tolist(), dict(zip(arrays["words"].tolist(), arrays["lemmas"].tolist())),
+                   arrays["ngram_range"].tolist(), None if norm == "None" else norm, bool(arrays["sublinear_tf"]), str(arrays["dtype"]))
+
+    def ngrams(self, doc):
+        """
+        Word n-grams of a document, as built by sklearn's word analyzer (lowercase, tokens, stop words, n-grams)
+        """
+        tokens = [t for t in self.tokenizer(doc.lower()) if t not in self.stop_words]
+        min_n, max_n = self.ngram_range
+        grams = list(tokens) if min_n == 1 else []
+        for n in range(max(min_n, 2), min(max_n, len(tokens)) + 1):
+            grams += [" ".join(tokens[i:i+n]) for i in range(len(tokens) - n + 1)]
+        return grams
+
+    def transform(self, texts):
+        import scipy.sparse as sp
+        columns, indptr = [], [0]
+        for doc in texts:
+            columns += [self.index[gram] for gram in self.ngrams(doc) if gram in self.index]
+            indptr.append(len(columns))
+        X = sp.csr_matrix((np.ones(len(columns), dtype=self.dtype), np.array(columns, dtype=np.int32), np.array(indptr)),
+                          shape=(len(indptr) - 1, len(self.terms)))
+        X.sum_duplicates()
+        if self.sublinear_tf:
+            X.data = np.log(X.data) + 1
+        X.data *= self.idf[X.indices].astype(self.dtype)
+        if self.norm is not None:
+            rows = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+            lengths = np.sqrt(np.bincount(rows, weights=X.data**2, minlength=X.shape[0])) if self.norm == "l2" \
+                else np.bincount(rows, weights=np.abs(X.data), minlength=X.shape[0])
+            lengths[lengths == 0] = 1
+            X.data /= lengths[rows].astype(self.dtype)
+        return X
 
-def feature_extraction(data, num_features, max_df):
+def load_transform():
+    """
+    The TfidfTransform of TFIDF_FILE when it was saved with data/vectorizer.pkl, else the vectorizer itself
+    """
+    if os.path.exists(TFIDF_FILE) and os.path.getmtime(TFIDF_FILE) >= os.path.getmtime("data/vectorizer.pkl"):
+        return TfidfTransform.load()
+    return pickle.load(open("data/vectorizer.pkl","rb"))
+
+def vectorize(data, num_features, max_df, dedup=None, tokenizer=None, precision="float64"):
+    """
+
+    Parameters
+    ----------
+    data : AwardTable, parallels "data" from process_data
+    num_features, max_df : vocabulary size and maximum document frequency of the TF-IDF vectorizer
+    dedup : float. optional Jaccard threshold; near-duplicate awards (resubmissions, renewals) are collapsed
+        into one representative before vectorizing
+    tokenizer : LemmaStemmerTokenizer. optional, e.g. with a token cache shared between several extractions
+    precision : string. "float64", or "float32" for float32 TF-IDF values (see precision.py);
+        the vectorizer keeps the dtype for new documents
+
+    Returns
+    -------
+    vectorizer : fitted TfidfVectorizer
+    processed_text : TF-IDF matrix of the awards (of the group representatives with dedup)
+    groups : near-duplicate groups (see near_duplicates.collapse), or None without dedup
+
+    Nothing is saved, see feature_extraction.
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    data = as_table(data)
+    groups = None
+    if dedup is not None:
+        with perf.timer("dedup", items=len(data)):
+            groups = collapse(data, dedup)
+        print("Near-duplicates collapsed: {} awards in {} groups".format(len(data), len(groups["representatives"])))
+        data = data.take(groups["representatives"])
+    input_text = data.column("text")
+    print("Vectorizing...")
+    tokenizer = tokenizer if tokenizer is not None else LemmaStemmerTokenizer()
+    vectorizer = TfidfVectorizer(tokenizer=tokenizer, stop_words='english', ngram_range=(1,2), max_df=max_df, max_features=num_features, dtype=DTYPES[precision])
+    if tokenizer.cache is not None:
+        # Counted here, so the tokenizer itself records nothing per document (it sees preprocessed text)
+        preprocess = vectorizer.build_preprocessor()
+        perf.count("tokenize/cache_hits", sum(preprocess(text) in tokenizer.cache for text in input_text))
+    # fit_transform tokenizes each document once; the timer covers tokenizing and vectorizing
+    with perf.timer("fit", items=len(input_text)):
+        processed_text = compact(vectorizer.fit_transform(input_text), DTYPES[precision])
+    return vectorizer, processed_text, groups
+
+def feature_extraction(data, num_features, max_df, dedup=None, lsa=None, tokenizer=None, precision="float64"):
     """
 
     Parameters
     ----------
-    data : parallels "data" from process_data
+    data : AwardTable, parallels "data" from process_data
+    dedup : float. optional Jaccard threshold; near-duplicate awards (resubmissions, renewals) are collapsed
+        into one representative before vectorizing and the groups are saved to data/groups.npz
+    lsa : int. optional number of LSA (TruncatedSVD) components to fit and cache (see lsa.py)
+    tokenizer : LemmaStemmerTokenizer. optional, e.g. with a token cache shared between several extractions
+    precision : string. "float64", or "float32" for float32 TF-IDF values (see precision.py);
+        the vectorizer keeps the dtype for new documents
 
     Returns
     -------
@@ -119,18 +328,25 @@ def feature_extraction(data, num_features, max_df):
         year - one-hot encoded year
         text - tfidf for all text data
     """
-    input_text = [item["text"] for item in data]
-    print("Vectorizing...")
-    vectorizer = TfidfVectorizer(tokenizer=LemmaStemmerTokenizer(), stop_words='english', ngram_range=(1,2), max_df=max_df, max_features=num_features).fit(input_text)
-    processed_text = vectorizer.transform(input_text)
+    vectorizer, processed_text, groups = vectorize(data, num_features, max_df, dedup, tokenizer, precision)
+    if groups is not None:
+        save_groups(groups)
+    else:
+        clear_groups()
 
     with open("data/processed-data.pkl", 'wb') as handle:
         pickle.dump(processed_text, handle)
 
     with open("data/vectorizer.pkl", 'wb') as handle:
         pickle.dump(vectorizer, handle)
+    TfidfTransform.from_vectorizer(vectorizer).save()
     print("Data vectorized.")
 
+    if lsa is not None:
+        fit_lsa(lsa)
+    else:
+        clear_lsa()
+
 def get_features():
     """
     Parameters
@@ -151,6 +367,149 @@ def get_features():
         centroid_file.write("\n")
     centroid_file.close()
 
+def funding_summary(data, key, label, output_file, name_map=None):
+    """
+
+    Parameters
+    ----------
+    data : AwardTable, parallels "data" from process_data
+    key : string. categorical award field to group by ("administration", "year" or "mechanism")
+    label : string. header of the grouping column
+    output_file : path to csv
+    name_map : dictionary. optional display names for group values
+
+    Returns
+    -------
+    A csv file with the number and value of awards for each group
+    """
+    FundingCube.from_tables(as_table(data)).write_summary(key, label, output_file, name_map)
+
+def funding_summaries(data, test_data, name_map=None, cube_file="data/funding_cube.npz", store=None):
+    """
+
+    Parameters
+    ----------
+    data : AwardTable, parallels "data" from process_data
+    test_data : AwardTable, parallels "test_data" from process_data
+    name_map : dictionary. optional display names for funders
+    cube_file : path to save the funder x year x mechanism cube of all awards (test year included)
+    store : optional path of the award database (award_store.py); the cube is then a grouped query of its awards table
+
+    Returns
+    -------
+    by_funder.csv, by_year.csv and by_mechanism.csv for the awards until 2020, sliced from the cube
+    """
+    if store is not None:
+        conn = connect(store)
+        cube = FundingCube.from_store(conn)
+        conn.close()
+    else:
+        cube = FundingCube.from_tables(as_table(data), as_table(test_data))
+    cube.save(cube_file)
+    train = cube.exclude(year=TEST_YEAR)
+    train.write_summary("administration", "Funder", "data/by_funder.csv", name_map)
+    train.write_summary("year", "Year", "data/by_year.csv")
+    train.write_summary("mechanism", "Mechanism", "data/by_mechanism.csv")
+    return cube
+
+def get_funder_map(funder_file="data/nih_institutes.csv"):
+    """
+    Map of NIH institute abbreviations to full names
+    """
+    funder_map = {}
+    with open(funder_file, newline='', encoding='utf8') as csvfile:
+        raw_data = list(csv.reader(csvfile))
+        for i in range(1, len(raw_data)):
+            funder_map[raw_data[i][0]] = raw_data[i][1]
+    return funder_map
+
+def run_extraction(max_features, max_df, file='data/raw_data.csv', dedup=None, lsa=None, tokenizer=None, precision="float64", store=False):
+    """
+    Processes the raw RePORTER data, extracts TF-IDF features and summarizes funding.
+    With store, the award database is (re)built from the new data and the summaries are queried from it.
+    """
+    with perf.timer("process_data"):
+        data, test_data = process_data(file)
+    if store:
+        with perf.timer("store"):
+            build_store()
+    with perf.timer("feature_extraction"):
+        feature_extraction(data, max_features, max_df, dedup, lsa, tokenizer, precision)
+        get_features()
+    # data = data + test_data
+
+    with perf.timer("summaries"):
+        # By funder, year and mechanism in one pass
+        funding_summaries(data, test_data, get_funder_map(), store=DB_FILE if store else None)
+    perf.save("data/perf-feature_extraction.json")
+    return data, test_data
+
+def query_membership(file='data/raw_data.csv'):
+    """
+    Names of the queries matching each award (appl_id) of a batch download (nih_reporter_query.py --queries)
+    """
+    membership = {}
+    with open(file, newline='', encoding='utf8') as csvfile:
+        reader = csv.reader(x.replace('\0', '') for x in csvfile)
+        header = next(reader)
+        if "queries" not in header:
+            raise ValueError("{} has no queries column, download it with nih_reporter_query.py --queries".format(file))
+        c_id, c_queries = header.index("appl_id"), header.index("queries")
+        for row in reader:
+            membership[row[c_id]] = row[c_queries].split(";")
+    return membership
+
+def run_batch_extraction(max_features, max_df, file='data/raw_data.csv', dedup=None, lsa=None, queries_file='data/queries.json', folder='queries', precision="float64", store=False):
+    """
+    Batch mode: processes and vectorizes the union of the queries once in data/, then writes the awards
+    of each query to folder/<name>/data/ (data.pkl, test-data.pkl, features and funding summaries) with
+    the shared publications, citations and institute names, ready for analyze_clusters.py or
+    cli.py run from folder/<name>. All extractions of the batch share one tokenizer cache, so each abstract
+    is tokenized once; the cache holds the tokens of the union and is dropped when the batch is done.
+    """
+    queries = json.load(open(queries_file, encoding="utf8"))
+    tokenizer = LemmaStemmerTokenizer(cache={})
+    data, test_data = run_extraction(max_features, max_df, file, dedup, lsa, tokenizer, precision, store)
+    membership = query_membership(file)
+
+    cwd = os.getcwd()
+    for query in queries:
+        name = query["name"]
+        subset = data.take([name in membership[i] for i in data.column("id")])
+        test_subset = test_data.take([name in membership[i] for i in test_data.column("id")])
+        workdir = os.path.join(folder, name)
+        os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+        for path in ["data/publications.csv", "data/citations.csv", "data/nih_institutes.csv"]:
+            if os.path.exists(path):
+                share_file(path, workdir)
+
+        os.chdir(workdir) # the extraction functions read and write data/ relative to the working directory
+        try:
+            with perf.timer("query:{}".format(name), items=len(subset)):
+                with open("data/data.pkl", 'wb') as handle:
+                    pickle.dump(subset, handle)
+                with open("data/test-data.pkl", 'wb') as handle:
+                    pickle.dump(test_subset, handle)
+                feature_extraction(subset, max_features, max_df, dedup, lsa, tokenizer, precision)
+                get_features()
+                funding_summaries(subset, test_subset, get_funder_map())
+        finally:
+            os.chdir(cwd)
+        print("Query {}: {} awards ({} in {}) in {}".format(name, len(subset), len(test_subset), TEST_YEAR, workdir))
+    perf.save("data/perf-feature_extraction.json")
+
+def share_file(path, folder):
+    """
+    Hard link (or copy, across file systems) of path under folder
+    """
+    target = os.path.join(folder, path)
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(path, target)
+    except OSError:
+        shutil.copyfile(path, target)
+
 if __name__ == "__main__":
     # Arguments: maximum number of features and maximum document frequency 
     parser = argparse.ArgumentParser()
@@ -168,52 +527,38 @@ if __name__ == "__main__":
         help='maximum document frequency',
         default=0.5,
         )
+    parser.add_argument(
+        '--dedup',
+        type=float,
+        help='collapse near-duplicate awards with at least this estimated Jaccard similarity before vectorizing (e.g. 0.8)',
+        default=None,
+        )
+    parser.add_argument(
+        '--lsa',
+        type=int,
+        help='also fit and cache an LSA embedding with this number of components (e.g. 100)',
+        default=None,
+        )
+    parser.add_argument(
+        '--precision',
+        type=str,
+        help='float64, or float32 for float32 features through clustering (see precision.py)',
+        default="float64",
+        )
+    parser.add_argument(
+        '--batch',
+        action='store_true',
+        help='also extract the awards of each query of a batch download (data/queries.json) to queries/<name>/data',
+        )
+    parser.add_argument(
+        '--store',
+        action='store_true',
+        help='build the award database (data/awards.db) after processing the data and summarize funding from it',
+        )
     FLAGS, unparsed = parser.parse_known_args()
     
-    
     # Feature extraction
-    file = 'data/raw_data.csv'
-    data, test_data = process_data(file)
-    feature_extraction(data, FLAGS.max_features, FLAGS.max_df)
-    get_features()
-    # data = data + test_data
-
-    # By Funder
-    funder_map = {}
-    with open("data/nih_institutes.csv", newline='', encoding='utf8') as csvfile:
-        raw_data = list(csv.reader(csvfile))
-        for i in range(1, len(raw_data)):
-            funder_map[raw_data[i][0]] = raw_data[i][1]
-    
-    funders = np.unique(np.array([item["administration"] for item in data]))
-    output = [["Funder", "Number of awards", "Value of awards"]]
-    for funder in funders:
-        count = len([item for item in data if item["administration"] == funder])
-        amount = sum([item["award_amount"] for item in data if item["administration"] == funder])
-        funder = funder_map[funder] if (funder in funder_map) else funder
-        output.append([funder, count, amount])
-    with open('data/by_funder.csv', 'w', newline='', encoding='utf8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerows(output)
-
-    # By Year
-    years = np.unique(np.array([item["year"] for item in data]))
-    output = [["Year", "Number of awards", "Value of awards"]]
-    for year in years:
-        count = len([item for item in data if item["year"] == year])
-        amount = sum([item["award_amount"] for item in data if item["year"] == year])
-        output.append([year, count, amount])
-    with open('data/by_year.csv', 'w', newline='', encoding='utf8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerows(output)
-    
-    # By Mechanism
-    mechanisms = np.unique(np.array([item["mechanism"] for item in data]))
-    output = [["Mechanism", "Number of awards", "Value of awards"]]
-    for mech in mechanisms:
-        count = len([item for item in data if item["mechanism"] == mech])
-        amount = sum([item["award_amount"] for item in data if item["mechanism"] == mech])
-        output.append([mech, count, amount])
-    with open('data/by_mechanism.csv', 'w', newline='', encoding='utf8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerows(output)
+    if FLAGS.batch:
+        run_batch_extraction(FLAGS.max_features, FLAGS.max_df, dedup=FLAGS.dedup, lsa=FLAGS.lsa, precision=FLAGS.precision, store=FLAGS.store)
+    else:
+        run_extraction(FLAGS.max_features, FLAGS.max_df, dedup=FLAGS.dedup, lsa=FLAGS.lsa, precision=FLAGS.precision, store=FLAGS.store)
@@ -1,15 +1,20 @@
-from sklearn.cluster import MiniBatchKMeans
-import pickle
 import numpy as np
-from sklearn import metrics
-import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-from feature_extraction import feature_extraction
+from feature_extraction import vectorize
+from award_table import load_awards
+from lsa import reduce
+from spherical_kmeans import SphericalKMeans
 import argparse
-from pylab import *
+import perf
+
+def find_k(data, trials, k, sample_weight=None, engine="minibatch"):
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn import metrics
+    import pandas as pd
+    import seaborn as sns
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
 
-def find_k(data, trials, k):
     # Test different cluster sizes
     init_vals = np.random.choice(np.arange(100), size=10, replace=False)
     silhouette_vals = []
@@ -19,9 +24,14 @@ def find_k(data, trials, k):
     for selected_k in np.array(clusters):
       print("Cluster: {}".format(str(selected_k)))
       for i in np.arange(trials):
-        km = MiniBatchKMeans(n_clusters=selected_k, init='k-means++', verbose=0, max_no_improvement=None)
-        km.fit(data)
-        score = metrics.silhouette_score(data, km.labels_)
+        if engine == "spherical":
+            km = SphericalKMeans(n_clusters=selected_k, init='k-means++')
+        else:
+            km = MiniBatchKMeans(n_clusters=selected_k, init='k-means++', verbose=0, max_no_improvement=None)
+        with perf.timer("fit"):
+            km.fit(data, sample_weight=sample_weight)
+        with perf.timer("silhouette"):
+            score = metrics.silhouette_score(data, km.labels_, metric="cosine" if engine == "spherical" else "euclidean")
         silhouette_vals.append(score)
         print("Rep: {}, Score: {}".format(str(i), str(score)))
         sse_vals.append(km.inertia_)
@@ -46,6 +56,21 @@ def find_k(data, trials, k):
     ax.set(xlabel='Number of Clusters', ylabel='Sum of Squared Errors')
     plt.savefig('figures/k_selection_sse.eps', format='eps')
 
+def run_find_k(trials, max_k, features, lsa=None, engine="minibatch", dedup=None):
+    """
+    Extracts features with the given number of features (and dedup threshold) in memory and runs the
+    empiric search for k, in the LSA space with lsa components if given. The features, groups and LSA
+    space saved in data/ by feature_extraction are left as they are.
+    """
+    data = load_awards("data/data.pkl")
+    with perf.timer("feature_extraction"):
+        vectorizer, processed, groups = vectorize(data, features, 0.1, dedup)
+        if lsa is not None:
+            processed = reduce(processed, lsa)[0]
+    with perf.timer("find_k"):
+        find_k(processed, trials, max_k, None if groups is None else groups["weights"], engine=engine)
+    perf.save("data/perf-find_k.json")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -69,11 +94,23 @@ if __name__ == "__main__":
         help='maximum number of clusters to evaluate',
         default=1000,
         )
+    parser.add_argument(
+        '--lsa',
+        type=int,
+        help='cluster in an LSA space with this number of components (e.g. 100)',
+        default=None,
+        )
+    parser.add_argument(
+        '--dedup',
+        type=float,
+        help='collapse near-duplicate awards above this Jaccard similarity before vectorizing (e.g. 0.8)',
+        default=None,
+        )
+    parser.add_argument(
+        '--engine',
+        type=str,
+        help='k-means engine (minibatch, spherical)',
+        default="minibatch",
+        )
     FLAGS, unparsed = parser.parse_known_args()
-    trials = FLAGS.trials
-    max_k = FLAGS.max_k
-    features = FLAGS.num_features
-    data = pickle.load(open("data/data.pkl","rb"))
-    feature_extraction(data, features, 0.1)
-    processed = pickle.load(open("data/processed-data.pkl","rb"))
-    output = find_k(processed, trials, max_k)
\ No newline at end of file
+    run_find_k(FLAGS.trials, FLAGS.max_k, FLAGS.num_features, FLAGS.lsa, FLAGS.engine, FLAGS.dedup)
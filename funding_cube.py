@@ -0,0 +1,150 @@
+import argparse
+import csv
+import sys
+import numpy as np
+
+# Dimensions of the cube, in axis order
+DIMENSIONS = ["administration", "year", "mechanism"]
+
+# Fiscal year held out as test data by process_data
+TEST_YEAR = "2021"
+
+class FundingCube:
+    """
+    Number and value of awards by funder x year x mechanism. Built in one grouped pass over the
+    awards; any slice or cross-tab is then a sum over the cube axes.
+
+    Parameters
+    ----------
+    values : dictionary of sorted arrays of the values of each dimension
+    counts : int64 array (funders, years, mechanisms) of the number of awards
+    amounts : int64 array (funders, years, mechanisms) of the value of awards
+    """
+    def __init__(self, values, counts, amounts):
+        self.values = values
+        self.counts = counts
+        self.amounts = amounts
+
+    @classmethod
+    def from_tables(cls, *tables):
+        """
+        Aggregates one or more AwardTables (e.g. data and test_data) into a cube
+        """
+        values = {dim: np.unique(np.concatenate([table.categories(dim) for table in tables]).astype(str)) for dim in DIMENSIONS}
+        shape = tuple(len(values[dim]) for dim in DIMENSIONS)
+        counts = np.zeros(np.prod(shape), dtype=np.int64)
+        amounts = np.zeros(np.prod(shape), dtype=np.int64)
+        for table in tables:
+            # Cell of each award from its categorical codes, remapped to the cube values
+            cell = np.zeros(len(table), dtype=np.int64)
+            for dim, size in zip(DIMENSIONS, shape):
+                remap = np.searchsorted(values[dim], table.categories(dim).astype(str))
+                cell = cell * size + remap[table.codes(dim)]
+            counts += np.bincount(cell, minlength=len(counts))
+            amounts += np.bincount(cell, weights=table.column("award_amount"), minlength=len(amounts)).astype(np.int64)
+        return cls(values, counts.reshape(shape), amounts.reshape(shape))
+
+    @classmethod
+    def from_store(cls, conn):
+        """
+        Aggregates the awards table of the award database (award_store.py) with one GROUP BY
+        """
+        rows = conn.execute("SELECT administration, year, mechanism, COUNT(*), SUM(award_amount) FROM awards GROUP BY administration, year, mechanism").fetchall()
+        values = {dim: np.unique(np.array([row[i] for row in rows], dtype=str)) for i, dim in enumerate(DIMENSIONS)}
+        shape = tuple(len(values[dim]) for dim in DIMENSIONS)
+        counts = np.zeros(shape, dtype=np.int64)
+        amounts = np.zeros(shape, dtype=np.int64)
+        for row in rows:
+            cell = tuple(np.searchsorted(values[dim], str(row[i])) for i, dim in enumerate(DIMENSIONS))
+            counts[cell] = row[3]
+            amounts[cell] = row[4]
+        return cls(values, counts, amounts)
+
+    def save(self, path="data/funding_cube.npz"):
+        arrays = {"values_" + dim: self.values[dim] for dim in DIMENSIONS}
+        np.savez_compressed(path, counts=self.counts, amounts=self.amounts, **arrays)
+
+    @classmethod
+    def load(cls, path="data/funding_cube.npz"):
+        arrays = np.load(path)
+        return cls({dim: arrays["values_" + dim] for dim in DIMENSIONS}, arrays["counts"], arrays["amounts"])
+
+    def select(self, **where):
+        """
+        Sub-cube restricted to some values, e.g. select(year=["2019", "2020"]) or select(administration="NCI")
+        """
+        values, counts, amounts = dict(self.values), self.counts, self.amounts
+        for dim, selected in where.items():
+            axis = DIMENSIONS.index(dim)
+            selected = [selected] if isinstance(selected, str) else [str(value) for value in selected]
+            keep = np.flatnonzero(np.isin(values[dim], selected))
+            values[dim] = values[dim][keep]
+            counts = counts.take(keep, axis=axis)
+            amounts = amounts.take(keep, axis=axis)
+        return FundingCube(values, counts, amounts)
+
+    def exclude(self, **where):
+        """
+        Sub-cube without some values, e.g. exclude(year=TEST_YEAR)
+        """
+        selected = {}
+        for dim, excluded in where.items():
+            excluded = [excluded] if isinstance(excluded, str) else [str(value) for value in excluded]
+            selected[dim] = [value for value in self.values[dim] if value not in excluded]
+        return self.select(**selected)
+
+    def slice(self, *dims):
+        """
+        Totals over the other dimensions
+
+        Returns
+        -------
+        values : list of the value arrays of dims
+        counts : int64 array with one axis per dim
+        amounts : int64 array with one axis per dim
+        """
+        axes = tuple(i for i, dim in enumerate(DIMENSIONS) if dim not in dims)
+        order = [[dim for dim in DIMENSIONS if dim in dims].index(dim) for dim in dims]
+        counts = self.counts.sum(axis=axes).transpose(order)
+        amounts = self.amounts.sum(axis=axes).transpose(order)
+        return [self.values[dim] for dim in dims], counts, amounts
+
+    def write_summary(self, key, label, output_file, name_map=None):
+        """
+        Csv with the number and value of awards for each value of key (values without awards are left out)
+        """
+        (groups,), counts, amounts = self.slice(key)
+        output = [[label, "Number of awards", "Value of awards"]]
+        for group, count, amount in zip(groups, counts, amounts):
+            if count == 0:
+                continue
+            group = str(group)
+            if name_map is not None:
+                group = name_map[group] if (group in name_map) else group
+            output.append([group, int(count), int(amount)])
+        with open(output_file, 'w', newline='', encoding='utf8') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerows(output)
+
+    def write_crosstab(self, rows, columns, output, value="amounts"):
+        """
+        Csv of value ("amounts" or "counts") with one row per value of rows and one column per value of columns
+        """
+        (row_values, column_values), counts, amounts = self.slice(rows, columns)
+        table = amounts if value == "amounts" else counts
+        writer = csv.writer(output)
+        writer.writerow([rows] + [str(column) for column in column_values])
+        for row, cells in zip(row_values, table):
+            writer.writerow([str(row)] + [int(cell) for cell in cells])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=str, default="administration", help='dimension of the rows ({})'.format(", ".join(DIMENSIONS)))
+    parser.add_argument('--columns', type=str, default="year", help='dimension of the columns')
+    parser.add_argument('--value', type=str, default="amounts", help='amounts or counts')
+    parser.add_argument('--where', type=str, action='append', default=[], help='filter as dimension=value[,value...], repeatable')
+    parser.add_argument('--cube', type=str, default="data/funding_cube.npz", help='cube saved by feature_extraction.py')
+    FLAGS, unparsed = parser.parse_known_args()
+
+    cube = FundingCube.load(FLAGS.cube).select(**{f.split("=")[0]: f.split("=")[1].split(",") for f in FLAGS.where})
+    cube.write_crosstab(FLAGS.rows, FLAGS.columns, sys.stdout, FLAGS.value)
@@ -0,0 +1,17 @@
+import hashlib
+import os
+
+def file_hash(path, cache):
+    """
+    sha256 of a file's content. Hashes are cached by (size, mtime) so unchanged files are not re-read.
+    """
+    stat = os.stat(path)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    if path in cache and cache[path]["stamp"] == stamp:
+        return cache[path]["hash"]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    cache[path] = {"stamp": stamp, "hash": digest.hexdigest()}
+    return cache[path]["hash"]
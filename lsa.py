@@ -0,0 +1,78 @@
+import os
+import pickle
+import numpy as np
+import perf
+
+# Cached LSA space: float32 document embedding (awards x components) and components (components x TF-IDF features)
+EMBEDDING_FILE = "data/lsa-embedding.npy"
+COMPONENTS_FILE = "data/lsa-components.npy"
+
+def reduce(X_transformed, n_components=100, seed=0):
+    """
+
+    Parameters
+    ----------
+    X_transformed : TF-IDF matrix
+    n_components : number of LSA dimensions (less than the number of TF-IDF features)
+    seed : random seed of the randomized SVD
+
+    Returns
+    -------
+    embedding : unit length float32 rows of the reduced TF-IDF matrix (euclidean k-means on them is spherical k-means)
+    components : float32 SVD components (components x TF-IDF features)
+    explained : fraction of the variance kept
+
+    """
+    from sklearn.decomposition import TruncatedSVD
+    n_components = min(n_components, X_transformed.shape[1] - 1)
+    svd = TruncatedSVD(n_components=n_components, random_state=seed)
+    with perf.timer("svd", items=X_transformed.shape[0]):
+        embedding = svd.fit_transform(X_transformed)
+    return normalize(embedding).astype(np.float32), svd.components_.astype(np.float32), svd.explained_variance_ratio_.sum()
+
+def fit_lsa(n_components=100, processed_file="data/processed-data.pkl", seed=0):
+    """
+    Saves EMBEDDING_FILE and COMPONENTS_FILE, the reduce output of the TF-IDF matrix in processed_file
+    """
+    embedding, components, explained = reduce(pickle.load(open(processed_file,"rb")), n_components, seed)
+    np.save(EMBEDDING_FILE, embedding)
+    np.save(COMPONENTS_FILE, components)
+    print("LSA: {} components, {:.1%} of variance".format(components.shape[0], explained))
+
+def clear_lsa():
+    for path in [EMBEDDING_FILE, COMPONENTS_FILE]:
+        if os.path.exists(path):
+            os.remove(path)
+
+def normalize(X):
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return X / norms
+
+def is_lsa(processed_file):
+    return processed_file.endswith(".npy")
+
+def load_features(processed_file):
+    """
+    Document features: the TF-IDF matrix (processed-data.pkl) or the LSA embedding (EMBEDDING_FILE)
+    """
+    if is_lsa(processed_file):
+        if not os.path.exists(processed_file):
+            raise FileNotFoundError("{} not found, extract features with --lsa first".format(processed_file))
+        return np.load(processed_file)
+    return pickle.load(open(processed_file,"rb"))
+
+def project(X_tfidf):
+    """
+    LSA embedding of TF-IDF rows (e.g. vectorizer.transform of new documents)
+    """
+    components = np.load(COMPONENTS_FILE)
+    return normalize(np.asarray(X_tfidf @ components.T)).astype(np.float32)
+
+def term_weights(centers, processed_file):
+    """
+    Cluster centers in TF-IDF term space (LSA centers are projected back through the components)
+    """
+    if is_lsa(processed_file):
+        return centers @ np.load(COMPONENTS_FILE)
+    return centers
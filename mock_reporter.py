@@ -0,0 +1,146 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from synthetic_data import SyntheticCorpus
+
+class MockReporter:
+    """
+    Local stand-in for the NIH RePORTER (/v2/projects/search, /v2/publications/search) and
+    iCite (/api/pubs) APIs serving a deterministic SyntheticCorpus. Search text is ignored:
+    every award of the requested fiscal years matches.
+
+    Parameters
+    ----------
+    n : number of awards
+    seed : random seed of the corpus
+    latency : seconds added to every response
+    jitter : maximum random seconds added on top of latency
+    error_rate : fraction of requests answered with a 500/502/503 error
+    rate_limit : fraction of requests answered with 429 Too Many Requests
+    retry_after : seconds sent in the Retry-After header of 429 and 503 responses
+    """
+    def __init__(self, n, seed=0, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=0.0, retry_after=1):
+        self.corpus = SyntheticCorpus(n, seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.by_year = {int(year): np.flatnonzero(self.corpus.years == year) for year in np.unique(self.corpus.years)}
+
+    def fault(self):
+        """
+        Status code and headers of an injected failure, or None
+        """
+        with self.lock:
+            self.requests += 1
+            draw = self.random.random()
+            status = self.random.choice([500, 502, 503])
+        if draw < self.rate_limit:
+            return 429, {"Retry-After": str(self.retry_after)}
+        if draw < self.rate_limit + self.error_rate:
+            return status, ({"Retry-After": str(self.retry_after)} if status == 503 else {})
+        return None
+
+    def projects(self, body):
+        criteria = body.get("criteria", {})
+        years = criteria.get("fiscal_years") or sorted(self.by_year)
+        matches = np.concatenate([self.by_year.get(int(year), np.array([], dtype=int)) for year in years])
+        offset, limit = int(body.get("offset", 0)), int(body.get("limit", 50))
+        results = [self.corpus.award(int(i)) for i in matches[offset:offset+limit]]
+        return {"meta": {"total": len(matches), "offset": offset, "limit": limit}, "results": results}
+
+    def publications(self, body):
+        appl_ids = body.get("criteria", {}).get("appl_ids", [])
+        matches = []
+        for appl_id in appl_ids:
+            i = int(appl_id) - 1000000
+            if 0 <= i < self.corpus.n:
+                matches.extend(self.corpus.publications(i))
+        offset, limit = int(body.get("offset", 0)), int(body.get("limit", 50))
+        return {"meta": {"total": len(matches), "offset": offset, "limit": limit}, "results": matches[offset:offset+limit]}
+
+    def pubs(self, query):
+        pmids = [int(pmid) for pmid in query.get("pmids", [""])[0].split(",") if pmid]
+        limit = int(query.get("limit", ["1000"])[0])
+        return {"meta": {"pmids": len(pmids)}, "data": [self.corpus.citation(pmid) for pmid in pmids[:limit]]}
+
+def make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        def respond(self, status, payload=None, headers=None):
+            body = json.dumps(payload if payload is not None else {"error": status}).encode("utf8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def handle_request(self, route):
+            time.sleep(mock.latency + mock.random.random() * mock.jitter)
+            fault = mock.fault()
+            if fault is not None:
+                self.respond(fault[0], headers=fault[1])
+                return
+            self.respond(200, route())
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            path = urlparse(self.path).path
+            if path == "/v2/projects/search":
+                self.handle_request(lambda: mock.projects(body))
+            elif path == "/v2/publications/search":
+                self.handle_request(lambda: mock.publications(body))
+            else:
+                self.respond(404)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/api/pubs":
+                self.handle_request(lambda: mock.pubs(parse_qs(url.query)))
+            else:
+                self.respond(404)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def serve(mock, host="127.0.0.1", port=0):
+    """
+    Starts the mock server in a background thread
+
+    Returns
+    -------
+    server : ThreadingHTTPServer, stop with server.shutdown()
+    base_url : string. e.g. "http://127.0.0.1:8123", usable as both the RePORTER and the iCite base URL
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(mock))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://{}:{}".format(*server.server_address[:2])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=10000, help='number of synthetic awards')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum random extra latency')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='fraction of 5xx responses')
+    parser.add_argument('--rate_limit', type=float, default=0.0, help='fraction of 429 responses')
+    parser.add_argument('--retry_after', type=int, default=1, help='Retry-After seconds of 429/503 responses')
+    FLAGS, unparsed = parser.parse_known_args()
+
+    mock = MockReporter(FLAGS.n, latency=FLAGS.latency, jitter=FLAGS.jitter, error_rate=FLAGS.error_rate,
+                        rate_limit=FLAGS.rate_limit, retry_after=FLAGS.retry_after)
+    server = ThreadingHTTPServer(("127.0.0.1", FLAGS.port), make_handler(mock))
+    print("Serving {} synthetic awards at http://127.0.0.1:{}".format(FLAGS.n, FLAGS.port))
+    server.serve_forever()
@@ -0,0 +1,128 @@
+import os
+import zlib
+import numpy as np
+
+# Mersenne prime for the universal hash family (a*x + b) mod PRIME, small enough that a*x fits in uint64
+PRIME = np.uint64(2**31 - 1)
+
+def shingles(text, k=3):
+    """
+    crc32 hashes of the word k-shingles of a text (a text shorter than k words is one shingle)
+    """
+    words = text.lower().split()
+    grams = [" ".join(words[i:i+k]) for i in range(max(len(words)-k+1, 1))]
+    return np.unique(np.array([zlib.crc32(gram.encode("utf8")) for gram in grams], dtype=np.uint64))
+
+def minhash_signatures(texts, num_perm=128, k=3, seed=0):
+    """
+
+    Parameters
+    ----------
+    texts : list of strings
+    num_perm : number of hash functions
+    k : number of words per shingle
+    seed : random seed of the hash functions
+
+    Returns
+    -------
+    signatures : uint32 array (len(texts), num_perm). The fraction of equal columns of two rows
+        estimates the Jaccard similarity of their shingle sets.
+
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, int(PRIME), size=num_perm, dtype=np.uint64)[:, None]
+    b = rng.integers(0, int(PRIME), size=num_perm, dtype=np.uint64)[:, None]
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    for i, text in enumerate(texts):
+        h = shingles(text, k) % PRIME
+        signatures[i] = ((a * h[None, :] + b) % PRIME).min(axis=1)
+    return signatures
+
+def find_groups(signatures, bands=32, threshold=0.8):
+    """
+    Groups near-duplicates with LSH banding: rows sharing all values of any band are candidates,
+    and candidates with an estimated Jaccard similarity of at least threshold are merged (transitively).
+
+    Returns
+    -------
+    group : int64 array. group id of each row; rows of a group share the id of the group's first row
+    """
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    parent = np.arange(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for band in range(bands):
+        keys = signatures[:, band*rows:(band+1)*rows]
+        _, bucket, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+        bucket = bucket.ravel()
+        shared = np.flatnonzero(counts[bucket] > 1)
+        if len(shared) == 0:
+            continue
+        order = shared[np.argsort(bucket[shared], kind="stable")]
+        # Compare every member of a bucket with the first member of the bucket
+        starts = np.flatnonzero(np.r_[True, bucket[order][1:] != bucket[order][:-1]])
+        for start, end in zip(starts, np.r_[starts[1:], len(order)]):
+            first = order[start]
+            others = order[start+1:end]
+            similarity = (signatures[others] == signatures[first]).mean(axis=1)
+            for other in others[similarity >= threshold]:
+                root_first, root_other = find(first), find(other)
+                if root_first != root_other:
+                    parent[max(root_first, root_other)] = min(root_first, root_other)
+
+    return np.array([find(i) for i in range(n)])
+
+def collapse(data, threshold=0.8, num_perm=128, bands=32):
+    """
+
+    Parameters
+    ----------
+    data : AwardTable
+    threshold : minimum estimated Jaccard similarity of the word 3-shingles of two near-duplicate texts
+    num_perm : number of MinHash functions
+    bands : number of LSH bands (num_perm/bands rows per band)
+
+    Returns
+    -------
+    groups : dictionary with
+        "representatives": row of data representing each group (its most recent award), ascending
+        "group": index into representatives of each award of data
+        "weights": number of awards in each group
+
+    """
+    signatures = minhash_signatures(data.column("text"), num_perm)
+    root = find_groups(signatures, bands, threshold)
+
+    # Most recent award of each group represents it (ties go to the earlier row)
+    years = data.column("year").astype(int)
+    order = np.lexsort((np.arange(len(data)), -years, root))
+    first = np.r_[True, root[order][1:] != root[order][:-1]]
+    representatives = np.sort(order[first])
+
+    rep_of_root = np.zeros(len(data), dtype=np.int64)
+    rep_of_root[root[representatives]] = np.arange(len(representatives))
+    group = rep_of_root[root]
+    weights = np.bincount(group, minlength=len(representatives))
+    return {"representatives": representatives, "group": group.astype(np.int32), "weights": weights}
+
+def save_groups(groups, path="data/groups.npz"):
+    np.savez_compressed(path, **groups)
+
+def load_groups(path="data/groups.npz"):
+    """
+    Near-duplicate groups of the current features, or None when the features were extracted from every award
+    """
+    if not os.path.exists(path):
+        return None
+    arrays = np.load(path)
+    return {key: arrays[key] for key in arrays.files}
+
+def clear_groups(path="data/groups.npz"):
+    if os.path.exists(path):
+        os.remove(path)
@@ -1,16 +1,75 @@
 import requests
 import argparse
+import json
 import pandas as pd
 import csv
 import time
 from progress.bar import Bar
 from tqdm import tqdm
 import codecs
+import perf
 
-def get_data(termsfile, start, end, operator):
-    
-    # Get query
-    lines = []
+REPORTER_URL = "https://api.reporter.nih.gov"
+ICITE_URL = "https://icite.od.nih.gov"
+
+# Retries of a rate-limited or failed request before giving up
+MAX_RETRIES = 10
+
+def retry_after(response, default):
+    """
+    Seconds to wait before retrying, from the Retry-After header in seconds or as an HTTP-date, or default
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return default
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    from datetime import datetime, timezone
+    from email.utils import parsedate_to_datetime
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0)
+
+def fetch(method, url, retry_wait=30, max_retries=MAX_RETRIES, **kwargs):
+    """
+
+    Parameters
+    ----------
+    method : string. "GET" or "POST"
+    url : string
+    retry_wait : seconds to wait before retrying a failed request, unless the response has a Retry-After header
+    max_retries : maximum number of retries of a rate-limited (429) or failed (5xx) request, None to retry until it succeeds
+    kwargs : passed to requests.request
+
+    Returns
+    -------
+    response : successful response. Other client errors (e.g. 400, 404) are raised without retrying,
+        as is the last failure once max_retries is reached
+
+    """
+    response = perf.http(method, url, **kwargs)
+    retries = 0
+    while response.status_code == 429 or response.status_code >= 500:
+        if max_retries is not None and retries >= max_retries:
+            break
+        print("Didn't work trying again, status code: {}".format(response.status_code))
+        time.sleep(retry_after(response, retry_wait))
+        response = perf.http(method, url, retry=True, **kwargs)
+        retries += 1
+    response.raise_for_status()
+    return response
+
+def get_search_text(termsfile, operator):
+    """
+    RePORTER search text of a terms file: a quoted list of its lines for "and"/"or" queries,
+    or its first line for "advanced" queries
+    """
     search_text = ""
     with open(termsfile) as f:
         lines = f.readlines()
@@ -23,11 +82,12 @@ def get_data(termsfile, start, end, operator):
         else: # if "advanced query" (search_text.txt must be directly formated query)
             line = lines[0].strip()
             search_text = line
-    print("Your query: {}".format(search_text))
-            
-    
-    # Get awards from NIH RePORTER
-    print("Getting awards...")
+    return search_text
+
+def get_awards(search_text, operator, start, end, base_url=REPORTER_URL, retry_wait=30, max_retries=MAX_RETRIES):
+    """
+    Awards of fiscal years start to end-1 matching a search, as a DataFrame of flattened RePORTER projects
+    """
     dfs = []
     years = list(range(start,end))
     for year in years:
@@ -51,13 +111,9 @@ def get_data(termsfile, start, end, operator):
               "sort_field":"fiscal_year",
               "sort_order":"desc",
             }
-        
-            response = requests.post("https://api.reporter.nih.gov/v2/projects/search", json=params)
-            while response.status_code != 200:
-                print("Didn't work trying again, status code: {}".format(response.status_code))
-                time.sleep(30)
-                response = requests.post("https://api.reporter.nih.gov/v2/projects/search", json=params)
-                
+    
+            response = fetch("POST", base_url + "/v2/projects/search", retry_wait, max_retries, json=params)
+
             response_dict = response.json()
             results = response_dict["results"]
             print("Year: {}, {}: {}, {} awards".format(year, o, response, len(results)))
@@ -66,80 +122,149 @@ def get_data(termsfile, start, end, operator):
             dfs.append(df)
             if len(results) < 500:
                 break
-    
-    result = pd.concat(dfs)
-    result.to_csv("data/raw_data.csv", index=False)
-    print("Got awards.")
-    
-    ############################################
-    
+    return pd.concat(dfs)
+
+def get_papers(base_url=REPORTER_URL, icite_url=ICITE_URL, retry_wait=30, max_retries=MAX_RETRIES):
+    """
+    Downloads the publications of the awards in data/raw_data.csv and the iCite data of each distinct paper
+    to data/publications.csv and data/citations.csv
+    """
     # Getting the papers
-    print("Getting papers (5 awards at a time)...")
-    data_file = "data/raw_data.csv"
+    with perf.timer("publications"):
+        print("Getting papers (5 awards at a time)...")
+        data_file = "data/raw_data.csv"
     
-    with open(data_file, newline='', encoding='utf8') as csvfile:
-        reader = csv.reader(x.replace('\0', '') for x in csvfile)
-        raw_data = list(reader)
+        with open(data_file, newline='', encoding='utf8') as csvfile:
+            reader = csv.reader(x.replace('\0', '') for x in csvfile)
+            raw_data = list(reader)
         
-    application_ids = []
-    for i in range(1,len(raw_data)):
-        application_ids.append(str(raw_data[i][0]))
+        application_ids = []
+        for i in range(1,len(raw_data)):
+            application_ids.append(str(raw_data[i][0]))
     
-    dfs = []
-    for o in tqdm(range(len(application_ids)//5), position=0, leave=True):
-        params = {
-            "criteria": {
-                "appl_ids": application_ids[o*5:min(o*5+5, len(application_ids))],
-            },
-            "sort_field":"appl_ids",
-            "sort_order":"desc"
-        }
-    
-        response = requests.post("https://api.reporter.nih.gov/v2/publications/search", json=params)
-        while response.status_code != 200:
-            response = requests.post("https://api.reporter.nih.gov/v2/publications/search", json=params)
-            
-        # print("{}: {}".format(o,response))
-        response_dict = response.json()
-        results = response_dict["results"]
-        results = pd.json_normalize(results, sep='_')
-        df = pd.DataFrame.from_dict(results)
-        dfs.append(df)
+        dfs = []
+        for o in tqdm(range(0, len(application_ids), 5), position=0, leave=True):
+            for page in range(0,1000):
+                params = {
+                    "criteria": {
+                        "appl_ids": application_ids[o:o+5],
+                    },
+                    "offset":page*500,
+                    "limit":500,
+                    "sort_field":"appl_ids",
+                    "sort_order":"desc"
+                }
+
+                response = fetch("POST", base_url + "/v2/publications/search", retry_wait, max_retries, json=params)
+
+                # print("{}: {}".format(o,response))
+                response_dict = response.json()
+                results = response_dict["results"]
+                results = pd.json_normalize(results, sep='_')
+                df = pd.DataFrame.from_dict(results)
+                dfs.append(df)
+                if len(results) < 500:
+                    break
     
-    result = pd.concat(dfs)
-    result.to_csv("data/publications.csv", index=False)
-    print("Got papers.")
+        result = pd.concat(dfs)
+        result.to_csv("data/publications.csv", index=False)
+        print("Got papers.")
     
     ###########################################
     
     # Getting the citation data
-    print("Getting citation data...")
-    data_file = "data/publications.csv"
-    dfs = []
+    with perf.timer("citations"):
+        print("Getting citation data...")
+        data_file = "data/publications.csv"
+        dfs = []
+    
+        with open(data_file, newline='', encoding='utf8') as csvfile:
+            raw_data = list(csv.reader(csvfile))
+        # Papers of several awards are fetched once
+        pmids = list(dict.fromkeys(raw_data[i][1] for i in range(1,len(raw_data))))
+    
     
-    with open(data_file, newline='', encoding='utf8') as csvfile:
-        raw_data = list(csv.reader(csvfile))
-    pmids = []
-    for i in range(1,len(raw_data)):
-        pmids.append(raw_data[i][1])
-    
-    
-    for i in tqdm(range(0, max(len(pmids)//1000,1)), position=0, leave=True):
-        target_pmids = pmids[i*1000:min(i*1000+1000, len(pmids))]
-        pmid_string = ",".join(target_pmids)
-        query = "pmids=" + pmid_string + "&limit=1000"
-        response = requests.get("https://icite.od.nih.gov/api/pubs?" + query)
-        # print("{}: {}".format(i,response))
-        pub = response.json()
-        for i in range(len(pub["data"])):
-            pub["data"][i]['pmid'] = target_pmids[i]
-        results = pd.json_normalize(pub["data"], sep='_')
-        df = pd.DataFrame.from_dict(results)
-        dfs.append(df)
-    
-    result = pd.concat(dfs)
-    result.to_csv("data/citations.csv", index=False)
-    print("Got citation data.")
+        for i in tqdm(range(0, max(len(pmids),1), 1000), position=0, leave=True):
+            target_pmids = pmids[i:i+1000]
+            pmid_string = ",".join(target_pmids)
+            query = "pmids=" + pmid_string + "&limit=1000"
+            response = fetch("GET", icite_url + "/api/pubs?" + query, retry_wait, max_retries)
+            # print("{}: {}".format(i,response))
+            pub = response.json()
+            for i in range(len(pub["data"])):
+                pub["data"][i]['pmid'] = target_pmids[i]
+            results = pd.json_normalize(pub["data"], sep='_')
+            df = pd.DataFrame.from_dict(results)
+            dfs.append(df)
+    
+        result = pd.concat(dfs)
+        result.to_csv("data/citations.csv", index=False)
+        print("Got citation data.")
+
+def get_data(termsfile, start, end, operator, base_url=REPORTER_URL, icite_url=ICITE_URL, retry_wait=30, max_retries=MAX_RETRIES):
+    
+    # Get query
+    search_text = get_search_text(termsfile, operator)
+    print("Your query: {}".format(search_text))
+            
+    
+    # Get awards from NIH RePORTER
+    with perf.timer("awards"):
+        print("Getting awards...")
+        result = get_awards(search_text, operator, start, end, base_url, retry_wait, max_retries)
+        result.to_csv("data/raw_data.csv", index=False)
+        print("Got awards.")
+    
+    ############################################
+    
+    get_papers(base_url, icite_url, retry_wait, max_retries)
+
+def get_batch(queries_file, start, end, base_url=REPORTER_URL, icite_url=ICITE_URL, retry_wait=30, max_retries=MAX_RETRIES):
+    """
+
+    Parameters
+    ----------
+    queries_file : path to a json list of query definitions, e.g.
+        [{"name": "ai", "search_terms": "search_terms.txt", "operator": "or"},
+         {"name": "ai_cancer", "search_terms": "cancer_query.txt", "operator": "advanced", "start_year": 2010}]
+        start_year and end_year (inclusive) are optional and default to start and end-1
+    start : first fiscal year
+    end : last fiscal year + 1
+
+    Returns
+    -------
+    The union of the awards of all queries, each award once, in data/raw_data.csv with a "queries" column
+    (";"-joined names of the queries that matched it); publications and citations of the union fetched
+    once per appl_id and pmid; the definitions and award counts of the queries in data/queries.json
+    """
+    queries = json.load(open(queries_file, encoding="utf8"))
+    dfs = []
+    membership = {}
+    with perf.timer("awards"):
+        for query in queries:
+            search_text = get_search_text(query["search_terms"], query["operator"])
+            print("Query {}: {}".format(query["name"], search_text))
+            df = get_awards(search_text, query["operator"], query.get("start_year", start), query.get("end_year", end-1)+1, base_url, retry_wait, max_retries)
+            query["search_text"] = search_text
+            # A query without matches gives a frame without columns
+            query["awards"] = int(df["appl_id"].nunique()) if "appl_id" in df else 0
+            print("Query {}: {} awards".format(query["name"], query["awards"]))
+            if query["awards"] == 0:
+                continue
+            for appl_id in df["appl_id"].astype(str).unique():
+                membership.setdefault(appl_id, []).append(query["name"])
+            dfs.append(df)
+        if not dfs:
+            raise ValueError("No awards match any query of {}".format(queries_file))
+        result = pd.concat(dfs).drop_duplicates(subset="appl_id")
+        result["queries"] = [";".join(membership[appl_id]) for appl_id in result["appl_id"].astype(str)]
+        result.to_csv("data/raw_data.csv", index=False)
+        print("Got {} awards for {} queries ({} fetched)".format(len(result), len(queries), sum(len(df) for df in dfs)))
+
+    with open("data/queries.json", "w", encoding="utf8") as f:
+        json.dump(queries, f, indent=2)
+
+    get_papers(base_url, icite_url, retry_wait, max_retries)
 
 if __name__ == "__main__":
     
@@ -148,14 +273,12 @@ if __name__ == "__main__":
     parser.add_argument(
         '--search_terms',
         type=str,
-        required=True,
         help='Terms for NIH RePORTER query',
         default="search_terms.txt",
         )
     parser.add_argument(
         '--operator',
         type=str,
-        required=True,
         help='Operator for NIH RePORTER query (and, or, advanced)',
         default="or",
         )
@@ -173,7 +296,42 @@ if __name__ == "__main__":
         help='End year for search (inclusive)',
         default=2021,
         )
+    parser.add_argument(
+        '--base_url',
+        type=str,
+        help='Base URL of the RePORTER API (e.g. a local mock_reporter.py server)',
+        default=REPORTER_URL,
+        )
+    parser.add_argument(
+        '--icite_url',
+        type=str,
+        help='Base URL of the iCite API',
+        default=ICITE_URL,
+        )
+    parser.add_argument(
+        '--retry_wait',
+        type=float,
+        help='Seconds to wait before retrying a failed request without a Retry-After header',
+        default=30,
+        )
+    parser.add_argument(
+        '--max_retries',
+        type=int,
+        help='Retries of a rate-limited (429) or failed (5xx) request before giving up',
+        default=MAX_RETRIES,
+        )
+    parser.add_argument(
+        '--queries',
+        type=str,
+        help='Json list of query definitions to fetch together (batch mode, instead of --search_terms and --operator)',
+        default=None,
+        )
     FLAGS, unparsed = parser.parse_known_args()
     
     # Run
-    get_data(FLAGS.search_terms, FLAGS.start_year, FLAGS.end_year+1, FLAGS.operator)
\ No newline at end of file
+    with perf.timer("query"):
+        if FLAGS.queries is not None:
+            get_batch(FLAGS.queries, FLAGS.start_year, FLAGS.end_year+1, FLAGS.base_url, FLAGS.icite_url, FLAGS.retry_wait, FLAGS.max_retries)
+        else:
+            get_data(FLAGS.search_terms, FLAGS.start_year, FLAGS.end_year+1, FLAGS.operator, FLAGS.base_url, FLAGS.icite_url, FLAGS.retry_wait, FLAGS.max_retries)
+    perf.save("data/perf-query.json")
\ No newline at end of file
@@ -0,0 +1,183 @@
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Upper bounds (seconds) of the HTTP latency histogram buckets
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process and its finished children, in MB
+    """
+    scale = 1 if sys.platform == "darwin" else 1024 # ru_maxrss is bytes on macOS, KB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) * scale / 1e6
+
+class Recorder:
+    """
+    Collects wall/CPU timers, item throughput, counters and HTTP statistics for one process.
+    Timers nest: a timer opened inside "cluster" named "kmeans" is recorded as "cluster/kmeans".
+    """
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.http = {}
+        self.stack = []
+
+    def add(self, name, wall, cpu=0.0, items=0, calls=1):
+        name = "/".join(self.stack + [name])
+        entry = self.timers.setdefault(name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "items": 0, "peak_rss_mb": 0.0})
+        entry["calls"] += calls
+        entry["wall_s"] += wall
+        entry["cpu_s"] += cpu
+        entry["items"] += items
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def timer(self, name, items=0):
+        path = "/".join(self.stack + [name])
+        profiler = start_profile(path)
+        wall, cpu = time.perf_counter(), time.process_time()
+        self.stack.append(name)
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            self.add(name, time.perf_counter() - wall, time.process_time() - cpu, items)
+            entry = self.timers[path]
+            entry["peak_rss_mb"] = max(entry["peak_rss_mb"], peak_rss_mb())
+            stop_profile(profiler, path)
+
+    def record_http(self, endpoint, latency, nbytes, status, retry=False):
+        entry = self.http.setdefault(endpoint, {"requests": 0, "retries": 0, "errors": 0, "bytes": 0, "latency_s": 0.0,
+                                                "latency_hist": [0 for i in range(len(LATENCY_BUCKETS)+1)]})
+        entry["requests"] += 1
+        entry["retries"] += int(retry)
+        entry["errors"] += int(status != 200)
+        entry["bytes"] += nbytes
+        entry["latency_s"] += latency
+        bucket = len([edge for edge in LATENCY_BUCKETS if latency > edge])
+        entry["latency_hist"][bucket] += 1
+
+    def snapshot(self):
+        return {"timers": self.timers, "counters": self.counters, "http": self.http}
+
+    def merge(self, snapshot):
+        """
+        Adds the statistics of another recorder's snapshot (e.g. from a worker process)
+        """
+        for name, other in snapshot["timers"].items():
+            entry = self.timers.setdefault(name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "items": 0, "peak_rss_mb": 0.0})
+            for key in ["calls", "wall_s", "cpu_s", "items"]:
+                entry[key] += other[key]
+            entry["peak_rss_mb"] = max(entry["peak_rss_mb"], other["peak_rss_mb"])
+        for name, n in snapshot["counters"].items():
+            self.count(name, n)
+        for endpoint, other in snapshot["http"].items():
+            entry = self.http.setdefault(endpoint, {"requests": 0, "retries": 0, "errors": 0, "bytes": 0, "latency_s": 0.0,
+                                                    "latency_hist": [0 for i in range(len(LATENCY_BUCKETS)+1)]})
+            for key in ["requests", "retries", "errors", "bytes", "latency_s"]:
+                entry[key] += other[key]
+            entry["latency_hist"] = [a + b for a, b in zip(entry["latency_hist"], other["latency_hist"])]
+
+    def report(self):
+        timers = {}
+        for name, entry in self.timers.items():
+            timers[name] = dict(entry)
+            if entry["items"] > 0 and entry["wall_s"] > 0:
+                timers[name]["items_per_s"] = entry["items"] / entry["wall_s"]
+        http = {}
+        for endpoint, entry in self.http.items():
+            http[endpoint] = dict(entry)
+            http[endpoint]["latency_hist"] = dict(zip(["<={}s".format(edge) for edge in LATENCY_BUCKETS] + [">{}s".format(LATENCY_BUCKETS[-1])], entry["latency_hist"]))
+            if entry["requests"] > 0:
+                http[endpoint]["mean_latency_s"] = entry["latency_s"] / entry["requests"]
+        return {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "peak_rss_mb": peak_rss_mb(),
+            "timers": timers,
+            "counters": self.counters,
+            "http": http,
+            }
+
+    def save(self, path):
+        with open(path, "w", encoding="utf8") as f:
+            json.dump(self.report(), f, indent=1)
+
+    def reset(self):
+        self.__init__()
+
+# Process-wide recorder
+recorder = Recorder()
+timer = recorder.timer
+add = recorder.add
+count = recorder.count
+snapshot = recorder.snapshot
+merge = recorder.merge
+save = recorder.save
+reset = recorder.reset
+
+def load(path):
+    """
+    Merges a saved perf.json (e.g. from an upstream script) into the process recorder
+    """
+    saved = json.load(open(path, encoding="utf8"))
+    for entry in saved["http"].values():
+        entry["latency_hist"] = list(entry["latency_hist"].values())
+    merge(saved)
+
+def http(method, url, retry=False, **kwargs):
+    """
+    requests.request that records request count, retries, bytes and latency by endpoint
+    """
+    import requests
+    start = time.perf_counter()
+    response = requests.request(method, url, **kwargs)
+    endpoint = url.split("?")[0]
+    recorder.record_http(endpoint, time.perf_counter() - start, len(response.content), response.status_code, retry)
+    return response
+
+def configure_profile(stage, profiler="cprofile", output_dir="."):
+    """
+    Profile the timer named stage with cProfile or pyinstrument. stage is the nested path of the timer
+    (e.g. "cluster/kmeans") or just its name ("kmeans", every timer of that name). The setting is kept in the
+    environment so that worker processes started afterwards profile the same stage.
+    """
+    os.environ["PERF_PROFILE_STAGE"] = stage
+    os.environ["PERF_PROFILER"] = profiler
+    os.environ["PERF_PROFILE_DIR"] = output_dir
+
+def start_profile(path):
+    if os.environ.get("PERF_PROFILE_STAGE") not in (path, path.split("/")[-1]):
+        return None
+    if os.environ.get("PERF_PROFILER") == "pyinstrument":
+        from pyinstrument import Profiler
+        profiler = Profiler()
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+    if hasattr(profiler, "enable"):
+        profiler.enable()
+    else:
+        profiler.start()
+    return profiler
+
+def stop_profile(profiler, name):
+    if profiler is None:
+        return
+    path = "{}/profile-{}".format(os.environ.get("PERF_PROFILE_DIR", "."), name.replace("/", "-"))
+    if os.environ.get("PERF_PROFILER") == "pyinstrument":
+        profiler.stop()
+        with open(path + ".html", "w", encoding="utf8") as f:
+            f.write(profiler.output_html())
+    else:
+        profiler.disable()
+        profiler.dump_stats(path + ".prof")
@@ -0,0 +1,256 @@
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import time
+import perf
+from hashing import file_hash
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# Content hashes of each stage's last successful run
+STATE_FILE = "data/pipeline_state.json"
+
+class Stage:
+    """
+    A pipeline stage. A stage depends on every stage that produces one of its inputs,
+    and is skipped when the hashes of its inputs, parameters and outputs match its last run.
+
+    Parameters
+    ----------
+    name : string
+    func : string. "module:function" called with params as keyword arguments
+    inputs : list of file paths read by the stage
+    outputs : list of file paths written by the stage
+    params : dictionary of parameters passed to func
+    folder : string. optional results directory the stage writes to; its last run is recorded per folder,
+        so each results directory is memoized separately
+    """
+    def __init__(self, name, func, inputs, outputs, params=None, folder=None):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params if params is not None else {}
+        self.state_name = name if folder is None else "{}/{}".format(folder, name)
+
+def stage_key(stage, cache):
+    """
+    Hash of a stage's function, parameters and input contents
+    """
+    for path in stage.inputs:
+        if not os.path.exists(path):
+            raise FileNotFoundError("Stage '{}' is missing input {}".format(stage.name, path))
+    key = {
+        "func": stage.func,
+        "params": stage.params,
+        "inputs": {path: file_hash(path, cache) for path in stage.inputs},
+        }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf8")).hexdigest()
+
+def up_to_date(stage, key, state, cache):
+    """
+    True if the stage last ran with the same key and its outputs are unchanged since
+    """
+    previous = state["stages"].get(stage.state_name)
+    if previous is None or previous["key"] != key:
+        return False
+    for path in stage.outputs:
+        if not os.path.exists(path) or file_hash(path, cache) != previous["outputs"].get(path):
+            return False
+    return True
+
+def run_stage(name, func, params):
+    """
+    Imports and calls a stage function (runs in a worker process)
+
+    Returns
+    -------
+    elapsed : wall time in seconds
+    snapshot : perf statistics recorded during the stage
+    """
+    module, function = func.split(":")
+    perf.reset()
+    start = time.time()
+    with perf.timer(name):
+        getattr(importlib.import_module(module), function)(**params)
+    return time.time() - start, perf.snapshot()
+
+def run_pipeline(stages, jobs=None, force=(), state_file=STATE_FILE, perf_file=None):
+    """
+
+    Parameters
+    ----------
+    stages : list of Stage
+    jobs : number of worker processes, the default is the number of CPUs
+    force : names of stages to run even if they are up to date
+    state_file : path to json with hashes of previous runs
+    perf_file : path to save the merged performance report of the stages that ran, optional
+
+    Returns
+    -------
+    ran : list of names of stages that were run (the others were skipped)
+
+    """
+    state = {"stages": {}, "files": {}}
+    if os.path.exists(state_file):
+        state = json.load(open(state_file, encoding="utf8"))
+    cache = state["files"]
+
+    producers = {path: stage.name for stage in stages for path in stage.outputs}
+    deps = {stage.name: set(producers[path] for path in stage.inputs if path in producers) - {stage.name} for stage in stages}
+    pending = {stage.name: stage for stage in stages}
+    done = set()
+    ran = []
+    running = {}
+
+    def save_state():
+        with open(state_file, "w", encoding="utf8") as f:
+            json.dump(state, f, indent=1)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            # Start (or skip) every stage whose dependencies are complete
+            for name in [name for name in pending if deps[name] <= done]:
+                stage = pending.pop(name)
+                key = stage_key(stage, cache)
+                if name not in force and up_to_date(stage, key, state, cache):
+                    print("[pipeline] {}: up to date, skipped".format(name))
+                    done.add(name)
+                    continue
+                print("[pipeline] {}: running".format(name))
+                running[executor.submit(run_stage, name, stage.func, stage.params)] = (stage, key)
+
+            if not running:
+                # Skipped stages may have unblocked others; otherwise the graph is stuck
+                if pending and not any(deps[name] <= done for name in pending):
+                    raise RuntimeError("Unresolvable stage dependencies: {}".format(", ".join(pending)))
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, key = running.pop(future)
+                elapsed, snapshot = future.result()
+                perf.merge(snapshot)
+                state["stages"][stage.state_name] = {
+                    "key": key,
+                    "outputs": {path: file_hash(path, cache) for path in stage.outputs if os.path.exists(path)},
+                    }
+                save_state()
+                print("[pipeline] {}: done in {:.1f}s".format(stage.name, elapsed))
+                done.add(stage.name)
+                ran.append(stage.name)
+
+    save_state()
+    if perf_file is not None:
+        perf.save(perf_file)
+    return ran
+
+def extract_features(max_features, max_df, dedup=None, lsa=None, precision="float64"):
+    """
+    Feature extraction stage: TF-IDF features from data.pkl, optionally of near-duplicate group representatives
+    """
+    from feature_extraction import feature_extraction, get_features
+    from award_table import load_awards
+    data = load_awards("data/data.pkl")
+    feature_extraction(data, max_features, max_df, dedup, lsa, precision=precision)
+    get_features()
+
+def summarize(store=None):
+    """
+    Funding summary stage: funder x year x mechanism cube of data.pkl and test-data.pkl (or of the awards table
+    of the award database), and the by_* csv slices
+    """
+    from feature_extraction import funding_summaries, get_funder_map
+    from award_table import load_awards
+    funding_summaries(load_awards("data/data.pkl"), load_awards("data/test-data.pkl"), get_funder_map(), store=store)
+
+def search_k(trials, max_k, processed_file="data/processed-data.pkl", engine="minibatch"):
+    """
+    Find k stage: silhouette and SSE curves for the current TF-IDF features or LSA embedding
+    """
+    from find_k import find_k
+    from near_duplicates import load_groups
+    from lsa import load_features
+    processed = load_features(processed_file)
+    groups = load_groups()
+    find_k(processed, trials, max_k, None if groups is None else groups["weights"], engine)
+
+def build_stages(FLAGS):
+    """
+    Stages of the full analysis, from the RePORTER query to the final report
+    """
+    results = FLAGS.results
+    downloads = ["data/raw_data.csv", "data/publications.csv", "data/citations.csv"]
+    run = ["{}/run.json".format(results), "{}/labels.npy".format(results), "{}/scores.npy".format(results), "{}/centers.npy".format(results)]
+    features = ["data/processed-data.pkl"] + (["data/groups.npz"] if FLAGS.dedup is not None else [])
+    if FLAGS.lsa is not None:
+        features += ["data/lsa-embedding.npy", "data/lsa-components.npy"]
+    processed_file = "data/lsa-embedding.npy" if FLAGS.lsa is not None else "data/processed-data.pkl"
+    stages = [
+        Stage("query", "nih_reporter_query:get_data", [FLAGS.search_terms], downloads,
+              {"termsfile": FLAGS.search_terms, "start": FLAGS.start_year, "end": FLAGS.end_year+1, "operator": FLAGS.operator,
+               "base_url": FLAGS.base_url, "icite_url": FLAGS.icite_url}),
+        Stage("process_data", "feature_extraction:process_data", ["data/raw_data.csv"], ["data/data.pkl", "data/test-data.pkl"],
+              {"data_file": "data/raw_data.csv"}),
+        Stage("store", "award_store:build_store", downloads + ["data/data.pkl", "data/test-data.pkl"], ["data/awards.db"], {}),
+        Stage("feature_extraction", "pipeline:extract_features", ["data/data.pkl"],
+              features + ["data/vectorizer.pkl", "data/tfidf.npz", "data/features"],
+              {"max_features": FLAGS.max_features, "max_df": FLAGS.max_df, "dedup": FLAGS.dedup, "lsa": FLAGS.lsa, "precision": FLAGS.precision}),
+        Stage("index", "similarity_index:build_index", features, [os.path.splitext(processed_file)[0] + "-index.npz"],
+              {"processed_file": processed_file}),
+        Stage("funding", "pipeline:summarize", ["data/awards.db", "data/nih_institutes.csv"],
+              ["data/funding_cube.npz", "data/by_funder.csv", "data/by_year.csv", "data/by_mechanism.csv"], {"store": "data/awards.db"}),
+        Stage("cluster", "analyze_clusters:run_clustering",
+              ["data/data.pkl", "data/test-data.pkl", "data/vectorizer.pkl"] + features,
+              run + ["{}/top_terms.csv".format(results), "{}/centroids".format(results), "{}/assignments.npz".format(results), "{}/assignments_test.npz".format(results)],
+              {"selected_k": FLAGS.k, "num_trials": FLAGS.trials, "save_folder": results, "lsa": FLAGS.lsa is not None, "engine": FLAGS.engine}, results),
+        Stage("umap", "analyze_clusters:run_umap", features + run, ["{}/umap.png".format(results)],
+              {"save_folder": results}, results),
+        Stage("citations", "analyze_clusters:run_citations", run + ["data/data.pkl", "data/awards.db"],
+              ["{}/citations.pkl".format(results)], {"save_folder": results}, results),
+        Stage("report", "analyze_clusters:run_report",
+              run + ["{}/top_terms.csv".format(results), "{}/citations.pkl".format(results), "{}/assignments_test.npz".format(results), "data/data.pkl"],
+              ["{}/final_data.csv".format(results), "{}/supp_info.docx".format(results)], {"save_folder": results}, results),
+        ]
+    if FLAGS.find_k:
+        stages.append(Stage("find_k", "pipeline:search_k", features,
+                            ["data/finding_k.csv", "figures/k_selection.eps", "figures/k_selection_sse.eps"],
+                            {"trials": FLAGS.find_k_trials, "max_k": FLAGS.max_k, "processed_file": processed_file, "engine": FLAGS.engine}))
+    return [stage for stage in stages if stage.name not in FLAGS.skip]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--search_terms', type=str, default="search_terms.txt", help='Terms for NIH RePORTER query')
+    parser.add_argument('--operator', type=str, default="or", help='Operator for NIH RePORTER query (and, or, advanced)')
+    parser.add_argument('--start_year', type=int, default=1985, help='Start year for search (inclusive)')
+    parser.add_argument('--end_year', type=int, default=2021, help='End year for search (inclusive)')
+    parser.add_argument('--base_url', type=str, default="https://api.reporter.nih.gov", help='Base URL of the RePORTER API')
+    parser.add_argument('--icite_url', type=str, default="https://icite.od.nih.gov", help='Base URL of the iCite API')
+    parser.add_argument('--max_features', type=int, default=1000, help='number of features')
+    parser.add_argument('--max_df', type=float, default=0.1, help='maximum document frequency')
+    parser.add_argument('--dedup', type=float, default=None, help='collapse near-duplicate awards above this Jaccard similarity before vectorizing (e.g. 0.8)')
+    parser.add_argument('--lsa', type=int, default=None, help='cluster in an LSA (TruncatedSVD) space with this number of components (e.g. 100)')
+    parser.add_argument('--engine', type=str, default="minibatch", help='k-means engine (minibatch, spherical)')
+    parser.add_argument('--precision', type=str, default="float64", help='float64, or float32 for float32 features through clustering')
+    parser.add_argument('--k', type=int, default=50, help='number of clusters')
+    parser.add_argument('--trials', type=int, default=1, help='number of clustering trials')
+    parser.add_argument('--find_k', action='store_true', help='also run the empiric search for k')
+    parser.add_argument('--find_k_trials', type=int, default=5, help='numbers of trials per k')
+    parser.add_argument('--max_k', type=int, default=120, help='maximum number of clusters to evaluate')
+    parser.add_argument('--results', type=str, default=None, help='directory for clustering results (default a new results/<timestamp>; pass an existing one to resume it)')
+    parser.add_argument('--skip', nargs='*', default=[], help='stages to leave out, their outputs are used as inputs')
+    parser.add_argument('--force', nargs='*', default=[], help='stages to run even if up to date')
+    parser.add_argument('--jobs', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--profile', type=str, default=None, help='stage to profile, e.g. cluster or feature_extraction/fit')
+    parser.add_argument('--profiler', type=str, default="cprofile", help='profiler for --profile (cprofile, pyinstrument)')
+    FLAGS, unparsed = parser.parse_known_args()
+
+    if FLAGS.results is None:
+        from analyze_clusters import new_results_folder
+        FLAGS.results = new_results_folder()
+    os.makedirs(FLAGS.results, exist_ok=True)
+    if FLAGS.profile is not None:
+        perf.configure_profile(FLAGS.profile, FLAGS.profiler, FLAGS.results)
+    run_pipeline(build_stages(FLAGS), FLAGS.jobs, FLAGS.force, perf_file="{}/perf.json".format(FLAGS.results))
+    print("Complete.")
@@ -0,0 +1,167 @@
+import argparse
+import json
+import time
+import numpy as np
+import perf
+
+# Numeric precision of the features, selected with --precision
+DTYPES = {"float64": np.float64, "float32": np.float32}
+
+def compact(X, dtype=np.float32):
+    """
+    Features with values of dtype. Only the values shrink: scipy already stores CSR indices as int32
+    whenever they fit, so float32 saves about a third of the memory of a sparse TF-IDF matrix.
+    """
+    return X.astype(dtype, copy=False)
+
+def nbytes(X):
+    """
+    Memory of the values and indices of a sparse or dense matrix
+    """
+    if hasattr(X, "indices"):
+        return int(X.data.nbytes + X.indices.nbytes + X.indptr.nbytes)
+    return int(X.nbytes)
+
+def extract(dtype, processed_file="data/processed-data.pkl", tokenizer=None):
+    """
+    Features re-extracted in dtype: the TF-IDF vectorizer refit with the settings of data/vectorizer.pkl
+    on the awards of data.pkl (or their near-duplicate group representatives), projected onto the saved
+    LSA components when processed_file is the LSA embedding
+    """
+    import pickle
+    from sklearn.base import clone
+    from award_table import load_awards
+    from near_duplicates import load_groups
+    from lsa import is_lsa, normalize, COMPONENTS_FILE
+
+    data = load_awards("data/data.pkl")
+    groups = load_groups()
+    if groups is not None:
+        data = data.take(groups["representatives"])
+    vectorizer = clone(pickle.load(open("data/vectorizer.pkl","rb")))
+    vectorizer.set_params(dtype=dtype, **({} if tokenizer is None else {"tokenizer": tokenizer}))
+    X = compact(vectorizer.fit_transform(data.column("text")), dtype)
+    if is_lsa(processed_file):
+        X = normalize(np.asarray(X @ np.load(COMPONENTS_FILE).astype(dtype).T)).astype(dtype)
+    return X
+
+def validate_precision(k, processed_file="data/processed-data.pkl", engine="minibatch", seed=0,
+                       max_label_change=0.01, silhouette_tolerance=1e-3, report_file="data/precision-report.json"):
+    """
+
+    Parameters
+    ----------
+    k : number of clusters
+    processed_file : features (TF-IDF matrix or LSA embedding)
+    engine : string. "minibatch" or "spherical", as in get_clusters
+    seed : random seed shared by both fits
+    max_label_change : largest accepted fraction of awards assigned to a different cluster in float32
+    silhouette_tolerance : largest accepted difference of the mean silhouette score
+    report_file : path of the json report
+
+    Returns
+    -------
+    report : dictionary with the memory, time, labels and silhouettes of the float64 and float32 paths
+        and "ok", whether float32 is within tolerance
+
+    Both paths re-extract the features from the awards (float64 and float32 vectorizers sharing one
+    token cache), so the reference is a true float64 run whatever precision the saved features have.
+    Both fits start from the same k-means++ centers with the same seed, so mini-batch k-means samples the
+    same batches in the same order, and float32 passes only within max_label_change and silhouette_tolerance.
+    For mini-batch k-means the report also fits float64 with another batch seed; how many labels that
+    changes (reseed_label_change, reseed_silhouette_difference) is for reference and never widens the tolerances.
+    """
+    from sklearn.cluster import MiniBatchKMeans, kmeans_plusplus
+    import sklearn.metrics as metrics
+    from near_duplicates import load_groups
+    from spherical_kmeans import SphericalKMeans
+    from compare_runs import contingency, adjusted_rand_index
+    from feature_extraction import LemmaStemmerTokenizer
+
+    tokenizer = LemmaStemmerTokenizer(cache={})
+    with perf.timer("extract", items=2):
+        features = {name: extract(dtype, processed_file, tokenizer) for name, dtype in DTYPES.items()}
+    groups = load_groups()
+    weights = None if groups is None else groups["weights"]
+    metric = "cosine" if engine == "spherical" else "euclidean"
+    # Both paths start from the same k-means++ centers
+    init = kmeans_plusplus(features["float64"], k, random_state=seed)[0]
+    report = {"k": k, "engine": engine, "features": processed_file, "n": features["float64"].shape[0],
+              "max_difference": float(abs(features["float64"] - features["float32"].astype(np.float64)).max())}
+
+    def fit(X, batch_seed):
+        if engine == "spherical":
+            km = SphericalKMeans(n_clusters=k, init=init, random_state=seed)
+        else:
+            km = MiniBatchKMeans(n_clusters=k, init=init, n_init=1, random_state=batch_seed, max_no_improvement=None)
+        return km, km.fit_predict(X, sample_weight=weights)
+
+    results = {}
+    for name in ["float64", "float32"]:
+        X = features[name]
+        start = time.perf_counter()
+        with perf.timer("{}/kmeans".format(name)):
+            km, labels = fit(X, seed)
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        with perf.timer("{}/silhouette".format(name)):
+            scores = metrics.silhouette_samples(X, labels, metric=metric)
+        results[name] = (labels, scores)
+        report[name] = {
+            "feature_bytes": nbytes(X),
+            "value_dtype": str(X.dtype),
+            "index_dtype": str(X.indices.dtype) if hasattr(X, "indices") else None,
+            "centers_dtype": str(km.cluster_centers_.dtype),
+            "scores_dtype": str(scores.dtype),
+            "fit_s": elapsed,
+            "silhouette_s": time.perf_counter() - start,
+            "silhouette": float(np.mean(scores)),
+            }
+
+    (labels64, scores64), (labels32, scores32) = results["float64"], results["float32"]
+    report["label_change"] = float(np.mean(labels64 != labels32))
+    report["ari"] = adjusted_rand_index(contingency(labels64, labels32, k, k))
+    report["silhouette_difference"] = abs(report["float64"]["silhouette"] - report["float32"]["silhouette"])
+    report["max_sample_silhouette_difference"] = float(np.max(np.abs(scores64.astype(np.float64) - scores32)))
+    report["memory_ratio"] = report["float32"]["feature_bytes"] / report["float64"]["feature_bytes"]
+
+    report["max_label_change"], report["silhouette_tolerance"] = max_label_change, silhouette_tolerance
+    if engine != "spherical":
+        # Informational: the change another batch seed alone causes in float64
+        with perf.timer("reseed"):
+            km, labels = fit(features["float64"], seed + 1)
+            silhouette = float(np.mean(metrics.silhouette_samples(features["float64"], labels, metric=metric)))
+        report["reseed_label_change"] = float(np.mean(labels64 != labels))
+        report["reseed_silhouette_difference"] = abs(report["float64"]["silhouette"] - silhouette)
+    report["ok"] = report["label_change"] <= report["max_label_change"] and report["silhouette_difference"] <= report["silhouette_tolerance"]
+    with open(report_file, "w", encoding="utf8") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+def print_report(report):
+    print("{} awards, k={}, {} engine".format(report["n"], report["k"], report["engine"]))
+    for name in ["float64", "float32"]:
+        entry = report[name]
+        print("  {}: {:.1f} MB of features ({} values, {} indices), fit {:.2f}s, silhouette {:.2f}s, mean silhouette {:.5f}".format(
+            name, entry["feature_bytes"]/1e6, entry["value_dtype"], entry["index_dtype"], entry["fit_s"], entry["silhouette_s"], entry["silhouette"]))
+    print("  largest feature difference {:.2e}, memory ratio {:.2f}".format(report["max_difference"], report["memory_ratio"]))
+    print("  labels changed {:.2%} (ARI {:.4f}), silhouette difference {:.2e} (max per award {:.2e})".format(
+        report["label_change"], report["ari"], report["silhouette_difference"], report["max_sample_silhouette_difference"]))
+    if "reseed_label_change" in report:
+        print("  for reference, another mini-batch seed in float64 changes {:.2%} of labels, silhouette by {:.2e}".format(
+            report["reseed_label_change"], report["reseed_silhouette_difference"]))
+    print("  float32 {} the float64 path (accepting {:.2%} of labels changed, silhouette difference {:.2e})".format(
+        "matches" if report["ok"] else "DOES NOT match", report["max_label_change"], report["silhouette_tolerance"]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--k', type=int, required=True, help='number of clusters')
+    parser.add_argument('--features', type=str, default="data/processed-data.pkl", help='features to validate (data/processed-data.pkl or data/lsa-embedding.npy)')
+    parser.add_argument('--engine', type=str, default="minibatch", help='k-means engine (minibatch, spherical)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of both fits')
+    parser.add_argument('--max_label_change', type=float, default=0.01, help='largest accepted fraction of changed assignments')
+    parser.add_argument('--silhouette_tolerance', type=float, default=1e-3, help='largest accepted difference of the mean silhouette')
+    FLAGS, unparsed = parser.parse_known_args()
+
+    report = validate_precision(FLAGS.k, FLAGS.features, FLAGS.engine, FLAGS.seed, FLAGS.max_label_change, FLAGS.silhouette_tolerance)
+    print_report(report)
@@ -0,0 +1,136 @@
+import csv
+import os
+import numpy as np
+
+# Award fields stored in the columnar assignments file ("text" and "terms" are left in data.pkl)
+ASSIGNMENT_FIELDS = ["id", "title", "project_number", "administration", "organization", "mechanism", "year", "award_amount"]
+
+def write_assignments(save_folder, data, labels, scores=None, suffix="", per_cluster=True):
+    """
+
+    Parameters
+    ----------
+    save_folder : string. directory of the run
+    data : AwardTable of awards, ordered like labels
+    labels : array. cluster label of each award
+    scores : array. silhouette score of each award, optional
+    suffix : string. appended to output names, e.g. "_test" writes assignments_test.npz and clusters_test/
+    per_cluster : boolean. also export one csv per cluster
+
+    Returns
+    -------
+    path : string. path of the columnar assignments file
+
+    """
+    labels = np.asarray(labels)
+
+    writers = {}
+    handles = []
+    if per_cluster:
+        cluster_folder = "{}/clusters{}".format(save_folder, suffix)
+        os.makedirs(cluster_folder, exist_ok=True)
+        fieldnames = list(data[0].keys()) if len(data) > 0 else []
+        if scores is not None:
+            fieldnames.append("score")
+
+    # Single pass over awards: stream rows to their cluster file
+    for i, item in enumerate(data if per_cluster else []):
+        label = int(labels[i])
+        if label not in writers:
+            handle = open("{}/cluster-{}.csv".format(cluster_folder, label), 'w', newline='', encoding='utf8')
+            handles.append(handle)
+            writers[label] = csv.DictWriter(handle, fieldnames)
+            writers[label].writeheader()
+        row = dict(item)
+        if scores is not None:
+            row["score"] = scores[i]
+        writers[label].writerow(row)
+
+    for handle in handles:
+        handle.close()
+
+    arrays = {field: np.array(data.column(field)) for field in ASSIGNMENT_FIELDS}
+    arrays["award_amount"] = np.asarray(data.column("award_amount"), dtype=np.int64)
+    arrays["label"] = labels.astype(np.int32)
+    if scores is not None:
+        arrays["score"] = np.asarray(scores, dtype=np.float32)
+    path = "{}/assignments{}.npz".format(save_folder, suffix)
+    np.savez_compressed(path, **arrays)
+    return path
+
+def select_representatives(data, labels, scores, selected_k, n=5):
+    """
+
+    Parameters
+    ----------
+    data : list of dictionaries representing awards, ordered like labels
+    labels : array. cluster label of each award
+    scores : array. silhouette score of each award
+    selected_k : number of clusters
+    n : number of representative awards per cluster
+
+    Returns
+    -------
+    representatives : list of lists of dictionaries, top n unique titles by score for each cluster.
+        Resubmitted titles are represented by their most recent award.
+
+    """
+    unique_awards = [{} for i in range(selected_k)]
+    for i, item in enumerate(data):
+        cluster = unique_awards[int(labels[i])]
+        title = item["title"]
+        year = int(item["year"])
+        # Keep a new title, or replace it with a more recent award
+        if title not in cluster or year > cluster[title]["year"]:
+            cluster[title] = {
+                "title": title,
+                "organization": item["organization"],
+                "activity": item["mechanism"],
+                "year": year,
+                "score": float(scores[i]),
+                }
+
+    return [sorted(cluster.values(), key=lambda award: -award["score"])[0:n] for cluster in unique_awards]
+
+def write_supp_info(save_folder, representatives, n=5):
+    """
+
+    Parameters
+    ----------
+    save_folder : string. directory of the run
+    representatives : output of select_representatives
+    n : number of rows per cluster table
+
+    Returns
+    -------
+    Word document (supp_info.docx) with a table of representative awards for each non-empty cluster
+
+    """
+    if sum([len(awards) for awards in representatives]) == 0:
+        return
+    from docx import Document
+    document = Document()
+
+    for i, awards in enumerate(representatives):
+        if len(awards) == 0:
+            continue
+        p = document.add_paragraph()
+        p.add_run('Cluster {}:'.format(str(i))).bold = True
+        table = document.add_table(rows=n+1, cols=5)
+        hdr_cells = table.rows[0].cells
+        hdr_cells[0].text = 'Title'
+        hdr_cells[1].text = 'Awardee'
+        hdr_cells[2].text = 'Award Activity'
+        hdr_cells[3].text = 'Year'
+        hdr_cells[4].text = 'Sample Silhouette Score'
+
+        for j, award in enumerate(awards):
+            table.cell(j+1,0).text = award['title'] # Title
+            table.cell(j+1,1).text = award['organization'] # Awardee
+            table.cell(j+1,2).text = award['activity'] # Award Activity
+            table.cell(j+1,3).text = str(award['year']) # Year
+            table.cell(j+1,4).text = "{:.2g}".format(award['score']) # Sample Silhouette Score
+
+        document.add_page_break()
+
+    document.save('{}/supp_info.docx'.format(save_folder))
@@ -0,0 +1,166 @@
+import csv
+import json
+import os
+import numpy as np
+from award_table import load_awards
+from hashing import file_hash
+from lsa import is_lsa, project, COMPONENTS_FILE
+
+# Summary fields of a get_clusters output saved in run.json
+SUMMARY_FIELDS = ["score", "size", "yr_avg_cost", "yr_total_cost", "mechanisms"]
+
+VECTORIZER_FILE = "data/vectorizer.pkl"
+
+def fingerprints(paths):
+    """
+    Size, mtime and sha256 of each existing file (the hash is only recomputed when size or mtime change)
+    """
+    cache = {}
+    return {path: {"hash": file_hash(path, cache), "stamp": cache[path]["stamp"]} for path in paths if os.path.exists(path)}
+
+def save_run(save_folder, output, award_store="data/data.pkl", years=None, features="data/processed-data.pkl"):
+    """
+
+    Parameters
+    ----------
+    save_folder : string. directory of the run
+    output : dictionary returned by get_clusters
+    award_store : string. path of the awards that row indices refer to (labels[i] is the label of award i)
+    years : list of strings. years of "yr_total_cost"
+    features : string. features the run was clustered on (TF-IDF or LSA embedding)
+
+    Returns
+    -------
+    Compact run artifact in save_folder:
+        run.json - cluster summaries, the award store path and the fingerprints of the awards, vectorizer
+            and features the labels and centers belong to
+        labels.npy - int32 cluster label by award row
+        scores.npy - float32 silhouette score by award row
+        centers.npy - cluster centers
+        top_terms.csv - top centroid terms by cluster
+
+    """
+    labels = np.asarray(output["labels"], dtype=np.int32)
+    np.save("{}/labels.npy".format(save_folder), labels)
+    np.save("{}/scores.npy".format(save_folder), np.asarray(output["sample_scores"], dtype=np.float32))
+    np.save("{}/centers.npy".format(save_folder), output["model"].cluster_centers_)
+
+    with open("{}/top_terms.csv".format(save_folder), 'w', newline='', encoding='utf8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["cluster"] + ["term_{}".format(j+1) for j in range(len(output["centroids"][0]))])
+        for i, terms in enumerate(output["centroids"]):
+            writer.writerow([i] + list(terms))
+
+    meta = {
+        "k": len(output["size"]),
+        "n": len(labels),
+        "award_store": award_store,
+        "years": years,
+        "features": features,
+        "inputs": fingerprints([award_store, VECTORIZER_FILE, features] + ([COMPONENTS_FILE] if is_lsa(features) else [])),
+        }
+    for field in SUMMARY_FIELDS:
+        meta[field] = np.asarray(output[field]).tolist()
+    with open("{}/run.json".format(save_folder), "w", encoding="utf8") as f:
+        json.dump(meta, f)
+
+class ClusterRun:
+    """
+    Lazy accessor for a saved run. Arrays are memory-mapped and awards are loaded from the
+    award store only when per-cluster views are requested. The award store, vectorizer and features
+    are checked against the fingerprints saved with the run before they are used.
+
+    Parameters
+    ----------
+    save_folder : string. directory of the run
+    """
+    def __init__(self, save_folder):
+        self.save_folder = save_folder
+        self.meta = json.load(open("{}/run.json".format(save_folder), encoding="utf8"))
+        self.k = self.meta["k"]
+        self._awards = None
+        self._order = None
+
+    def __getitem__(self, field):
+        """
+        Summary fields, e.g. run["size"] or run["yr_total_cost"]
+        """
+        return self.meta[field]
+
+    @property
+    def features(self):
+        return self.meta.get("features", "data/processed-data.pkl")
+
+    @property
+    def labels(self):
+        return np.load("{}/labels.npy".format(self.save_folder), mmap_mode="r")
+
+    @property
+    def scores(self):
+        return np.load("{}/scores.npy".format(self.save_folder), mmap_mode="r")
+
+    @property
+    def centers(self):
+        return np.load("{}/centers.npy".format(self.save_folder))
+
+    @property
+    def top_terms(self):
+        with open("{}/top_terms.csv".format(self.save_folder), newline='', encoding='utf8') as csvfile:
+            rows = list(csv.reader(csvfile))
+        return [row[1:] for row in rows[1:]]
+
+    def check_inputs(self, paths=None):
+        """
+        Raises ValueError if a file the run was made from (all of them, or those in paths) has changed
+        since. A file whose size and mtime are unchanged is not re-read.
+        """
+        for path, saved in self.meta.get("inputs", {}).items():
+            if paths is not None and path not in paths:
+                continue
+            if not os.path.exists(path):
+                raise ValueError("{} was used by the run in {} and no longer exists".format(path, self.save_folder))
+            if file_hash(path, {path: saved}) != saved["hash"]:
+                raise ValueError("{} has changed since the run in {} was saved, its labels no longer match; cluster again".format(path, self.save_folder))
+
+    @property
+    def awards(self):
+        if self._awards is None:
+            self.check_inputs([self.meta["award_store"]])
+            self._awards = load_awards(self.meta["award_store"])
+            if len(self._awards) != self.meta["n"]:
+                raise ValueError("{} has {} awards but the run has {} labels".format(self.meta["award_store"], len(self._awards), self.meta["n"]))
+        return self._awards
+
+    def members(self, i):
+        """
+        Row indices of the awards in cluster i
+        """
+        if self._order is None:
+            labels = np.asarray(self.labels)
+            self._order = np.argsort(labels, kind="stable")
+            self._bounds = np.searchsorted(labels[self._order], np.arange(self.k + 1))
+        return self._order[self._bounds[i]:self._bounds[i+1]]
+
+    def cluster(self, i):
+        """
+        Awards in cluster i, each with its silhouette "score" (copies; the award store is not modified)
+        """
+        scores = self.scores
+        return [dict(self.awards[row], score=float(scores[row])) for row in self.members(i)]
+
+    def clusters(self):
+        """
+        Awards of every cluster: [ [{Cluster1pt1}, {Cluster1pt2},...], [{Cluster2pt1}, ...], ...]
+        """
+        return [self.cluster(i) for i in range(self.k)]
+
+    def predict(self, X):
+        """
+        Label of the nearest center for each row of TF-IDF features X (projected for runs clustered in the LSA space)
+        """
+        self.check_inputs([VECTORIZER_FILE] + ([COMPONENTS_FILE] if is_lsa(self.features) else []))
+        if is_lsa(self.features):
+            X = project(X)
+        centers = self.centers
+        distances = (centers**2).sum(axis=1) - 2 * np.asarray(X @ centers.T)
+        return distances.argmin(axis=1)
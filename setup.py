@@ -1,7 +1,7 @@
 import os
 import nltk
 import csv
-from pylab import sys
+import sys
 
 print("Creating directories...")
 
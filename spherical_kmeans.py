@@ -0,0 +1,166 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import perf
+
+class SphericalKMeans:
+    """
+    Spherical (cosine) k-means for L2-normalized rows such as TF-IDF output, on sparse CSR or dense input.
+    Centers have the dtype of the input (float32 features give float32 centers).
+    Centers are unit length mean directions, so the nearest center is the one with the largest dot product.
+    Assignment uses sparse-dense products split across threads, and Hamerly's bounds skip the points
+    whose assignment cannot have changed since the last iteration.
+
+    Has the attributes and methods of sklearn's KMeans that the scripts use: cluster_centers_, labels_,
+    inertia_ (sum of squared euclidean distances to the centers), n_iter_, fit, fit_predict and predict.
+
+    Parameters
+    ----------
+    n_clusters : number of clusters
+    init : 'k-means++', 'random' or array of initial centers
+    max_iter : maximum number of iterations
+    tol : stop when no center moves by more than tol
+    n_jobs : number of assignment threads, the default is the number of CPUs
+    random_state : random seed
+    verbose : print progress by iteration
+    """
+    def __init__(self, n_clusters=8, init='k-means++', max_iter=100, tol=1e-4, n_jobs=None, random_state=None, verbose=0):
+        self.n_clusters = n_clusters
+        self.init = init
+        self.max_iter = max_iter
+        self.tol = tol
+        self.n_jobs = n_jobs if n_jobs is not None else os.cpu_count()
+        self.random_state = random_state
+        self.verbose = verbose
+
+    def _dot(self, X, centers, rows=None):
+        """
+        Dot products of rows of X with every center, computed in row chunks by a thread pool
+        """
+        rows = np.arange(X.shape[0]) if rows is None else rows
+        chunks = [chunk for chunk in np.array_split(rows, self.n_jobs) if len(chunk) > 0]
+        if len(chunks) <= 1:
+            return np.asarray(X[rows] @ centers.T)
+        with ThreadPoolExecutor(len(chunks)) as pool:
+            return np.vstack(list(pool.map(lambda chunk: np.asarray(X[chunk] @ centers.T), chunks)))
+
+    def _init_centers(self, X, rng):
+        n = X.shape[0]
+        if not isinstance(self.init, str):
+            return normalize(np.asarray(self.init, dtype=X.dtype))
+        if self.init == 'random':
+            return normalize(dense_rows(X, rng.choice(n, self.n_clusters, replace=False)))
+        # Greedy k-means++ on cosine distance (as in sklearn): draw candidates with probability proportional
+        # to 1 - max similarity and keep the one that leaves the smallest total distance
+        trials = 2 + int(np.log(self.n_clusters))
+        centers = [dense_rows(X, [rng.integers(n)])[0]]
+        similarity = np.asarray(X @ centers[0]).ravel()
+        for j in range(1, self.n_clusters):
+            distance = np.clip(1 - similarity, 0, None)
+            total = distance.sum()
+            choices = rng.choice(n, size=trials, p=distance/total) if total > 0 else rng.integers(n, size=trials)
+            candidates = dense_rows(X, choices)
+            candidate_similarity = np.maximum(similarity[:, None], np.asarray(X @ candidates.T))
+            best = np.argmax(candidate_similarity.sum(axis=0))
+            centers.append(candidates[best])
+            similarity = candidate_similarity[:, best]
+        return normalize(np.array(centers))
+
+    def _update_centers(self, X, labels, weights, old_centers, distances):
+        k = self.n_clusters
+        from scipy import sparse
+        membership = sparse.csr_matrix((weights, (labels, np.arange(len(labels)))), shape=(k, len(labels)))
+        sums = membership @ X
+        sums = (sums.toarray() if hasattr(sums, "toarray") else np.asarray(sums)).astype(X.dtype, copy=False)
+        # Empty clusters restart at the points farthest from their centers
+        empty = np.flatnonzero(np.bincount(labels, minlength=k) == 0)
+        if len(empty) > 0:
+            farthest = np.argsort(-distances)[:len(empty)]
+            sums[empty] = dense_rows(X, farthest)
+        norms = np.linalg.norm(sums, axis=1)
+        sums[norms == 0] = old_centers[norms == 0]
+        return normalize(sums)
+
+    def fit(self, X, y=None, sample_weight=None):
+        n = X.shape[0]
+        rng = np.random.default_rng(self.random_state)
+        weights = np.ones(n) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+        sq_norms = row_sq_norms(X)
+        centers = self._init_centers(X, rng)
+
+        # Exact assignment, upper bound on the distance to the assigned center
+        # and lower bound on the distance to any other center
+        labels, upper, lower = self._assign(X, centers, sq_norms)
+        skipped = 0
+
+        for iteration in range(self.max_iter):
+            new_centers = self._update_centers(X, labels, weights, centers, upper)
+            shift = np.linalg.norm(new_centers - centers, axis=1)
+            centers = new_centers
+            upper += shift[labels]
+            lower -= shift.max()
+            if shift.max() <= self.tol:
+                break
+
+            # Half the distance from each center to its nearest other center
+            center_distance = np.sqrt(np.clip(2 - 2 * (centers @ centers.T), 0, None))
+            np.fill_diagonal(center_distance, np.inf)
+            half_gap = center_distance.min(axis=1) / 2
+
+            bound = np.maximum(half_gap[labels], lower)
+            candidates = np.flatnonzero(upper > bound)
+            if len(candidates) > 0:
+                # Tighten the upper bound, then recompute every center only where it still exceeds the bound
+                assigned = rows_dot(X, candidates, centers[labels[candidates]])
+                upper[candidates] = np.sqrt(np.clip(sq_norms[candidates] - 2 * assigned + 1, 0, None))
+                candidates = candidates[upper[candidates] > bound[candidates]]
+            if len(candidates) > 0:
+                labels[candidates], upper[candidates], lower[candidates] = self._assign(X, centers, sq_norms, candidates)
+            skipped += n - len(candidates)
+            if self.verbose:
+                print("Iteration {}: {} of {} points reassigned".format(iteration+1, len(candidates), n))
+
+        self.cluster_centers_ = centers
+        self.labels_, distances, _ = self._assign(X, centers, sq_norms)
+        self.inertia_ = float(np.sum(weights * distances**2))
+        self.n_iter_ = iteration + 1
+        perf.count("spherical_kmeans/assignments_skipped", skipped)
+        return self
+
+    def _assign(self, X, centers, sq_norms, rows=None):
+        similarity = self._dot(X, centers, rows)
+        # Best and second best center (argpartition puts the largest similarity first)
+        order = np.argpartition(-similarity, 1, axis=1)[:, :2] if centers.shape[0] > 1 else np.zeros((similarity.shape[0], 1), dtype=int)
+        index = np.arange(similarity.shape[0])
+        norms = sq_norms if rows is None else sq_norms[rows]
+        best = np.sqrt(np.clip(norms - 2 * similarity[index, order[:, 0]] + 1, 0, None))
+        second = np.sqrt(np.clip(norms - 2 * similarity[index, order[:, -1]] + 1, 0, None)) if centers.shape[0] > 1 else np.full(len(index), np.inf)
+        return order[:, 0], best, second
+
+    def fit_predict(self, X, y=None, sample_weight=None):
+        return self.fit(X, sample_weight=sample_weight).labels_
+
+    def predict(self, X):
+        return np.asarray(self._dot(X, self.cluster_centers_)).argmax(axis=1)
+
+def normalize(centers):
+    norms = np.linalg.norm(centers, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return centers / norms
+
+def dense_rows(X, rows):
+    rows = X[np.asarray(rows)]
+    return rows.toarray() if hasattr(rows, "toarray") else np.array(rows)
+
+def row_sq_norms(X):
+    if hasattr(X, "multiply"):
+        return np.asarray(X.multiply(X).sum(axis=1)).ravel()
+    return np.einsum("ij,ij->i", X, X)
+
+def rows_dot(X, rows, vectors):
+    """
+    Dot product of each selected row of X with its own vector
+    """
+    if hasattr(X, "multiply"):
+        return np.asarray(X[rows].multiply(vectors).sum(axis=1)).ravel()
+    return np.einsum("ij,ij->i", X[rows], vectors)
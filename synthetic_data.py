@@ -0,0 +1,182 @@
+import csv
+import os
+import numpy as np
+
+# Columns of data/raw_data.csv read by process_data (RePORTER project records flattened with sep='_')
+RAW_FIELDS = ["appl_id", "project_num", "project_title", "abstract_text", "phr_text", "terms", "agency_ic_admin_abbreviation",
+              "organization_org_name", "activity_code", "fiscal_year", "award_amount", "direct_cost_amt", "cong_dist"]
+
+# Columns of data/publications.csv and data/citations.csv (iCite order; the award database reads them by name)
+PUBLICATION_FIELDS = ["coreproject", "pmid", "applid"]
+CITATION_FIELDS = ["pmid", "year", "title", "authors", "journal", "is_research_article", "relative_citation_ratio", "nih_percentile",
+                   "human", "animal", "molecular_cellular", "apt", "is_clinical", "citation_count", "citations_per_year",
+                   "expected_citations_per_year", "field_citation_rate", "provisional", "doi"]
+
+ADMINISTRATIONS = ["NCI", "NHLBI", "NIGMS", "NIMH", "NIA", "NIBIB", "NLM", "NIDDK", "NINDS", "NIAID", "NICHD", "NIDA", "NIEHS", "AHRQ", "NHGRI"]
+MECHANISMS = ["R01", "U01", "R44", "U24", "R21", "U54", "R43", "P30", "K08", "F31", "Z01", "T32"]
+MECHANISM_WEIGHTS = [0.35, 0.08, 0.06, 0.04, 0.12, 0.03, 0.08, 0.05, 0.07, 0.04, 0.04, 0.04]
+APT_VALUES = [0.05, 0.25, 0.5, 0.75, 0.95]
+SYLLABLES = ["neu", "ro", "car", "dio", "gen", "om", "ic", "bio", "lo", "gy", "im", "mu", "no", "path", "cell", "ul", "ar",
+             "tis", "sue", "ther", "apy", "dis", "ease", "pro", "tein", "mod", "el", "learn", "ing", "net", "work", "da", "ta"]
+
+YEARS = list(range(1985, 2022))
+PMID_STRIDE = 8 # maximum publications per award; award i owns pmids PMID_BASE + i*PMID_STRIDE + j
+PMID_BASE = 20000000
+
+def vocabulary(size=4000, seed=0):
+    """
+    Deterministic list of distinct alphabetic pseudo-words
+    """
+    rng = np.random.default_rng(seed)
+    words = []
+    seen = set()
+    while len(words) < size:
+        word = "".join(rng.choice(SYLLABLES, size=rng.integers(2, 5)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+class SyntheticCorpus:
+    """
+    Deterministic synthetic awards with topic-structured text. Award i is generated on demand from (seed, i),
+    so any slice of the corpus can be produced without generating the rest.
+
+    Parameters
+    ----------
+    n : number of awards
+    seed : random seed
+    n_topics : number of latent topics
+    words_per_doc : mean number of words in an abstract
+    papers_per_award : mean number of linked publications
+    """
+    def __init__(self, n, seed=0, n_topics=50, words_per_doc=150, papers_per_award=0.5):
+        self.n = n
+        self.seed = seed
+        self.words_per_doc = words_per_doc
+        self.papers_per_award = papers_per_award
+        self.words = np.array(vocabulary(seed=seed))
+        rng = np.random.default_rng(seed)
+
+        # Each topic prefers its own 150 words, drawn with Zipf-like weights
+        self.topic_words = np.array([rng.choice(len(self.words), size=150, replace=False) for t in range(n_topics)])
+        weights = 1.0 / np.arange(1, 151)
+        self.topic_cdf = np.cumsum(weights / weights.sum())
+        self.mechanism_cdf = np.cumsum(MECHANISM_WEIGHTS)
+
+        # Funding grows over time, so later fiscal years hold more awards
+        year_weights = np.exp(0.1 * np.arange(len(YEARS)))
+        self.years = np.array(YEARS)[rng.choice(len(YEARS), size=n, p=year_weights/year_weights.sum())]
+        self.topics = rng.integers(0, n_topics, size=n)
+
+    def text(self, rng, topic, size):
+        topic_part = self.topic_words[topic][np.minimum(np.searchsorted(self.topic_cdf, rng.random(size)), 149)]
+        background = rng.integers(0, len(self.words), size=size//3)
+        return " ".join(self.words[np.concatenate([topic_part, background])])
+
+    def award(self, i):
+        """
+        RePORTER project record of award i (nested like the /v2/projects/search response)
+        """
+        rng = np.random.default_rng([self.seed, i])
+        topic = self.topics[i]
+        mechanism = MECHANISMS[min(int(np.searchsorted(self.mechanism_cdf, rng.random())), len(MECHANISMS)-1)]
+        # Renewals and resubmissions reuse the project number and title of an earlier award
+        project = i if rng.random() > 0.2 or i == 0 else int(rng.integers(0, i))
+        title_rng = np.random.default_rng([self.seed, project, 1])
+        title = self.text(title_rng, self.topics[project], 6).title()
+        abstract = "No abstract available" if rng.random() < 0.01 else self.text(rng, topic, int(rng.poisson(self.words_per_doc)))
+        amount = int(rng.lognormal(12.5, 0.8)) if rng.random() > 0.01 else 0
+        return {
+            "appl_id": 1000000 + i,
+            "project_num": "{}{}{}-{:02d}".format(int(rng.integers(1, 6)), mechanism, "CA{:06d}".format(project), int(rng.integers(1, 10))),
+            "project_title": title,
+            "abstract_text": abstract,
+            "phr_text": self.text(rng, topic, 30),
+            "terms": ";".join(self.words[self.topic_words[topic][rng.choice(150, size=8)]]),
+            "agency_ic_admin": {"abbreviation": ADMINISTRATIONS[topic % len(ADMINISTRATIONS)]},
+            "organization": {"org_name": "UNIVERSITY {}".format(int(rng.integers(0, 500)))},
+            "activity_code": mechanism,
+            "fiscal_year": int(self.years[i]),
+            "award_amount": amount,
+            "direct_cost_amt": int(amount * 0.7),
+            "cong_dist": "{}-{:02d}".format(["MA", "CA", "NY", "TX", "PA"][int(rng.integers(0, 5))], int(rng.integers(1, 20))),
+            }
+
+    def publications(self, i, project_num=None):
+        """
+        Publication records (coreproject, pmid, applid) linked to award i
+        """
+        rng = np.random.default_rng([self.seed, i, 2])
+        count = min(int(rng.poisson(self.papers_per_award)), PMID_STRIDE)
+        if project_num is None:
+            project_num = self.award(i)["project_num"]
+        core_project = project_num[1:].split("-")[0]
+        return [{"coreproject": core_project, "pmid": PMID_BASE + i*PMID_STRIDE + j, "applid": 1000000 + i} for j in range(count)]
+
+    def citation(self, pmid):
+        """
+        iCite record of a publication
+        """
+        rng = np.random.default_rng([self.seed, pmid, 3])
+        award = (pmid - PMID_BASE) // PMID_STRIDE
+        year = min(int(self.years[award]) + int(rng.integers(0, 4)), 2021)
+        citations = int(rng.negative_binomial(2, 0.1))
+        return {
+            "pmid": pmid, "year": year, "title": "Paper {}".format(pmid), "authors": "A. Author", "journal": "J Synth",
+            "is_research_article": "Yes", "relative_citation_ratio": round(float(rng.gamma(2, 0.6)), 2),
+            "nih_percentile": round(float(rng.uniform(0, 100)), 1), "human": round(float(rng.random()), 2),
+            "animal": round(float(rng.random()), 2), "molecular_cellular": round(float(rng.random()), 2),
+            "apt": APT_VALUES[int(rng.integers(0, len(APT_VALUES)))], "is_clinical": "No", "citation_count": citations,
+            "citations_per_year": round(citations / max(2022 - year, 1), 2), "expected_citations_per_year": 2.0,
+            "field_citation_rate": 4.0, "provisional": "No", "doi": "10.0000/synth.{}".format(pmid),
+            }
+
+def flatten(record, prefix=""):
+    """
+    Flattens a nested record like pd.json_normalize(record, sep='_')
+    """
+    flat = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + "_"))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+def write_corpus(n, folder="data", seed=0):
+    """
+
+    Parameters
+    ----------
+    n : number of awards
+    folder : string. directory for raw_data.csv, publications.csv and citations.csv
+    seed : random seed
+
+    Returns
+    -------
+    corpus : SyntheticCorpus that generated the files
+
+    """
+    corpus = SyntheticCorpus(n, seed)
+    os.makedirs(folder, exist_ok=True)
+    pmids = []
+    with open("{}/raw_data.csv".format(folder), 'w', newline='', encoding='utf8') as raw_file, \
+         open("{}/publications.csv".format(folder), 'w', newline='', encoding='utf8') as pub_file:
+        raw_writer = csv.DictWriter(raw_file, RAW_FIELDS)
+        raw_writer.writeheader()
+        pub_writer = csv.DictWriter(pub_file, PUBLICATION_FIELDS)
+        pub_writer.writeheader()
+        for i in range(n):
+            award = corpus.award(i)
+            raw_writer.writerow(flatten(award))
+            for publication in corpus.publications(i, award["project_num"]):
+                pub_writer.writerow(publication)
+                pmids.append(publication["pmid"])
+
+    with open("{}/citations.csv".format(folder), 'w', newline='', encoding='utf8') as cite_file:
+        cite_writer = csv.DictWriter(cite_file, CITATION_FIELDS)
+        cite_writer.writeheader()
+        for pmid in pmids:
+            cite_writer.writerow(corpus.citation(pmid))
+    return corpus
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from sklearn.metrics import adjusted_rand_score, normalized_mutual_info_score
+from compare_runs import contingency, adjusted_rand_index, normalized_mutual_info, match_clusters
+
+def labelings(n=2000, ka=12, kb=9, seed=0):
+    """
+    Two related labelings: b is a coarsening of a with 30% of the labels redrawn
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(ka, size=n)
+    b = np.where(rng.random(n) < 0.3, rng.integers(kb, size=n), a % kb)
+    return a, b
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_scores_match_sklearn(seed):
+    a, b = labelings(seed=seed)
+    table = contingency(a, b, 12, 9)
+    assert adjusted_rand_index(table) == pytest.approx(adjusted_rand_score(a, b), abs=1e-10)
+    assert normalized_mutual_info(table) == pytest.approx(normalized_mutual_info_score(a, b), abs=1e-10)
+
+def test_identical_and_independent_labelings():
+    a, _ = labelings()
+    permuted = (a * 5 + 3) % 12
+    table = contingency(a, permuted, 12, 12)
+    assert adjusted_rand_index(table) == pytest.approx(1.0)
+    assert normalized_mutual_info(table) == pytest.approx(1.0)
+    independent = np.random.default_rng(3).integers(12, size=len(a))
+    assert abs(adjusted_rand_index(contingency(a, independent, 12, 12))) < 0.01
+
+def test_awards_missing_from_a_run_are_left_out():
+    a, b = labelings()
+    missing = a.copy()
+    missing[:100] = -1
+    table = contingency(missing, b, 12, 9)
+    assert table.sum() == len(a) - 100
+    assert adjusted_rand_index(table) == pytest.approx(adjusted_rand_score(a[100:], b[100:]), abs=1e-10)
+
+def test_relabeled_clusters_are_matched():
+    a, _ = labelings()
+    permuted = (a * 5 + 3) % 12
+    match, jaccard = match_clusters(contingency(a, permuted, 12, 12))
+    assert np.array_equal(match, (np.arange(12) * 5 + 3) % 12)
+    assert np.allclose(jaccard, 1)
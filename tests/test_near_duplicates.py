@@ -0,0 +1,39 @@
+import numpy as np
+from award_table import AwardTable, FIELDS
+from near_duplicates import minhash_signatures, collapse
+
+def words(rng, n):
+    return " ".join("w{}".format(i) for i in rng.integers(0, 5000, size=n))
+
+def table(texts, years):
+    columns = {field: [""] * len(texts) for field in FIELDS}
+    columns.update({"text": texts, "year": [str(year) for year in years], "terms": [[]] * len(texts),
+                    "id": [str(i) for i in range(len(texts))], "award_amount": [0] * len(texts)})
+    return AwardTable.from_columns(columns)
+
+def test_signatures_estimate_jaccard():
+    rng = np.random.default_rng(0)
+    base = words(rng, 200).split()
+    # Replacing the last 40 words keeps 158 of the 198 3-shingles of each text
+    edited = base[:160] + words(rng, 40).split()
+    signatures = minhash_signatures([" ".join(base), " ".join(edited)], num_perm=256)
+    jaccard = 158 / (198 + 198 - 158)
+    assert abs(np.mean(signatures[0] == signatures[1]) - jaccard) < 0.1
+
+def test_collapse_groups_resubmissions():
+    rng = np.random.default_rng(0)
+    originals = [words(rng, 200) for _ in range(20)]
+    # Awards 20-29 resubmit awards 0-9 later with one word changed, 30-49 are unrelated
+    resubmissions = [text.rsplit(" ", 1)[0] + " revised" for text in originals[:10]]
+    texts = originals + resubmissions + [words(rng, 200) for _ in range(20)]
+    years = [2010] * 20 + [2012] * 10 + [2010] * 20
+    groups = collapse(table(texts, years), threshold=0.8)
+
+    assert len(groups["representatives"]) == 40
+    assert groups["weights"].sum() == 50
+    for i in range(10):
+        # The most recent award of the pair represents it
+        assert groups["group"][i] == groups["group"][20 + i]
+        assert groups["representatives"][groups["group"][i]] == 20 + i
+        assert groups["weights"][groups["group"][i]] == 2
+    assert len(set(groups["group"][30:])) == 20
@@ -0,0 +1,59 @@
+import os
+import time
+import pytest
+from pipeline import Stage, run_pipeline
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+    # A new mtime, so the hash cache keyed by (size, mtime) sees the change
+    t = time.time() + 1
+    os.utime(path, (t, t))
+
+def chain(folder=None):
+    # a.txt -> b.txt -> c.txt, copied by shutil in the worker processes
+    return [
+        Stage("first", "shutil:copyfile", ["a.txt"], ["b.txt"], {"src": "a.txt", "dst": "b.txt"}),
+        Stage("second", "shutil:copyfile", ["b.txt"], ["c.txt"], {"src": "b.txt", "dst": "c.txt"}, folder=folder),
+        ]
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # Stages read and write paths relative to the working directory, the state goes to data/
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("data")
+    return tmp_path
+
+def test_unchanged_stages_are_skipped(workdir):
+    write("a.txt", "one")
+    assert run_pipeline(chain(), jobs=1) == ["first", "second"]
+    assert open("c.txt").read() == "one"
+    assert run_pipeline(chain(), jobs=1) == []
+
+def test_changed_input_reruns_dependents(workdir):
+    write("a.txt", "one")
+    run_pipeline(chain(), jobs=1)
+    write("a.txt", "two")
+    assert run_pipeline(chain(), jobs=1) == ["first", "second"]
+    assert open("c.txt").read() == "two"
+
+def test_changed_output_reruns_its_stage(workdir):
+    write("a.txt", "one")
+    run_pipeline(chain(), jobs=1)
+    write("c.txt", "edited")
+    assert run_pipeline(chain(), jobs=1) == ["second"]
+    assert open("c.txt").read() == "one"
+
+def test_changed_params_and_force(workdir):
+    write("a.txt", "one")
+    run_pipeline(chain(), jobs=1)
+    assert run_pipeline(chain(), jobs=1, force=("first",)) == ["first"]
+    stages = chain()
+    stages[0].params["follow_symlinks"] = False
+    assert run_pipeline(stages, jobs=1) == ["first"]
+
+def test_results_folders_are_memoized_separately(workdir):
+    write("a.txt", "one")
+    assert run_pipeline(chain("results/1"), jobs=1) == ["first", "second"]
+    assert run_pipeline(chain("results/2"), jobs=1) == ["second"]
+    assert run_pipeline(chain("results/1"), jobs=1) == []
@@ -0,0 +1,43 @@
+import pickle
+import numpy as np
+from scipy import sparse
+from similarity_index import RandomProjectionIndex, measure_recall
+
+def clustered(n=10000, terms=2000, k=100, seed=0):
+    """
+    Unit length rows of 60 word counts, 80% drawn from the 100 terms of one of k topics, like clustered TF-IDF rows
+    """
+    rng = np.random.default_rng(seed)
+    topics = [rng.choice(terms, 100, replace=False) for _ in range(k)]
+    rows, cols = [], []
+    for i, topic in enumerate(rng.integers(k, size=n)):
+        words = np.where(rng.random(60) < 0.8, rng.choice(topics[topic], 60), rng.integers(terms, size=60))
+        rows += [i] * len(words)
+        cols += words.tolist()
+    X = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, terms))
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    return sparse.csr_matrix(sparse.diags(1 / norms) @ X)
+
+def test_recall_of_nearest_neighbors():
+    index = RandomProjectionIndex(n_tables=32, n_bits=8).build(clustered())
+    recall = measure_recall(index, k=10, probes=2, n_queries=100)
+    assert recall["recall"] >= 0.8
+    # Most queries rank the rows of their buckets, not the whole index
+    assert recall["candidates"] < index.vectors.shape[0] / 2
+    # Probing more buckets finds more of the neighbors
+    assert measure_recall(index, k=10, probes=0, n_queries=100)["recall"] < recall["recall"]
+
+def test_saved_index_answers_the_same(tmp_path):
+    X = clustered(n=1000, seed=1)
+    features = str(tmp_path / "features.pkl")
+    with open(features, "wb") as handle:
+        pickle.dump(X, handle)
+    index = RandomProjectionIndex().build(X)
+    path = str(tmp_path / "index.npz")
+    index.save(path, features)
+    loaded = RandomProjectionIndex.load(path)
+    neighbors, similarities = index.query(X[:20], k=5)
+    for a, b in zip(neighbors, loaded.query(X[:20], k=5)[0]):
+        assert np.array_equal(a, b)
+    # A row is its own nearest neighbor
+    assert [row[0] for row in neighbors] == list(range(20))
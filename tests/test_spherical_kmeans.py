@@ -0,0 +1,49 @@
+import numpy as np
+from scipy import sparse
+import perf
+from spherical_kmeans import SphericalKMeans, normalize
+
+def clustered(n=600, dims=200, k=6, seed=0):
+    """
+    Unit length sparse rows around k random directions
+    """
+    rng = np.random.default_rng(seed)
+    directions = rng.random((k, dims)) ** 8
+    X = directions[rng.integers(k, size=n)] + 0.5 * rng.random((n, dims)) ** 8
+    X[rng.random((n, dims)) < 0.7] = 0
+    return sparse.csr_matrix(normalize(X))
+
+def lloyd(X, centers, iterations=100):
+    """
+    Spherical k-means without bounds: every point is reassigned in every iteration
+    """
+    for _ in range(iterations):
+        labels = np.asarray(X @ centers.T).argmax(axis=1)
+        sums = np.vstack([np.asarray(X[labels == j].sum(axis=0)).ravel() for j in range(len(centers))])
+        new_centers = normalize(sums)
+        if np.allclose(new_centers, centers):
+            break
+        centers = new_centers
+    return labels
+
+def test_labels_match_predict():
+    X = clustered()
+    km = SphericalKMeans(n_clusters=6, random_state=0, n_jobs=2).fit(X)
+    assert np.array_equal(km.labels_, km.predict(X))
+    assert np.allclose(np.linalg.norm(km.cluster_centers_, axis=1), 1)
+
+def test_hamerly_bounds_match_full_reassignment():
+    X = clustered(seed=1)
+    init = normalize(X[np.random.default_rng(1).choice(X.shape[0], 6, replace=False)].toarray())
+    perf.reset()
+    km = SphericalKMeans(n_clusters=6, init=init, tol=0, random_state=0).fit(X)
+    assert perf.recorder.counters["spherical_kmeans/assignments_skipped"] > 0
+    assert np.array_equal(km.labels_, lloyd(X, init))
+
+def test_sparse_dense_and_float32_agree():
+    X = clustered(seed=2)
+    labels = SphericalKMeans(n_clusters=6, random_state=0).fit_predict(X)
+    assert np.array_equal(SphericalKMeans(n_clusters=6, random_state=0).fit_predict(X.toarray()), labels)
+    km = SphericalKMeans(n_clusters=6, random_state=0).fit(X.astype(np.float32))
+    assert km.cluster_centers_.dtype == np.float32
+    assert np.mean(km.labels_ == labels) > 0.99
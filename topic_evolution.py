@@ -0,0 +1,253 @@
+import argparse
+import csv
+import json
+import os
+import time
+import numpy as np
+import perf
+from award_table import load_awards
+from lsa import load_features, term_weights
+from near_duplicates import load_groups
+
+def sliding_windows(years, window=5, step=1, start_year=None, end_year=None):
+    """
+    Fiscal-year windows (first year, last year) of window years every step years, over the years of the corpus
+    """
+    start_year = int(min(years)) if start_year is None else start_year
+    end_year = int(max(years)) if end_year is None else end_year
+    last = max(start_year, end_year - window + 1)
+    windows = [(first, min(first + window - 1, end_year)) for first in range(start_year, last + 1, step)]
+    if windows[-1][1] < end_year:
+        # The last window always ends with the last year
+        windows.append((last, end_year))
+    return windows
+
+def row_years(data_file="data/data.pkl"):
+    """
+    Fiscal year of each feature row: of each award, or of each near-duplicate group representative
+    """
+    data = load_awards(data_file)
+    years = data.categories("year").astype(int)[data.codes("year")]
+    groups = load_groups()
+    return years if groups is None else years[groups["representatives"]]
+
+def fit_chain(windows, k, processed_file="data/processed-data.pkl", engine="minibatch", seed=0, threads=1):
+    """
+
+    Parameters
+    ----------
+    windows : list of (first year, last year, row indices) fitted in order
+    k : number of clusters
+    processed_file : features (TF-IDF matrix or LSA embedding)
+    engine : string. "minibatch" or "spherical", as in get_clusters
+    seed : random seed of the k-means++ start of the first window
+    threads : assignment threads of the spherical engine
+
+    Returns
+    -------
+    results : list of dictionaries (start, end, n, centers, sizes, score, iterations, fit_s) for each window
+
+    Runs in a worker process. The first window starts from k-means++, every later window from the centers
+    of the window before it, so it only has to adjust the previous clustering to the years that changed.
+    Windows with fewer than k awards are skipped and the next window starts from the last fitted centers.
+    BLAS and OpenMP are limited to one thread, since the chains already run in parallel processes.
+    """
+    from sklearn.cluster import MiniBatchKMeans
+    import sklearn.metrics as metrics
+    from threadpoolctl import threadpool_limits
+    from spherical_kmeans import SphericalKMeans
+
+    features = load_features(processed_file)
+    groups = load_groups()
+    metric = "cosine" if engine == "spherical" else "euclidean"
+    centers = None
+    results = []
+    with threadpool_limits(limits=1):
+        for first, last, rows in windows:
+            result = {"start": first, "end": last, "n": len(rows), "centers": None}
+            results.append(result)
+            if len(rows) < k:
+                continue
+            X = features[rows]
+            weights = None if groups is None else groups["weights"][rows]
+            init = 'k-means++' if centers is None else centers
+            if engine == "spherical":
+                km = SphericalKMeans(n_clusters=k, init=init, random_state=seed, n_jobs=threads)
+            else:
+                # Early stopping (unlike get_clusters), so a warm start stops as soon as the centers settle
+                km = MiniBatchKMeans(n_clusters=k, init=init, n_init=1, random_state=seed)
+            start = time.perf_counter()
+            labels = km.fit_predict(X, sample_weight=weights)
+            result["fit_s"] = time.perf_counter() - start
+            centers = km.cluster_centers_
+            sizes = np.bincount(labels, weights=weights, minlength=k)
+            # Silhouette of a sample, the full score is quadratic in the window size
+            score = metrics.silhouette_score(X, labels, metric=metric, sample_size=min(len(rows), 2000), random_state=seed) if len(set(labels)) > 1 else 0.0
+            result.update({"centers": centers, "sizes": sizes.astype(int), "score": float(score),
+                           "iterations": int(km.n_iter_), "warm_start": not isinstance(init, str)})
+    return results
+
+def link_windows(previous, current, threshold=0.5):
+    """
+
+    Parameters
+    ----------
+    previous : centers of a window (k x features)
+    current : centers of the next window
+    threshold : minimum cosine similarity of a cluster with its parent
+
+    Returns
+    -------
+    parent : most similar cluster of the previous window for each current cluster (-1 below threshold)
+    similarity : cosine similarity with the parent (with the most similar previous cluster when there is none)
+    event : "continues", "split" (its parent has other children), "merge" (it is the closest successor
+        of more than one previous cluster) or "new"
+
+    """
+    unit = lambda centers: centers / np.maximum(np.linalg.norm(centers, axis=1, keepdims=True), 1e-12)
+    S = unit(previous) @ unit(current).T
+    best = np.argmax(S, axis=0)
+    similarity = S[best, np.arange(S.shape[1])]
+    parent = np.where(similarity >= threshold, best, -1)
+    successor = np.where(S.max(axis=1) >= threshold, np.argmax(S, axis=1), -1)
+    children = np.bincount(parent[parent >= 0], minlength=S.shape[0])
+    predecessors = np.bincount(successor[successor >= 0], minlength=S.shape[1])
+    event = np.where(parent < 0, "new", np.where(predecessors > 1, "merge",
+                     np.where(children[np.maximum(parent, 0)] > 1, "split", "continues")))
+    return parent, similarity, event
+
+def topic_evolution(k, window=5, step=1, start_year=None, end_year=None, processed_file="data/processed-data.pkl",
+                    engine="minibatch", jobs=None, threshold=0.5, save_folder=None, seed=0):
+    """
+
+    Parameters
+    ----------
+    k : number of clusters per window
+    window : number of fiscal years per window
+    step : years between the first years of consecutive windows
+    start_year, end_year : first and last fiscal year of the sweep (default those of the corpus)
+    processed_file : features (TF-IDF matrix or LSA embedding)
+    engine : string. "minibatch" or "spherical"
+    jobs : number of worker processes (default the number of CPUs, at most half the number of windows)
+    threshold : minimum cosine similarity of linked clusters
+    save_folder : string. optional directory for lineage.csv, windows.json and centers.npz
+    seed : random seed
+
+    Returns
+    -------
+    lineage : list of dictionaries, one per cluster of each window: its size, top terms, topic, parent
+        cluster in the previous window, similarity and event
+    windows : list of dictionaries with the years, size, silhouette and fit time of each window
+
+    The windows are cut into one contiguous chain per worker and the chains are fitted in parallel, each
+    window warm-started from the centers of the window before it in its chain. Only the first window of
+    each chain starts from k-means++. Every window shares the vocabulary of the full corpus, so clusters
+    of consecutive windows (across chains too) are linked by the cosine similarity of their centroids.
+    A topic keeps its id in the most similar child of its cluster, so every topic id appears at most once per window.
+    """
+    import pickle
+    from concurrent.futures import ProcessPoolExecutor
+
+    years = row_years()
+    spans = sliding_windows(years, window, step, start_year, end_year)
+    windows = [(first, last, np.flatnonzero((years >= first) & (years <= last))) for first, last in spans]
+    # At least two windows per chain, so every chain warm-starts
+    jobs = max(1, min(jobs if jobs is not None else os.cpu_count(), len(windows) // 2))
+    chains = [[windows[i] for i in chain] for chain in np.array_split(np.arange(len(windows)), jobs) if len(chain) > 0]
+    threads = max(1, os.cpu_count() // len(chains))
+    print("Clustering {} windows of {} years in {} chains...".format(len(windows), window, len(chains)))
+
+    with perf.timer("evolution/fit", items=len(windows)):
+        with ProcessPoolExecutor(max_workers=len(chains)) as executor:
+            futures = [executor.submit(fit_chain, chain, k, processed_file, engine, seed, threads) for chain in chains]
+            results = [result for future in futures for result in future.result()]
+
+    vectorizer = pickle.load(open("data/vectorizer.pkl","rb"))
+    terms = vectorizer.get_feature_names_out()
+    lineage, summary = [], []
+    previous, topics, next_topic = None, None, 0
+    with perf.timer("evolution/link", items=len(results)):
+        for w, result in enumerate(results):
+            name = "{}-{}".format(result["start"], result["end"])
+            summary.append({"window": name, "start": result["start"], "end": result["end"], "n": result["n"],
+                            "fitted": result["centers"] is not None, "warm_start": result.get("warm_start", False),
+                            "silhouette": result.get("score"), "iterations": result.get("iterations"), "fit_s": result.get("fit_s")})
+            if result["centers"] is None:
+                continue
+            centers = result["centers"]
+            top = term_weights(centers, processed_file).argsort()[:, ::-1][:, :5]
+            if previous is None:
+                parent, similarity, event = np.full(k, -1), np.zeros(k), np.full(k, "new")
+            else:
+                parent, similarity, event = link_windows(previous, centers, threshold)
+            # Topic ids: the most similar child of each parent keeps its topic, the other children get new ones
+            current = np.full(k, -1)
+            for j in np.argsort(-similarity):
+                if parent[j] >= 0 and topics[parent[j]] not in current:
+                    current[j] = topics[parent[j]]
+                else:
+                    current[j], next_topic = next_topic, next_topic + 1
+            for j in range(k):
+                lineage.append({"window": name, "start": result["start"], "end": result["end"], "cluster": j,
+                                "size": int(result["sizes"][j]), "share": round(float(result["sizes"][j] / max(result["sizes"].sum(), 1)), 4),
+                                "terms": ", ".join(terms[top[j]]), "topic": int(current[j]), "parent": int(parent[j]),
+                                "similarity": round(float(similarity[j]), 4), "event": str(event[j])})
+            previous, topics = centers, current
+
+    if save_folder is not None:
+        os.makedirs(save_folder, exist_ok=True)
+        with open("{}/lineage.csv".format(save_folder), 'w', newline='', encoding='utf8') as csvfile:
+            writer = csv.DictWriter(csvfile, list(lineage[0].keys()) if lineage else [])
+            writer.writeheader()
+            writer.writerows(lineage)
+        with open("{}/windows.json".format(save_folder), "w", encoding="utf8") as f:
+            json.dump({"k": k, "window": window, "step": step, "engine": engine, "features": processed_file,
+                       "threshold": threshold, "chains": len(chains), "windows": summary}, f, indent=1)
+        np.savez("{}/centers.npz".format(save_folder), **{"{}-{}".format(r["start"], r["end"]): r["centers"]
+                                                           for r in results if r["centers"] is not None})
+    return lineage, summary
+
+def new_evolution_folder():
+    """
+    Creates results/<timestamp>-evolution for a new sweep
+    """
+    from datetime import datetime
+    save_folder = "results/{}-evolution".format(datetime.now().strftime("%m-%d-%Y--%H%M%S"))
+    os.makedirs(save_folder)
+    return save_folder
+
+def print_evolution(lineage, summary):
+    """
+    Windows with their silhouettes, then the topics that appear, split or merge
+    """
+    for entry in summary:
+        if entry["fitted"]:
+            print("{window}: {n} awards, silhouette {silhouette:.3f}, {iterations} iterations, {fit_s:.2f}s".format(**entry))
+        else:
+            print("{window}: {n} awards, skipped".format(**entry))
+    first = lineage[0]["window"] if lineage else None
+    for row in lineage:
+        if row["window"] != first and row["event"] != "continues":
+            print("  {window} topic {topic:>3} {event:<6} (parent {parent}, similarity {similarity:.2f}) {terms}".format(**row))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--k', type=int, required=True, help='number of clusters per window')
+    parser.add_argument('--window', type=int, default=5, help='fiscal years per window')
+    parser.add_argument('--step', type=int, default=1, help='years between consecutive windows')
+    parser.add_argument('--start_year', type=int, default=None, help='first fiscal year (default the first of the corpus)')
+    parser.add_argument('--end_year', type=int, default=None, help='last fiscal year (default the last of the corpus)')
+    parser.add_argument('--features', type=str, default="data/processed-data.pkl", help='features to cluster (data/processed-data.pkl or data/lsa-embedding.npy)')
+    parser.add_argument('--engine', type=str, default="minibatch", help='k-means engine (minibatch, spherical)')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default the number of CPUs, at most half the number of windows)')
+    parser.add_argument('--threshold', type=float, default=0.5, help='minimum centroid cosine similarity of linked clusters')
+    parser.add_argument('--results', type=str, default=None, help='output directory (default results/<timestamp>-evolution)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    FLAGS, unparsed = parser.parse_known_args()
+
+    save_folder = FLAGS.results if FLAGS.results is not None else new_evolution_folder()
+    lineage, summary = topic_evolution(FLAGS.k, FLAGS.window, FLAGS.step, FLAGS.start_year, FLAGS.end_year, FLAGS.features,
+                                       FLAGS.engine, FLAGS.jobs, FLAGS.threshold, save_folder, FLAGS.seed)
+    print_evolution(lineage, summary)
+    perf.save("{}/perf.json".format(save_folder))
+    print("Results: {}".format(save_folder))